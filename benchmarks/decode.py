@@ -0,0 +1,51 @@
+import glob
+import gzip
+import json
+import sys
+import time
+from typing import Callable, List
+
+from motogp.archive import ARCHIVE_PATH
+from motogp.decode import backend, decode_classification
+from motogp.model import Classification, Task
+
+ROUNDS = 5
+
+
+def load_corpus(path: str) -> List[bytes]:
+    pattern = f"{path}/**/classification-*.json.gz"
+    corpus = []
+    for filename in sorted(glob.glob(pattern, recursive=True)):
+        with gzip.open(filename, "rb") as f:
+            corpus.append(f.read())
+
+    return corpus
+
+
+def best_of(fn: Callable, corpus: List[bytes]) -> float:
+    best = None
+    for _ in range(ROUNDS):
+        start = time.perf_counter()
+        for content in corpus:
+            fn(content)
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+
+    return best
+
+
+if __name__ == "__main__":
+    path = sys.argv[1] if len(sys.argv) > 1 else ARCHIVE_PATH
+    corpus = load_corpus(path)
+    if not corpus:
+        sys.exit(f"no archived classification payloads found under {path}")
+
+    task = Task("bench", "season", "event", "category", "session")
+    size = sum(len(content) for content in corpus)
+    rows = sum(len(decode_classification(content)) for content in corpus)
+    print(f"{len(corpus)} payloads, {size / 1e6:.1f} MB, {rows} results")
+
+    baseline = best_of(lambda c: Classification.from_req(json.loads(c), task), corpus)
+    fast = best_of(lambda c: Classification.from_bytes(c, task), corpus)
+    print(f"json + from_req:      {baseline:.3f}s")
+    print(f"from_bytes ({backend()}): {fast:.3f}s ({baseline / fast:.1f}x)")
@@ -0,0 +1,139 @@
+import json
+import multiprocessing
+import resource
+import sys
+import tracemalloc
+import uuid
+from dataclasses import dataclass
+from typing import List
+
+from motogp.model import Classification, Task, TaskStatus
+
+# roughly the shape of the full history of the api
+SEASONS = 76
+EVENTS = 18
+CATEGORIES = 3
+SESSIONS = 4
+RIDERS = 25
+COUNTRIES = ["Italy", "Spain", "France", "Japan", "Australia", "Portugal"]
+
+
+# the plain dataclasses the model used before
+@dataclass
+class PlainTask:
+    id: str
+    season_id: str
+    event_id: str
+    category_id: str
+    session_id: str
+    status: TaskStatus = TaskStatus.NEW
+    attempt: int = 0
+
+
+@dataclass
+class PlainRider:
+    id: str
+    name: str
+    country: str
+    number: int
+    team: str
+
+
+@dataclass
+class PlainRiderResult:
+    rider: PlainRider
+    position: int
+    points: int
+
+
+def task_rows():
+    # fresh strings per row, like rows read back from sqlite
+    for s in range(SEASONS):
+        for e in range(EVENTS):
+            for c in range(CATEGORIES):
+                for _ in range(SESSIONS):
+                    yield (
+                        str(uuid.uuid4()),
+                        f"season-{s:04d}",
+                        f"event-{s:04d}-{e:02d}",
+                        f"category-{c:02d}",
+                        str(uuid.uuid4()),
+                        0,
+                        0,
+                    )
+
+
+def payload(seed: int) -> bytes:
+    return json.dumps(
+        {
+            "classification": [
+                {
+                    "rider": {
+                        "id": f"rider-{(seed + i) % 3000}",
+                        "full_name": f"Rider {(seed + i) % 3000}",
+                        "country": {"name": COUNTRIES[(seed + i) % len(COUNTRIES)]},
+                        "number": i,
+                    },
+                    "team": {"name": f"Team {(seed + i) % 40}"},
+                    "position": i + 1,
+                    "points": max(25 - i, 0),
+                }
+                for i in range(RIDERS)
+            ]
+        }
+    ).encode()
+
+
+def build(variant: str) -> List:
+    objects = []
+    for i, row in enumerate(task_rows()):
+        if variant == "slots":
+            task = Task.from_row(row)
+            results = Classification.from_bytes(payload(i), task).results
+        else:
+            task = PlainTask(*row[:5], TaskStatus(row[5]), row[6])
+            results = [
+                PlainRiderResult(
+                    PlainRider(
+                        r["rider"]["id"],
+                        r["rider"]["full_name"],
+                        r["rider"]["country"]["name"],
+                        r["rider"]["number"],
+                        r["team"]["name"],
+                    ),
+                    r["position"],
+                    r["points"],
+                )
+                for r in json.loads(payload(i))["classification"]
+            ]
+        objects.append((task, results))
+
+    return objects
+
+
+def measure(variant: str, out: multiprocessing.Queue):
+    tracemalloc.start()
+    objects = build(variant)
+    current, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    count = sum(1 + 2 * len(results) for _, results in objects)
+    # ru_maxrss is in kilobytes on linux
+    peak_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+    out.put((variant, count, current, peak_rss))
+
+
+if __name__ == "__main__":
+    variants = sys.argv[1:] or ["plain", "slots"]
+    # one process per variant so the peak rss of one does not hide the other
+    ctx = multiprocessing.get_context("spawn")
+    out = ctx.Queue()
+    for variant in variants:
+        process = ctx.Process(target=measure, args=(variant, out))
+        process.start()
+        variant, count, current, peak_rss = out.get()
+        process.join()
+        print(
+            f"{variant:>6}: {count} objects, {current / count:.0f} B/object, "
+            f"{current / 1e6:.0f} MB live, {peak_rss / 1e6:.0f} MB peak rss"
+        )
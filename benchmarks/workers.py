@@ -0,0 +1,126 @@
+import asyncio
+import json
+import sys
+import tempfile
+import time
+from typing import List
+
+from motogp.archive import Archive
+from motogp.database import close_connections, setup_duckdb, setup_sqlite
+from motogp.model import FACT_COLUMNS, ClassificationBatch, Task, TaskQueue
+from motogp.workers import SHARD_SIZE, Coordinator, shard_tasks
+
+SEASONS = 10
+EVENTS = 18
+CATEGORIES = 3
+SESSIONS = 4
+RIDERS = 25
+PROCESSES = [1, 2, 4]
+
+
+def classification(session: int) -> bytes:
+    return json.dumps(
+        {
+            "classification": [
+                {
+                    "rider": {
+                        "id": f"r{i}",
+                        "full_name": f"Rider {i}",
+                        "country": {"name": "Italy"},
+                        "number": i,
+                    },
+                    "team": {"name": f"Team {i}"},
+                    "position": i,
+                    "points": max(25 - i, 0) if session % SESSIONS == 0 else None,
+                }
+                for i in range(1, RIDERS + 1)
+            ]
+        }
+    ).encode()
+
+
+def write_archive(path: str) -> List[Task]:
+    archive = Archive(path)
+    tasks = []
+    for s in range(SEASONS):
+        for e in range(EVENTS):
+            for c in range(CATEGORIES):
+                for i in range(SESSIONS):
+                    session_id = f"s{s}-e{e}-c{c}-{i}"
+                    task = Task(session_id, f"s{s}", f"s{s}-e{e}", f"c{c}", session_id)
+                    archive.write(
+                        archive.classification_path(
+                            task.season_id, task.event_id, session_id
+                        ),
+                        classification(i),
+                    )
+                    tasks.append(task)
+
+    return tasks
+
+
+def shard_batches(tasks: List[Task]) -> List[ClassificationBatch]:
+    rows = [
+        (f"r{i}", f"Rider {i}", "Italy", i, f"Team {i}", i, 25.0)
+        for i in range(1, RIDERS + 1)
+    ]
+    batches = []
+    for shard in shard_tasks(tasks, SHARD_SIZE):
+        batch = ClassificationBatch()
+        for t in shard:
+            batch.add(t.season_id, t.event_id, t.category_id, t.session_id, rows)
+        batches.append(batch)
+
+    return batches
+
+
+def bench_merge(tasks: List[Task]):
+    batches = shard_batches(tasks)
+
+    start = time.perf_counter()
+    merged = ClassificationBatch()
+    for batch in batches:
+        # the row by row merge the coordinator did before
+        merged.riders.update(batch.riders)
+        for row in zip(*[batch.facts[column] for column in FACT_COLUMNS]):
+            merged.put(row)
+    put = time.perf_counter() - start
+
+    start = time.perf_counter()
+    merged = ClassificationBatch()
+    for batch in batches:
+        merged.extend(batch.facts, batch.riders)
+    extend = time.perf_counter() - start
+
+    print(f"merge {merged.size} rows of {len(batches)} shards")
+    print(f"  put per row: {put:.3f}s")
+    print(f"  extend:      {extend:.3f}s ({put / extend:.1f}x)")
+
+
+def bench_coordinator(tasks: List[Task], path: str, processes: int) -> float:
+    setup_duckdb(True)
+    setup_sqlite(True)
+    TaskQueue.from_list(tasks).sync()
+
+    coordinator = Coordinator(processes, archive_path=path, replay=True)
+    start = time.perf_counter()
+    asyncio.run(coordinator.run())
+    return time.perf_counter() - start
+
+
+if __name__ == "__main__":
+    processes = [int(p) for p in sys.argv[1:]] or PROCESSES
+    with tempfile.TemporaryDirectory() as path:
+        tasks = write_archive(path)
+        print(f"{len(tasks)} sessions, {len(tasks) * RIDERS} results")
+        bench_merge(tasks)
+
+        baseline = None
+        for n in processes:
+            elapsed = bench_coordinator(tasks, path, n)
+            baseline = baseline if baseline is not None else elapsed
+            print(
+                f"coordinator, {n} processes: {elapsed:.3f}s ({baseline / elapsed:.1f}x)"
+            )
+
+    close_connections()
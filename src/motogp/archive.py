@@ -0,0 +1,84 @@
+import glob
+import gzip
+import os
+
+ARCHIVE_PATH = "data-lake/bronze/api"
+UNKNOWN_SEASON = "unknown"
+
+
+# a payload asked for in replay that was never archived
+class ArchiveMiss(Exception):
+    pass
+
+
+# raw api payloads, gzipped under season=<id>/event=<id>, read back in replay
+class Archive:
+    def __init__(self, path: str = ARCHIVE_PATH, replay: bool = False):
+        self.path = path
+        self.replay = replay
+
+    def event_dir(self, season_id: str, event_id: str) -> str:
+        if season_id is None:
+            # callers that only know the event find it under any season
+            matches = glob.glob(os.path.join(self.path, "*", f"event={event_id}"))
+            if matches:
+                return matches[0]
+
+            season_id = UNKNOWN_SEASON
+
+        return os.path.join(self.path, f"season={season_id}", f"event={event_id}")
+
+    def seasons_path(self) -> str:
+        return os.path.join(self.path, "seasons.json.gz")
+
+    def events_path(self, season_id: str) -> str:
+        return os.path.join(self.path, f"season={season_id}", "events.json.gz")
+
+    def categories_path(self, season_id: str, event_id: str) -> str:
+        return os.path.join(self.event_dir(season_id, event_id), "categories.json.gz")
+
+    def sessions_path(self, season_id: str, event_id: str, category_id: str) -> str:
+        return os.path.join(
+            self.event_dir(season_id, event_id), f"sessions-{category_id}.json.gz"
+        )
+
+    def classification_path(
+        self, season_id: str, event_id: str, session_id: str
+    ) -> str:
+        return os.path.join(
+            self.event_dir(season_id, event_id),
+            f"classification-{session_id}.json.gz",
+        )
+
+    def write(self, path: str, content: bytes):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp = f"{path}.{os.getpid()}.tmp"
+        with gzip.open(tmp, "wb") as f:
+            f.write(content)
+
+        os.replace(tmp, path)
+
+    def read(self, path: str) -> bytes:
+        try:
+            with gzip.open(path, "rb") as f:
+                return f.read()
+        except FileNotFoundError:
+            raise ArchiveMiss(path) from None
+
+
+_archive: Archive = None
+
+
+def setup_archive(**kwargs) -> Archive:
+    global _archive
+    _archive = Archive(**kwargs)
+    return _archive
+
+
+def get_archive() -> Archive:
+    return _archive
+
+
+def close_archive():
+    global _archive
+    _archive = None
@@ -0,0 +1,154 @@
+from dataclasses import dataclass
+import os
+import re
+import sqlite3
+import threading
+import time
+from typing import Dict, List, Tuple
+
+import httpx
+
+
+@dataclass
+class CachePolicy:
+    # seconds a stored response is served without asking the api again
+    ttl: float
+    # immutable responses are never revalidated once stored settled, before
+    # that they are kept for ttl like any other
+    immutable: bool = False
+
+
+HOUR = 3600.0
+DAY = 24 * HOUR
+
+# results may still be corrected in the days after an event, a classification
+# is only stored settled when fetched SETTLE_DAYS after its event ended
+POLICIES: List[Tuple[str, CachePolicy]] = [
+    ("/classification", CachePolicy(ttl=HOUR, immutable=True)),
+    ("/categories", CachePolicy(ttl=DAY)),
+    ("/sessions", CachePolicy(ttl=HOUR)),
+    ("/events", CachePolicy(ttl=HOUR)),
+    ("/seasons", CachePolicy(ttl=HOUR)),
+]
+
+
+CREATE_RESPONSES = """\
+CREATE TABLE IF NOT EXISTS responses (
+    url TEXT PRIMARY KEY,
+    content BLOB,
+    content_type TEXT,
+    etag TEXT,
+    last_modified TEXT,
+    fetched_timestamp REAL,
+    settled INTEGER
+)"""
+
+
+def policy_for(url: str) -> CachePolicy:
+    for pattern, policy in POLICIES:
+        if re.search(pattern, url):
+            return policy
+
+    return None
+
+
+@dataclass
+class CachedResponse:
+    url: str
+    content: bytes
+    content_type: str
+    etag: str
+    last_modified: str
+    fetched_timestamp: float
+    settled: bool = False
+
+    def is_fresh(self, policy: CachePolicy, now: float = None) -> bool:
+        now = now if now is not None else time.time()
+        if policy.immutable and self.settled:
+            return True
+
+        return now - self.fetched_timestamp < policy.ttl
+
+    def validators(self) -> Dict[str, str]:
+        headers = {}
+        if self.etag:
+            headers["if-none-match"] = self.etag
+        if self.last_modified:
+            headers["if-modified-since"] = self.last_modified
+
+        return headers
+
+    def response(self) -> httpx.Response:
+        headers = {"content-type": self.content_type} if self.content_type else {}
+        return httpx.Response(
+            200,
+            content=self.content,
+            headers=headers,
+            request=httpx.Request("GET", self.url),
+            # tells callers nothing was downloaded
+            extensions={"from_cache": True},
+        )
+
+
+# http responses by url, served or revalidated as the endpoint's CachePolicy says
+class ResponseCache:
+    def __init__(self, filename: str = None):
+        if filename is None:
+            test = os.getenv("MOTOGP_ENV").lower() == "test"
+            filename = "test-cache.db" if test else "cache.db"
+
+        self.lock = threading.Lock()
+        self.conn = sqlite3.connect(filename, check_same_thread=False)
+        self.conn.execute("PRAGMA journal_mode = WAL")
+        self.conn.execute("PRAGMA synchronous = NORMAL")
+        self.conn.execute(CREATE_RESPONSES)
+        columns = [row[1] for row in self.conn.execute("PRAGMA table_info(responses)")]
+        if "settled" not in columns:
+            self.conn.execute("ALTER TABLE responses ADD COLUMN settled INTEGER")
+        self.conn.commit()
+
+    def lookup(self, url: str) -> CachedResponse:
+        with self.lock:
+            res = self.conn.execute(
+                """\
+SELECT url, content, content_type, etag, last_modified, fetched_timestamp, settled
+FROM responses
+WHERE url = ?""",
+                [url],
+            ).fetchone()
+
+        if res is None:
+            return None
+
+        *columns, settled = res
+        return CachedResponse(*columns, bool(settled))
+
+    def store(self, res: httpx.Response, settled: bool = False):
+        with self.lock:
+            self.conn.execute(
+                """\
+INSERT OR REPLACE INTO responses (url, content, content_type, etag, last_modified, fetched_timestamp, settled)
+VALUES (?, ?, ?, ?, ?, ?, ?)""",
+                [
+                    str(res.request.url),
+                    res.content,
+                    res.headers.get("content-type"),
+                    res.headers.get("etag"),
+                    res.headers.get("last-modified"),
+                    time.time(),
+                    settled,
+                ],
+            )
+            self.conn.commit()
+
+    def touch(self, url: str, settled: bool = False):
+        with self.lock:
+            self.conn.execute(
+                "UPDATE responses SET fetched_timestamp = ?, settled = ? WHERE url = ?",
+                [time.time(), settled, url],
+            )
+            self.conn.commit()
+
+    def close(self):
+        with self.lock:
+            self.conn.close()
@@ -0,0 +1,257 @@
+import asyncio
+import importlib.util
+import logging
+import threading
+import time
+from typing import Tuple
+
+import httpx
+
+from motogp.cache import CachePolicy, CachedResponse, ResponseCache, policy_for
+from motogp.metrics import get_metrics
+from motogp.ratelimit import AdaptiveLimiter, parse_retry_after
+
+DEFAULT_TIMEOUT = 10.0
+DEFAULT_MAX_CONNECTIONS = 20
+DEFAULT_MAX_KEEPALIVE_CONNECTIONS = 10
+DEFAULT_KEEPALIVE_EXPIRY = 30.0
+
+
+def http2_available() -> bool:
+    # httpx only speaks http/2 when the optional h2 package is installed
+    return importlib.util.find_spec("h2") is not None
+
+
+def endpoint_name(url: str) -> str:
+    # seasons, events, categories, sessions or classification
+    return httpx.URL(url).path.rsplit("/", 1)[-1]
+
+
+# pooled sync and async http clients behind the limiter and the response cache,
+# a refreshing client stores responses but never serves them
+class Client:
+    def __init__(
+        self,
+        max_connections: int = DEFAULT_MAX_CONNECTIONS,
+        max_keepalive_connections: int = DEFAULT_MAX_KEEPALIVE_CONNECTIONS,
+        keepalive_expiry: float = DEFAULT_KEEPALIVE_EXPIRY,
+        timeout: float = DEFAULT_TIMEOUT,
+        http2: bool = True,
+        transport: httpx.BaseTransport = None,
+        async_transport: httpx.AsyncBaseTransport = None,
+        limiter: AdaptiveLimiter = None,
+        cache: ResponseCache = None,
+        refresh: bool = False,
+    ):
+        self.limits = httpx.Limits(
+            max_connections=max_connections,
+            max_keepalive_connections=max_keepalive_connections,
+            keepalive_expiry=keepalive_expiry,
+        )
+        self.timeout = timeout
+        self.http2 = http2 and http2_available()
+        self.transport = transport
+        self.async_transport = async_transport
+        self.limiter = limiter if limiter is not None else AdaptiveLimiter()
+        self.cache = cache
+        self.refresh = refresh
+
+        self._sync_client = None
+        self._async_client = None
+        self._async_loop = None
+
+    @property
+    def sync_client(self) -> httpx.Client:
+        if self._sync_client is None:
+            self._sync_client = httpx.Client(
+                limits=self.limits,
+                timeout=self.timeout,
+                http2=self.http2,
+                transport=self.transport,
+            )
+
+        return self._sync_client
+
+    @property
+    def async_client(self) -> httpx.AsyncClient:
+        # pooled connections are bound to the loop that opened them
+        loop = asyncio.get_running_loop()
+        if self._async_client is None or self._async_loop is not loop:
+            self.discard_async_client()
+            self._async_client = httpx.AsyncClient(
+                limits=self.limits,
+                timeout=self.timeout,
+                http2=self.http2,
+                transport=self.async_transport,
+            )
+            self._async_loop = loop
+
+        return self._async_client
+
+    def get(self, url: str, settled: bool = False) -> httpx.Response:
+        policy, cached = self.lookup(url)
+        if cached and cached.is_fresh(policy):
+            get_metrics().inc("motogp_cache_hits_total", endpoint=endpoint_name(url))
+            return cached.response()
+
+        headers = cached.validators() if cached else {}
+        with self.limiter.acquire_sync():
+            start = time.monotonic()
+            try:
+                res = self.sync_client.get(url, headers=headers)
+            except httpx.TransportError:
+                self.limiter.record(time.monotonic() - start)
+                get_metrics().inc(
+                    "motogp_http_requests_total",
+                    endpoint=endpoint_name(url),
+                    status="error",
+                )
+                raise
+            latency = time.monotonic() - start
+
+        self.record(res, latency)
+        return self.revalidate(res, policy, cached, settled)
+
+    async def async_get(self, url: str, settled: bool = False) -> httpx.Response:
+        policy, cached = None, None
+        if self.cache is not None:
+            # sqlite reads and writes of the cache run on threads
+            policy, cached = await asyncio.to_thread(self.lookup, url)
+
+        if cached and cached.is_fresh(policy):
+            get_metrics().inc("motogp_cache_hits_total", endpoint=endpoint_name(url))
+            return cached.response()
+
+        headers = cached.validators() if cached else {}
+        async with self.limiter.acquire():
+            start = time.monotonic()
+            try:
+                res = await self.async_client.get(url, headers=headers)
+            except httpx.TransportError:
+                self.limiter.record(time.monotonic() - start)
+                get_metrics().inc(
+                    "motogp_http_requests_total",
+                    endpoint=endpoint_name(url),
+                    status="error",
+                )
+                raise
+            latency = time.monotonic() - start
+
+        self.record(res, latency)
+        if policy is None:
+            return res
+
+        return await asyncio.to_thread(self.revalidate, res, policy, cached, settled)
+
+    def lookup(self, url: str) -> Tuple[CachePolicy, CachedResponse]:
+        policy = policy_for(url) if self.cache else None
+        if policy is None or self.refresh:
+            return policy, None
+
+        return policy, self.cache.lookup(url)
+
+    def revalidate(
+        self,
+        res: httpx.Response,
+        policy: CachePolicy,
+        cached: CachedResponse,
+        settled: bool = False,
+    ) -> httpx.Response:
+        if policy is None:
+            return res
+
+        if res.status_code == 304 and cached:
+            self.cache.touch(cached.url, settled)
+            return cached.response()
+
+        if res.status_code == 200:
+            self.cache.store(res, settled)
+
+        return res
+
+    def record(self, res: httpx.Response, latency: float):
+        retry_after = parse_retry_after(res.headers.get("retry-after"))
+        self.limiter.record(latency, res.status_code, retry_after)
+
+        metrics = get_metrics()
+        endpoint = endpoint_name(str(res.request.url))
+        metrics.inc(
+            "motogp_http_requests_total", endpoint=endpoint, status=res.status_code
+        )
+        metrics.observe("motogp_http_request_seconds", latency, endpoint=endpoint)
+
+    def discard_async_client(self):
+        # an async client can only be closed on the loop that opened it
+        client, loop = self._async_client, self._async_loop
+        self._async_client = None
+        self._async_loop = None
+        if client is None:
+            return None
+
+        if loop.is_closed():
+            # its sockets are only released when garbage collected, callers
+            # have to close_client() before their loop ends
+            logging.getLogger("client").warning(
+                "async client outlived its event loop and could not be closed"
+            )
+        elif loop.is_running():
+            asyncio.run_coroutine_threadsafe(client.aclose(), loop)
+        else:
+            # on its own thread, the caller may be inside another loop
+            thread = threading.Thread(
+                target=loop.run_until_complete, args=(client.aclose(),)
+            )
+            thread.start()
+            thread.join()
+
+    def close(self):
+        if self._sync_client is not None:
+            self._sync_client.close()
+            self._sync_client = None
+
+        if self.cache is not None:
+            self.cache.close()
+            self.cache = None
+
+        self.discard_async_client()
+
+    async def aclose(self):
+        if self._async_client is not None:
+            if self._async_loop is asyncio.get_running_loop():
+                await self._async_client.aclose()
+                self._async_client = None
+                self._async_loop = None
+
+        self.close()
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *_):
+        await self.aclose()
+
+
+_client: Client = None
+
+
+def setup_client(**kwargs) -> Client:
+    global _client
+    if _client is not None:
+        _client.close()
+
+    _client = Client(**kwargs)
+    return _client
+
+
+def get_client() -> Client:
+    if _client is None:
+        return setup_client()
+
+    return _client
+
+
+async def close_client():
+    global _client
+    if _client is not None:
+        await _client.aclose()
+        _client = None
@@ -1,75 +1,277 @@
 import asyncio
+import os
+import socket
 import sys
+import time
+import uuid
+from typing import List, Tuple
 
 import httpx
 
-from motogp.database import export_results
+from motogp.archive import ArchiveMiss, setup_archive, close_archive
+from motogp.cache import ResponseCache
+from motogp.client import setup_client, close_client
+from motogp.database import close_connections
+from motogp.export import compact_results, export_incremental
 from motogp.logger import setup_logger
-from motogp.model import TaskStatus, TaskQueue
-from motogp.endpoints import async_get_classification
+from motogp.metrics import SIZE_BUCKETS, close_metrics, get_metrics, setup_metrics
+from motogp.model import (
+    LEASE_SECONDS,
+    ClassificationBatch,
+    StatusRecorder,
+    Task,
+    TaskStatus,
+    TaskQueue,
+)
+from motogp.decode import ResultRow
+from motogp.endpoints import async_get_results
 
 
 class SyncError(Exception):
     pass
 
 
+WRITE_BATCH_SIZE = 50
+WRITE_FLUSH_INTERVAL = 1.0
+CLAIM_BATCH_SIZE = 100
+HEARTBEAT_INTERVAL = LEASE_SECONDS / 3
+MAX_RETRY_WAIT = 300.0
+# client errors other than these will not succeed on a retry
+RETRYABLE_STATUS_CODES = {408, 425, 429, 500, 502, 503, 504}
+
+
 # scrape
-async def consumer(queue: asyncio.Queue):
-    while True:
-        logger = setup_logger("consumer")
-        task = await queue.get()
+async def fetch_results(task: Task) -> Tuple[List[ResultRow], TaskStatus]:
+    # decoded rows, or None and the status the failed task is recorded with
+    logger = setup_logger("consumer")
+    logger.info(
+        "requesting classification for session_id: %s",
+        task.session_id,
+    )
+
+    status = TaskStatus.ERROR
+    try:
+        rows = await async_get_results(task)
+    except httpx.HTTPStatusError as err:
+        rows = None
+        logger.error(f"http error: {err}")
+        if err.response.status_code not in RETRYABLE_STATUS_CODES:
+            status = TaskStatus.DEAD
+    except httpx.HTTPError as err:
+        rows = None
+        logger.error(f"http error: {err}")
+    except ArchiveMiss as err:
+        # replay has nothing to retry it from
+        rows = None
+        status = TaskStatus.DEAD
+        logger.error(f"classification not archived: {err}")
+    except Exception as err:
+        rows = None
+        logger.error(f"failed to parse classification: {err}")
 
-        logger.info(
-            "requesting classification for session_id: %s",
+    if rows is None:
+        logger.error(
+            "failed to get classification with session_id: %s",
             task.session_id,
         )
 
-        try:
-            classification = await async_get_classification(task)
-        except httpx.HTTPStatusError as err:
-            classification = None
-            logger.error(f"http error: {err}")
-
-        if not classification:
-            logger.error(
-                "failed to get classification with session_id: %s",
-                task.session_id,
-            )
-            task.upsert_status(TaskStatus.ERROR)
+    return rows, status
+
+
+async def consumer(
+    queue: asyncio.Queue, write_queue: asyncio.Queue, recorder: StatusRecorder
+):
+    metrics = get_metrics()
+    while True:
+        task = await queue.get()
+        metrics.gauge("motogp_queue_depth", queue.qsize(), queue="fetch")
+
+        rows, status = await fetch_results(task)
+        if rows is None:
+            recorder.record(task, status)
         else:
-            try:
-                classification.sync()
-                task.upsert_status(TaskStatus.COMPLETED)
-            except Exception as err:
-                logger.error(
-                    "failed to sync classification with session_id: %s",
-                    task.session_id,
-                )
-                task.upsert_status(TaskStatus.ERROR)
+            await write_queue.put((task, rows))
 
         queue.task_done()
 
 
-async def main(limit: int):
+def flush(batch: List[Tuple[Task, List[ResultRow]]], recorder: StatusRecorder):
+    results = ClassificationBatch()
+    for task, rows in batch:
+        results.add(
+            task.season_id, task.event_id, task.category_id, task.session_id, rows
+        )
+
+    write(results, [task for task, _ in batch], recorder)
+
+
+def write(results: ClassificationBatch, tasks: List[Task], recorder: StatusRecorder):
     logger = setup_logger("consumer")
-    logger.info("started consumer")
+    metrics = get_metrics()
+    try:
+        with metrics.timer("motogp_db_flush_seconds", target="classifications"):
+            results.sync()
+        metrics.observe(
+            "motogp_db_flush_rows", results.size, SIZE_BUCKETS, target="classifications"
+        )
+        status = TaskStatus.COMPLETED
+    except Exception as err:
+        logger.error(
+            "failed to sync classifications with session_ids: %s, %s",
+            [task.session_id for task in tasks],
+            err,
+        )
+        status = TaskStatus.ERROR
+
+    for task in tasks:
+        recorder.record(task, status)
+
+
+# load
+async def writer(
+    write_queue: asyncio.Queue,
+    recorder: StatusRecorder,
+    batch_size: int = WRITE_BATCH_SIZE,
+    flush_interval: float = WRITE_FLUSH_INTERVAL,
+):
+    loop = asyncio.get_running_loop()
+    metrics = get_metrics()
+    while True:
+        batch = [await write_queue.get()]
+        deadline = loop.time() + flush_interval
+        while len(batch) < batch_size:
+            timeout = deadline - loop.time()
+            if timeout <= 0:
+                break
+
+            try:
+                batch.append(await asyncio.wait_for(write_queue.get(), timeout))
+            except asyncio.TimeoutError:
+                break
+
+        metrics.gauge("motogp_queue_depth", write_queue.qsize(), queue="write")
+        # duckdb writes run off the event loop so fetching keeps going
+        await asyncio.to_thread(flush, batch, recorder)
 
-    queue = asyncio.Queue()
-    for i, task in enumerate(TaskQueue.from_db(TaskStatus.QUEUED).tasks):
-        queue.put_nowait(task)
-        task.upsert_status(TaskStatus.QUEUED)
+        for _ in batch:
+            write_queue.task_done()
 
-        if i > limit and limit > 0:
-            break
 
-    consumers = [asyncio.create_task(consumer(queue)) for _ in range(5)]
+async def heartbeat(worker_id: str, interval: float = HEARTBEAT_INTERVAL):
+    while True:
+        await asyncio.sleep(interval)
+        await asyncio.to_thread(TaskQueue.heartbeat, worker_id)
+
+
+def new_worker_id() -> str:
+    return f"{socket.gethostname()}-{os.getpid()}-{uuid.uuid4().hex[:8]}"
+
 
+def start_workers(
+    worker_id: str,
+    queue: asyncio.Queue,
+    write_queue: asyncio.Queue,
+    recorder: StatusRecorder,
+    concurrency: int,
+) -> List[asyncio.Task]:
+    # one worker per possible slot, the limiter decides how many of them
+    # have a request in flight at any time
+    consumers = [
+        asyncio.create_task(consumer(queue, write_queue, recorder))
+        for _ in range(concurrency)
+    ]
+    writers = [asyncio.create_task(writer(write_queue, recorder))]
+    recorders = [asyncio.create_task(recorder.run())]
+    heartbeats = [asyncio.create_task(heartbeat(worker_id))]
+    return consumers + writers + recorders + heartbeats
+
+
+async def stop_workers(
+    workers: List[asyncio.Task],
+    queue: asyncio.Queue,
+    write_queue: asyncio.Queue,
+    recorder: StatusRecorder,
+):
     await queue.join()
+    await write_queue.join()
+
+    for w in workers:
+        w.cancel()
+
+    await asyncio.to_thread(recorder.flush)
+
+
+async def claim_tasks(
+    worker_id: str,
+    limit: int,
+    queue: asyncio.Queue,
+    write_queue: asyncio.Queue,
+    recorder: StatusRecorder,
+) -> int:
+    logger = setup_logger("consumer")
+    claimed = 0
+    while limit <= 0 or claimed < limit:
+        size = (
+            CLAIM_BATCH_SIZE if limit <= 0 else min(CLAIM_BATCH_SIZE, limit - claimed)
+        )
+        tasks = await asyncio.to_thread(TaskQueue.claim, worker_id, size)
+        if tasks.size == 0:
+            # settle in-flight work so failed tasks have their retry time
+            await queue.join()
+            await write_queue.join()
+            await asyncio.to_thread(recorder.flush)
+
+            retry_at = await asyncio.to_thread(TaskQueue.next_attempt_timestamp)
+            if retry_at is None or retry_at - time.time() > MAX_RETRY_WAIT:
+                break
+
+            logger.info("waiting for retries due at: %s", retry_at)
+            await asyncio.sleep(max(retry_at - time.time(), 0))
+            continue
+
+        claimed += tasks.size
+        for task in tasks.tasks:
+            await queue.put(task)
+
+    return claimed
+
+
+def export():
+    logger = setup_logger("consumer")
+    logger.info("exported %s sessions", export_incremental())
+    compacted = compact_results()
+    if compacted:
+        logger.info("compacted %s partitions", compacted)
+
+
+async def main(limit: int, replay: bool = False, refresh: bool = False):
+    logger = setup_logger("consumer")
+    logger.info("started consumer")
+
+    client = setup_client(cache=ResponseCache(), refresh=refresh)
+    setup_archive(replay=replay)
+    setup_metrics()
+    try:
+        worker_id = new_worker_id()
+        logger.info("consumer worker_id: %s", worker_id)
+
+        queue = asyncio.Queue(maxsize=CLAIM_BATCH_SIZE)
+        write_queue = asyncio.Queue()
+        recorder = StatusRecorder()
+        workers = start_workers(
+            worker_id, queue, write_queue, recorder, client.limiter.max_concurrency
+        )
 
-    for c in consumers:
-        c.cancel()
+        await claim_tasks(worker_id, limit, queue, write_queue, recorder)
+        await stop_workers(workers, queue, write_queue, recorder)
+        logger.info("rate limits: %s", client.limiter.limits())
 
-    export_results()
+        export()
+    finally:
+        await close_client()
+        close_archive()
+        close_connections()
+        close_metrics()
 
     logger.info("finished consumer")
 
@@ -77,7 +279,8 @@ async def main(limit: int):
 if __name__ == "__main__":
     args = []
     file, limit, load_type, *args = sys.argv
+    replay = "replay" in args
     if load_type == "inc":
-        asyncio.run(main(limit=int(limit)))
+        asyncio.run(main(limit=int(limit), replay=replay))
     else:
-        asyncio.run(main(limit=int(limit)))
+        asyncio.run(main(limit=int(limit), replay=replay, refresh=True))
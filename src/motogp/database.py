@@ -1,12 +1,207 @@
+import contextlib
 import os
+import queue
+import threading
 import duckdb
 import sqlite3
 
+from motogp.standings import rebuild_standings
+
+SQLITE_POOL_SIZE = 4
+# columns added to tasks after the table was first released
+SQLITE_TASK_COLUMNS = {
+    "worker_id": "TEXT",
+    "lease_expires_timestamp": "REAL",
+    "heartbeat_timestamp": "REAL",
+    "next_attempt_timestamp": "REAL",
+    "event_end": "TEXT",
+}
+# claim / from_db, next_attempt_timestamp and heartbeat lookups
+SQLITE_TASK_INDEXES = {
+    "tasks_status_added": "status, added_timestamp",
+    "tasks_status_next_attempt": "status, next_attempt_timestamp",
+    "tasks_worker_id": "worker_id",
+    "tasks_session_id": "session_id",
+}
+# natural key of a classification row
+DUCKDB_FCT_KEY = ["session_id", "rider_id"]
+
+# rebuilds a fct_classification keyed on the surrogate id, keeping the latest
+# row of every session and rider, the view is recreated afterwards
+MIGRATE_FCT_CLASSIFICATION = """\
+DROP VIEW IF EXISTS dwh.vw_results;
+
+CREATE TABLE dwh.fct_classification_migrated (
+    id INT DEFAULT nextval('classification_id'),
+    season_id VARCHAR,
+    event_id VARCHAR,
+    category_id VARCHAR,
+    session_id VARCHAR,
+    rider_id VARCHAR,
+    position INT,
+    points DOUBLE,
+    timestamp TIMESTAMP,
+    team VARCHAR,
+    PRIMARY KEY (session_id, rider_id)
+);
+
+INSERT INTO dwh.fct_classification_migrated
+SELECT id, season_id, event_id, category_id, session_id, rider_id, position, points, timestamp, NULL
+FROM dwh.fct_classification
+WHERE session_id IS NOT NULL AND rider_id IS NOT NULL
+QUALIFY row_number() OVER (PARTITION BY session_id, rider_id ORDER BY timestamp DESC, id DESC) = 1;
+
+DROP TABLE dwh.fct_classification;
+ALTER TABLE dwh.fct_classification_migrated RENAME TO fct_classification;"""
+
+# the team a rider raced for was not kept before, duckdb only alters a table
+# without indexes and the dropped index must be committed first
+DROP_FCT_INDEX = """\
+DROP VIEW IF EXISTS dwh.vw_results;
+DROP INDEX IF EXISTS dwh.fct_classification_session_id;"""
+MIGRATE_FCT_TEAM = "ALTER TABLE dwh.fct_classification ADD COLUMN team VARCHAR"
+
+# existing rows get the rider's current team
+MIGRATE_FCT_INDEX = """\
+UPDATE dwh.fct_classification AS fct
+SET team = rider.team
+FROM dwh.dim_rider AS rider
+WHERE rider.id = fct.rider_id AND fct.team IS NULL;
+
+CREATE INDEX IF NOT EXISTS fct_classification_session_id ON dwh.fct_classification (session_id);"""
+
+# points were INT, half points races lost their half point, the column type
+# of a keyed table can only change by copying it
+MIGRATE_FCT_POINTS = """\
+DROP VIEW IF EXISTS dwh.vw_results;
+
+CREATE TABLE dwh.fct_classification_migrated (
+    id INT DEFAULT nextval('classification_id'),
+    season_id VARCHAR,
+    event_id VARCHAR,
+    category_id VARCHAR,
+    session_id VARCHAR,
+    rider_id VARCHAR,
+    position INT,
+    points DOUBLE,
+    timestamp TIMESTAMP,
+    team VARCHAR,
+    PRIMARY KEY (session_id, rider_id)
+);
+
+INSERT INTO dwh.fct_classification_migrated
+SELECT id, season_id, event_id, category_id, session_id, rider_id, position, points, timestamp, team
+FROM dwh.fct_classification;
+
+DROP TABLE dwh.fct_classification;
+ALTER TABLE dwh.fct_classification_migrated RENAME TO fct_classification;"""
+STANDINGS_TABLES = ["agg_standings_rider", "agg_standings_team"]
+
+
+# one duckdb connection with a cursor per thread and a pool of sqlite connections
+class ConnectionManager:
+    def __init__(self, env: str = None, sqlite_pool_size: int = SQLITE_POOL_SIZE):
+        env = env if env is not None else os.getenv("MOTOGP_ENV")
+        test = True if env.lower() == "test" else False
+        self.duckdb_filename = "test-motogp.db" if test else "motogp.db"
+        self.sqlite_filename = "test-processing.db" if test else "processing.db"
+
+        self._lock = threading.Lock()
+        self._duckdb = None
+        self._cursors = []
+        self._local = threading.local()
+        self._sqlite_pool = queue.LifoQueue(maxsize=sqlite_pool_size)
+        self._sqlite_migrated = False
+
+    def duckdb_connection(self) -> duckdb.DuckDBPyConnection:
+        with self._lock:
+            if self._duckdb is None:
+                self._duckdb = duckdb.connect(self.duckdb_filename)
+                migrate_duckdb(self._duckdb)
+
+            return self._duckdb
+
+    def duckdb_cursor(self) -> duckdb.DuckDBPyConnection:
+        cursor = getattr(self._local, "cursor", None)
+        if cursor is None:
+            cursor = self.duckdb_connection().cursor()
+            with self._lock:
+                self._cursors.append(cursor)
+            self._local.cursor = cursor
+
+        return cursor
+
+    def connect_sqlite(self) -> sqlite3.Connection:
+        return sqlite3.connect(self.sqlite_filename, check_same_thread=False)
+
+    def migrate_sqlite(self, conn: sqlite3.Connection):
+        with self._lock:
+            if not self._sqlite_migrated:
+                migrate_sqlite(conn)
+                self._sqlite_migrated = True
+
+    @contextlib.contextmanager
+    def sqlite_connection(self):
+        try:
+            conn = self._sqlite_pool.get_nowait()
+        except queue.Empty:
+            conn = self.connect_sqlite()
+            self.migrate_sqlite(conn)
+
+        try:
+            yield conn
+        finally:
+            if conn.in_transaction:
+                conn.rollback()
+
+            try:
+                self._sqlite_pool.put_nowait(conn)
+            except queue.Full:
+                conn.close()
+
+    def close(self):
+        with self._lock:
+            for cursor in self._cursors:
+                cursor.close()
+            self._cursors = []
+            self._local = threading.local()
+
+            if self._duckdb is not None:
+                self._duckdb.close()
+                self._duckdb = None
+
+        while not self._sqlite_pool.empty():
+            self._sqlite_pool.get_nowait().close()
+
+
+_manager: ConnectionManager = None
+
+
+def get_manager() -> ConnectionManager:
+    global _manager
+    if _manager is None:
+        _manager = ConnectionManager()
+
+    return _manager
+
+
+def close_connections():
+    global _manager
+    if _manager is not None:
+        _manager.close()
+        _manager = None
+
+
+def duckdb_cursor() -> duckdb.DuckDBPyConnection:
+    return get_manager().duckdb_cursor()
+
+
+def sqlite_connection():
+    return get_manager().sqlite_connection()
+
 
 def setup_sqlite(refresh: bool = False):
-    test = True if os.getenv("MOTOGP_ENV").lower() == "test" else False
-    filename = "test-processing.db" if test else "processing.db"
-    conn = sqlite3.connect(filename)
+    conn = get_manager().connect_sqlite()
 
     if refresh:
         refresh_sqlite(conn)
@@ -17,6 +212,7 @@ def setup_sqlite(refresh: bool = False):
 def refresh_sqlite(conn: sqlite3.Connection):
     cur = conn.cursor()
     cur.execute("DROP TABLE IF EXISTS tasks")
+    cur.execute("DROP TABLE IF EXISTS sync_state")
 
     path = os.path.dirname(__file__)
     files = os.listdir(path + "/sqlite")
@@ -26,12 +222,30 @@ def refresh_sqlite(conn: sqlite3.Connection):
         conn.execute(sql)
 
     cur.close()
+    migrate_sqlite(conn)
+
+
+def migrate_sqlite(conn: sqlite3.Connection):
+    path = os.path.dirname(__file__)
+    files = os.listdir(path + "/sqlite")
+    files.sort()
+    for file in files:
+        sql = open(path + "/sqlite/" + file).read()
+        conn.execute(sql)
+
+    columns = [row[1] for row in conn.execute("PRAGMA table_info(tasks)")]
+    for column, type in SQLITE_TASK_COLUMNS.items():
+        if column not in columns:
+            conn.execute(f"ALTER TABLE tasks ADD COLUMN {column} {type}")
+
+    for name, columns in SQLITE_TASK_INDEXES.items():
+        conn.execute(f"CREATE INDEX IF NOT EXISTS {name} ON tasks ({columns})")
+
+    conn.commit()
 
 
 def setup_duckdb(refresh: bool = False):
-    test = True if os.getenv("MOTOGP_ENV").lower() == "test" else False
-    filename = "test-motogp.db" if test else "motogp.db"
-    conn = duckdb.connect(filename)
+    conn = get_manager().duckdb_connection().cursor()
 
     if refresh:
         refresh_duckdb(conn)
@@ -50,7 +264,74 @@ def refresh_duckdb(conn: duckdb.DuckDBPyConnection):
         conn.execute(sql)
 
 
-def export_results():
-    conn = setup_duckdb()
-    conn.execute("copy dwh.vw_results to 'motogp.parquet' (FORMAT PARQUET)")
-    conn.close()
+def migrate_duckdb(conn: duckdb.DuckDBPyConnection):
+    tables = conn.execute(
+        "SELECT table_name FROM duckdb_tables() WHERE schema_name = 'dwh'"
+    ).fetchall()
+    tables = [table for table, in tables]
+    if "fct_classification" not in tables:
+        # no warehouse yet, refresh_duckdb creates it
+        return None
+
+    key = conn.execute(
+        """\
+SELECT constraint_column_names
+FROM duckdb_constraints()
+WHERE schema_name = 'dwh' AND table_name = 'fct_classification' AND constraint_type = 'PRIMARY KEY'"""
+    ).fetchone()
+    migrations = []
+    if key is None or key[0] != DUCKDB_FCT_KEY:
+        migrations += [MIGRATE_FCT_CLASSIFICATION, MIGRATE_FCT_INDEX]
+    else:
+        if not _has_team(conn):
+            conn.execute(DROP_FCT_INDEX)
+            migrations += [MIGRATE_FCT_TEAM, MIGRATE_FCT_INDEX]
+        if _column_type(conn, "fct_classification", "points") != "DOUBLE":
+            migrations += [MIGRATE_FCT_POINTS, MIGRATE_FCT_INDEX]
+
+    path = os.path.dirname(__file__)
+    # standings are derived, tables with INT points are built again
+    missing = [
+        table
+        for table in STANDINGS_TABLES
+        if _column_type(conn, table, "points") != "DOUBLE"
+    ]
+    for table in missing:
+        migrations.append(f"DROP TABLE IF EXISTS dwh.{table}")
+        migrations.append(open(f"{path}/duckdb/create_tbl_{table}.sql").read())
+
+    if not migrations:
+        return None
+
+    try:
+        conn.begin()
+        for sql in migrations:
+            conn.execute(sql)
+        if missing:
+            rebuild_standings(conn)
+        conn.execute(open(path + "/duckdb/create_vw_results.sql").read())
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+
+
+def _column_type(conn: duckdb.DuckDBPyConnection, table: str, column: str) -> str:
+    res = conn.execute(
+        """\
+SELECT data_type
+FROM duckdb_columns()
+WHERE schema_name = 'dwh' AND table_name = ? AND column_name = ?""",
+        [table, column],
+    ).fetchone()
+    return res[0] if res else None
+
+
+def _has_team(conn: duckdb.DuckDBPyConnection) -> bool:
+    res = conn.execute(
+        """\
+SELECT count(*)
+FROM duckdb_columns()
+WHERE schema_name = 'dwh' AND table_name = 'fct_classification' AND column_name = 'team'"""
+    ).fetchone()
+    return res[0] > 0
@@ -0,0 +1,103 @@
+import json
+import sys
+from typing import List, Optional, Tuple
+
+try:
+    import msgspec
+except ImportError:
+    msgspec = None
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+# rider_id, name, country, number, team, position, points
+ResultRow = Tuple[str, str, str, int, str, int, float]
+
+
+if msgspec is not None:
+    # only the fields we keep are declared, msgspec skips everything else in
+    # the payload without building python objects for it
+    class _Named(msgspec.Struct):
+        name: Optional[str] = None
+
+    class _Rider(msgspec.Struct):
+        id: str
+        full_name: Optional[str] = None
+        country: Optional[_Named] = None
+        number: Optional[int] = None
+
+    class _Result(msgspec.Struct):
+        rider: _Rider
+        team: Optional[_Named] = None
+        position: Optional[int] = None
+        points: Optional[float] = None
+
+    class _Classification(msgspec.Struct):
+        classification: Optional[List[_Result]] = None
+
+    _decoder = msgspec.json.Decoder(_Classification)
+
+
+def intern(value: str) -> str:
+    # names and ids repeated across many entities share one string object
+    return sys.intern(value) if value is not None else None
+
+
+def backend() -> str:
+    if msgspec is not None:
+        return "msgspec"
+    if orjson is not None:
+        return "orjson"
+
+    return "json"
+
+
+def _decode_msgspec(content: bytes) -> List[ResultRow]:
+    classification = _decoder.decode(content).classification
+    assert classification is not None
+    return [
+        (
+            r.rider.id,
+            r.rider.full_name,
+            intern(r.rider.country.name) if r.rider.country else None,
+            r.rider.number,
+            intern(r.team.name) if r.team else "",
+            r.position,
+            r.points,
+        )
+        for r in classification
+    ]
+
+
+def _decode_dict(content: bytes) -> List[ResultRow]:
+    payload = orjson.loads(content) if orjson is not None else json.loads(content)
+    classification = payload.get("classification")
+    assert classification is not None
+
+    rows = []
+    for r in classification:
+        rider = r["rider"]
+        country = rider.get("country")
+        team = r.get("team")
+        rows.append(
+            (
+                rider["id"],
+                rider.get("full_name"),
+                intern(country.get("name")) if country else None,
+                rider.get("number"),
+                intern(team.get("name")) if team else "",
+                r.get("position"),
+                r.get("points"),
+            )
+        )
+
+    return rows
+
+
+def decode_classification(content: bytes) -> List[ResultRow]:
+    if msgspec is not None:
+        return _decode_msgspec(content)
+
+    return _decode_dict(content)
@@ -0,0 +1,11 @@
+CREATE TABLE IF NOT EXISTS dwh.agg_standings_rider (
+    season_id VARCHAR,
+    category_id VARCHAR,
+    event_id VARCHAR,
+    event_date DATE,
+    rider_id VARCHAR,
+    event_points DOUBLE,
+    points DOUBLE,
+    timestamp TIMESTAMP,
+    PRIMARY KEY (season_id, category_id, event_id, rider_id)
+)
\ No newline at end of file
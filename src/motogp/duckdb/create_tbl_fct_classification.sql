@@ -1,13 +1,17 @@
 CREATE OR REPLACE SEQUENCE classification_id START 1;
 
 CREATE TABLE IF NOT EXISTS dwh.fct_classification (
-    id INT PRIMARY KEY DEFAULT nextval('classification_id'),
+    id INT DEFAULT nextval('classification_id'),
     season_id VARCHAR,
     event_id VARCHAR,
     category_id VARCHAR,
     session_id VARCHAR,
     rider_id VARCHAR,
     position INT,
-    points INT,
-    timestamp TIMESTAMP
-);
\ No newline at end of file
+    points DOUBLE,
+    timestamp TIMESTAMP,
+    team VARCHAR,
+    PRIMARY KEY (session_id, rider_id)
+);
+
+CREATE INDEX IF NOT EXISTS fct_classification_session_id ON dwh.fct_classification (session_id);
\ No newline at end of file
@@ -1,9 +1,17 @@
-from typing import AsyncGenerator, List
+from typing import AsyncGenerator, Callable, Dict, List
+import asyncio
+import datetime
 import functools
+import json
+import os
 
 import httpx
-import requests
+
+from motogp.archive import Archive, get_archive
+from motogp.client import get_client
+from motogp.decode import ResultRow, decode_classification
 from motogp.model import Classification, Season, Event, Category, Session, Task
+from motogp.state import SETTLE_DAYS
 
 # get year, event, category, sessions, and classification
 BASE_URL = "https://api.pulselive.motogp.com/motogp/v1/results"
@@ -18,85 +26,165 @@ CLASSIFICATION_ENDPOINT_TEMPL = (
 )
 
 
-def get_seasons(incremental: bool = True) -> List[Season]:
-    res = requests.get(SEASONS_ENDPOINT)
-    res.raise_for_status()
-    seasons = res.json()
+def _parse_seasons(seasons: List[Dict]) -> List[Season]:
     assert len(seasons) > 0
 
     seasons = [Season.from_req(s) for s in seasons]
     seasons.sort(key=lambda x: x.year)
-    if incremental:
-        last_year = Season.last_season_year()
-        new_seasons = [x.id for x in seasons if x.year >= last_year]
-        seasons = [s for s in seasons if s.id in new_seasons]
-
     return seasons
 
 
-def get_events(season_id: str, incremental: bool = True) -> List[Event]:
-    res = requests.get(EVENTS_ENDPOINT_TEMPL.format(season=season_id))
-    res.raise_for_status()
-    events = res.json()
+def _parse_events(events: List[Dict]) -> List[Event]:
     assert len(events) > 0
 
     events = [Event.from_req(e) for e in events]
     events.sort(key=lambda x: x.start)
-    if incremental:
-        ts = Event.last_event_date()
-        new_events = [x.id for x in events if x.start >= ts]
-        events = [e for e in events if e.id in new_events]
-
     return events
 
 
-@functools.cache
-def get_categories(event_id: str) -> List[Category]:
-    res = requests.get(CATEGORIES_ENDPOINT_TEMPL.format(event=event_id))
-    res.raise_for_status()
-    categories = res.json()
+def _parse_categories(categories: List[Dict]) -> List[Category]:
     assert len(categories) > 0
     return [Category.from_req(c) for c in categories]
 
 
-def get_sessions(event_id: str, category_id: str) -> List[Session]:
-    res = requests.get(
-        SESSIONS_ENDPOINT_TEMPL.format(event=event_id, category=category_id)
-    )
+def _settled(task: Task) -> bool:
+    # a classification fetched this long after its event is cached for good
+    if task.event_end is None:
+        return False
+
+    return datetime.date.today() >= task.event_end + datetime.timedelta(SETTLE_DAYS)
+
+
+def _fetch(
+    url: str, archive_path: Callable[[Archive], str], settled: bool = False
+) -> bytes:
+    archive = get_archive()
+    if archive and archive.replay:
+        return archive.read(archive_path(archive))
+
+    res = get_client().get(url, settled)
     res.raise_for_status()
-    sessions = res.json()
+    if archive:
+        path = archive_path(archive)
+        if _archive_due(res, path):
+            archive.write(path, res.content)
+
+    return res.content
+
+
+async def _async_fetch(
+    url: str, archive_path: Callable[[Archive], str], settled: bool = False
+) -> bytes:
+    archive = get_archive()
+    if archive and archive.replay:
+        return archive.read(archive_path(archive))
+
+    res = await get_client().async_get(url, settled)
+    res.raise_for_status()
+    if archive:
+        path = archive_path(archive)
+        if _archive_due(res, path):
+            await asyncio.to_thread(archive.write, path, res.content)
+
+    return res.content
+
+
+def _archive_due(res: httpx.Response, path: str) -> bool:
+    # cached responses are only archived when the archive lacks them
+    return not res.extensions.get("from_cache") or not os.path.exists(path)
+
+
+def get_seasons() -> List[Season]:
+    content = _fetch(SEASONS_ENDPOINT, lambda a: a.seasons_path())
+    return _parse_seasons(json.loads(content))
+
+
+async def async_get_seasons() -> List[Season]:
+    content = await _async_fetch(SEASONS_ENDPOINT, lambda a: a.seasons_path())
+    return _parse_seasons(json.loads(content))
+
+
+def get_events(season_id: str) -> List[Event]:
+    content = _fetch(
+        EVENTS_ENDPOINT_TEMPL.format(season=season_id),
+        lambda a: a.events_path(season_id),
+    )
+    return _parse_events(json.loads(content))
+
+
+async def async_get_events(season_id: str) -> List[Event]:
+    content = await _async_fetch(
+        EVENTS_ENDPOINT_TEMPL.format(season=season_id),
+        lambda a: a.events_path(season_id),
+    )
+    return _parse_events(json.loads(content))
+
+
+@functools.cache
+def get_categories(event_id: str, season_id: str = None) -> List[Category]:
+    content = _fetch(
+        CATEGORIES_ENDPOINT_TEMPL.format(event=event_id),
+        lambda a: a.categories_path(season_id, event_id),
+    )
+    return _parse_categories(json.loads(content))
+
+
+async def async_get_categories(event_id: str, season_id: str = None) -> List[Category]:
+    content = await _async_fetch(
+        CATEGORIES_ENDPOINT_TEMPL.format(event=event_id),
+        lambda a: a.categories_path(season_id, event_id),
+    )
+    return _parse_categories(json.loads(content))
+
+
+def get_sessions(
+    event_id: str, category_id: str, season_id: str = None
+) -> List[Session]:
+    content = _fetch(
+        SESSIONS_ENDPOINT_TEMPL.format(event=event_id, category=category_id),
+        lambda a: a.sessions_path(season_id, event_id, category_id),
+    )
+    sessions = json.loads(content)
     assert len(sessions) > 0
     return [Session.from_req(s) for s in sessions]
 
 
 async def async_get_sessions(
-    event_id: str, category_id: str
+    event_id: str, category_id: str, season_id: str = None
 ) -> AsyncGenerator[any, Session]:
-    client = httpx.AsyncClient(timeout=10.0)
-    res = await client.get(
-        SESSIONS_ENDPOINT_TEMPL.format(event=event_id, category=category_id)
+    content = await _async_fetch(
+        SESSIONS_ENDPOINT_TEMPL.format(event=event_id, category=category_id),
+        lambda a: a.sessions_path(season_id, event_id, category_id),
     )
-    res.raise_for_status()
-    sessions = res.json()
+    sessions = json.loads(content)
     assert len(sessions) > 0
 
     return [Session.from_req(s) for s in sessions]
 
 
 def get_classification(task: Task) -> Classification:
-    res = requests.get(CLASSIFICATION_ENDPOINT_TEMPL.format(session=task.session_id))
-    res.raise_for_status()
-    res = res.json()
-    assert len(res) > 0
-    return Classification.from_req(res, task)
+    content = _fetch(
+        CLASSIFICATION_ENDPOINT_TEMPL.format(session=task.session_id),
+        lambda a: a.classification_path(task.season_id, task.event_id, task.session_id),
+        _settled(task),
+    )
+    return Classification.from_bytes(content, task)
 
 
 async def async_get_classification(task: Task) -> Classification:
-    client = httpx.AsyncClient(timeout=10.0)
-    res = await client.get(
-        CLASSIFICATION_ENDPOINT_TEMPL.format(session=task.session_id)
+    content = await _async_fetch_classification(task)
+    return Classification.from_bytes(content, task)
+
+
+async def async_get_results(task: Task) -> List[ResultRow]:
+    # decoded rows only, for bulk loading without per result objects
+    content = await _async_fetch_classification(task)
+    return decode_classification(content)
+
+
+async def _async_fetch_classification(task: Task) -> bytes:
+    return await _async_fetch(
+        CLASSIFICATION_ENDPOINT_TEMPL.format(session=task.session_id),
+        lambda a: a.classification_path(task.season_id, task.event_id, task.session_id),
+        _settled(task),
     )
-    res.raise_for_status()
-    res = res.json()
-    assert len(res) > 0
-    return Classification.from_req(res, task)
@@ -0,0 +1,213 @@
+import json
+import os
+import sys
+import time
+import uuid
+from typing import Dict, List, Tuple
+
+from motogp.database import close_connections, duckdb_cursor
+from motogp.logger import setup_logger
+
+EXPORT_PATH = "data-lake/gold/results"
+MANIFEST_FILENAME = "manifest.json"
+# partitions with at least this many files are merged into one
+COMPACT_MIN_FILES = 8
+# a season of one category is a few thousand rows, small row groups let
+# readers skip by event date inside a partition
+ROW_GROUP_SIZE = 2048
+# hive's name for a partition whose value is null
+DEFAULT_PARTITION = "__HIVE_DEFAULT_PARTITION__"
+
+# partition columns live in the hive path, not in the files
+GOLD_QUERY = """\
+SELECT
+    event.date_start AS event_date,
+    event.name AS event_name,
+    event.short_name AS event_short_name,
+    session.name AS session,
+    rider.name AS rider_name,
+    rider.number AS rider_number,
+    rider.country AS rider_country,
+    coalesce(fct.team, rider.team) AS rider_team,
+    fct.position,
+    fct.points,
+    fct.session_id
+FROM dwh.fct_classification AS fct
+LEFT JOIN dwh.dim_event AS event ON event.id = fct.event_id
+LEFT JOIN dwh.dim_session AS session ON session.id = fct.session_id
+LEFT JOIN dwh.dim_rider AS rider ON rider.id = fct.rider_id"""
+
+# year, category
+Partition = Tuple[str, str]
+
+
+# hive partitioned export of the sessions loaded since the manifest's watermark,
+# reloaded sessions get their partition rewritten
+class Exporter:
+    def __init__(self, path: str = EXPORT_PATH):
+        self.path = path
+        self.manifest_path = os.path.join(path, MANIFEST_FILENAME)
+        self.manifest = self.load_manifest()
+
+    def load_manifest(self) -> Dict:
+        if not os.path.exists(self.manifest_path):
+            return {"watermark": None, "files": []}
+
+        with open(self.manifest_path) as f:
+            return json.load(f)
+
+    def save_manifest(self):
+        os.makedirs(self.path, exist_ok=True)
+        tmp = f"{self.manifest_path}.{os.getpid()}.tmp"
+        with open(tmp, "w") as f:
+            json.dump(self.manifest, f, indent=2)
+
+        os.replace(tmp, self.manifest_path)
+
+    def files(self, partition: Partition) -> List[Dict]:
+        return [f for f in self.manifest["files"] if _partition(f) == partition]
+
+    def changed_sessions(self) -> Dict[Partition, List[str]]:
+        conn = duckdb_cursor()
+        res = conn.execute(
+            """\
+SELECT DISTINCT season.year, category.name, fct.session_id
+FROM dwh.fct_classification AS fct
+LEFT JOIN dwh.dim_season AS season ON season.id = fct.season_id
+LEFT JOIN dwh.dim_category AS category ON category.id = fct.category_id
+WHERE $watermark IS NULL OR fct.timestamp > $watermark::TIMESTAMP
+ORDER BY ALL""",
+            {"watermark": self.manifest["watermark"]},
+        ).fetchall()
+
+        changed = {}
+        for year, category, session_id in res:
+            partition = (
+                str(year) if year is not None else DEFAULT_PARTITION,
+                category if category is not None else DEFAULT_PARTITION,
+            )
+            changed.setdefault(partition, []).append(session_id)
+
+        return changed
+
+    def write(self, partition: Partition, sessions: List[str]) -> Dict:
+        year, category = partition
+        relpath = os.path.join(
+            f"year={year}", f"category={category}", f"part-{uuid.uuid4().hex}.parquet"
+        )
+        path = os.path.join(self.path, relpath)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+
+        conn = duckdb_cursor()
+        escaped = path.replace("'", "''")
+        rows = conn.execute(
+            f"""\
+COPY (
+    {GOLD_QUERY}
+    WHERE fct.session_id IN (SELECT unnest($sessions::VARCHAR[]))
+    ORDER BY event_date, event_short_name, session, position
+) TO '{escaped}' (FORMAT PARQUET, ROW_GROUP_SIZE {ROW_GROUP_SIZE})""",
+            {"sessions": sessions},
+        ).fetchone()[0]
+
+        return {
+            "path": relpath,
+            "year": year,
+            "category": category,
+            "sessions": sorted(sessions),
+            "rows": rows,
+            "created_timestamp": time.time(),
+        }
+
+    def rewrite(self, partition: Partition, sessions: List[str]):
+        # replaces every file of the partition with a single new one
+        old = self.files(partition)
+        sessions = set(sessions)
+        for f in old:
+            sessions.update(f["sessions"])
+
+        written = self.write(partition, list(sessions))
+        self.manifest["files"] = [
+            f for f in self.manifest["files"] if _partition(f) != partition
+        ] + [written]
+        # the manifest never lists a deleted file
+        self.save_manifest()
+        for f in old:
+            self.remove(f)
+
+    def export(self) -> int:
+        conn = duckdb_cursor()
+        watermark = conn.execute(
+            "SELECT max(timestamp)::VARCHAR FROM dwh.fct_classification"
+        ).fetchone()[0]
+
+        changed = self.changed_sessions()
+        for partition, sessions in changed.items():
+            exported = {s for f in self.files(partition) for s in f["sessions"]}
+            if exported.intersection(sessions):
+                self.rewrite(partition, sessions)
+            else:
+                self.manifest["files"].append(self.write(partition, sessions))
+
+        self.manifest["watermark"] = watermark
+        self.save_manifest()
+        return sum(len(sessions) for sessions in changed.values())
+
+    def rebuild(self) -> int:
+        # full export from scratch, drops every file of the manifest
+        old = self.manifest["files"]
+        self.manifest = {"watermark": None, "files": []}
+        self.save_manifest()
+        for f in old:
+            self.remove(f)
+
+        return self.export()
+
+    def remove(self, file: Dict):
+        # files deleted by hand or by an interrupted run are already gone
+        try:
+            os.remove(os.path.join(self.path, file["path"]))
+        except FileNotFoundError:
+            pass
+
+    def compact(self, min_files: int = COMPACT_MIN_FILES) -> int:
+        counts: Dict[Partition, int] = {}
+        for f in self.manifest["files"]:
+            counts[_partition(f)] = counts.get(_partition(f), 0) + 1
+
+        partitions = [p for p, count in counts.items() if count >= min_files]
+        for partition in partitions:
+            self.rewrite(partition, [])
+
+        self.save_manifest()
+        return len(partitions)
+
+
+def _partition(file: Dict) -> Partition:
+    return file["year"], file["category"]
+
+
+def export_incremental(path: str = EXPORT_PATH) -> int:
+    return Exporter(path).export()
+
+
+def export_results(path: str = EXPORT_PATH) -> int:
+    return Exporter(path).rebuild()
+
+
+def compact_results(path: str = EXPORT_PATH, min_files: int = COMPACT_MIN_FILES):
+    return Exporter(path).compact(min_files)
+
+
+if __name__ == "__main__":
+    logger = setup_logger("export")
+    try:
+        if "compact" in sys.argv[1:]:
+            # merges every partition that has more than one file
+            logger.info("compacted %s partitions", compact_results(min_files=2))
+        elif "full" in sys.argv[1:]:
+            logger.info("exported %s sessions", export_results())
+        else:
+            logger.info("exported %s sessions", export_incremental())
+    finally:
+        close_connections()
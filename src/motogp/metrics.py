@@ -0,0 +1,245 @@
+import bisect
+import contextlib
+import http.server
+import json
+import os
+import threading
+import time
+from dataclasses import dataclass, field
+from typing import Dict, List, Tuple
+
+METRICS_FILE = "metrics.ndjson"
+PROMETHEUS_FILE = "metrics.prom"
+# set to serve the prometheus text on http://<host>:<port>/metrics
+METRICS_PORT_ENV = "MOTOGP_METRICS_PORT"
+
+# seconds
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+# rows or tasks
+SIZE_BUCKETS = (1, 10, 50, 100, 500, 1000, 5000, 10000, 50000)
+
+# metric name, sorted label pairs
+Key = Tuple[str, Tuple[Tuple[str, str], ...]]
+
+
+@dataclass
+class Histogram:
+    buckets: Tuple[float, ...]
+    counts: List[int] = field(default_factory=list)
+    sum: float = 0.0
+    count: int = 0
+
+    def __post_init__(self):
+        if not self.counts:
+            self.counts = [0] * len(self.buckets)
+
+    def observe(self, value: float):
+        index = bisect.bisect_left(self.buckets, value)
+        if index < len(self.buckets):
+            self.counts[index] += 1
+        self.sum += value
+        self.count += 1
+
+
+# every observation goes to the ndjson file, aggregates to prometheus text
+class Metrics:
+    def __init__(self, path: str = None, prometheus_path: str = None):
+        self.path = path
+        self.prometheus_path = prometheus_path
+        self.counters: Dict[Key, float] = {}
+        self.gauges: Dict[Key, float] = {}
+        self.histograms: Dict[Key, Histogram] = {}
+        self.lock = threading.Lock()
+        self.file = open(path, "a", buffering=1) if path else None
+        self.server = None
+
+    def inc(self, name: str, value: float = 1, **labels):
+        key = _key(name, labels)
+        with self.lock:
+            self.counters[key] = self.counters.get(key, 0) + value
+
+    def gauge(self, name: str, value: float, **labels):
+        with self.lock:
+            self.gauges[_key(name, labels)] = value
+
+    def observe(
+        self,
+        name: str,
+        value: float,
+        buckets: Tuple[float, ...] = LATENCY_BUCKETS,
+        **labels,
+    ):
+        key = _key(name, labels)
+        with self.lock:
+            histogram = self.histograms.get(key)
+            if histogram is None:
+                histogram = self.histograms[key] = Histogram(buckets)
+            histogram.observe(value)
+
+        self.event(name, value=value, **labels)
+
+    @contextlib.contextmanager
+    def timer(self, name: str, **labels):
+        start = time.monotonic()
+        try:
+            yield
+        finally:
+            self.observe(name, time.monotonic() - start, **labels)
+
+    def event(self, name: str, **fields):
+        if self.file is None:
+            return None
+
+        line = json.dumps({"timestamp": time.time(), "event": name, **fields})
+        with self.lock:
+            self.file.write(line + "\n")
+
+    def prometheus(self) -> str:
+        lines = []
+        with self.lock:
+            _render(lines, "counter", self.counters)
+            _render(lines, "gauge", self.gauges)
+
+            names = sorted({name for name, _ in self.histograms})
+            for name in names:
+                lines.append(f"# TYPE {name} histogram")
+                for (n, labels), h in sorted(self.histograms.items()):
+                    if n != name:
+                        continue
+
+                    cumulative = 0
+                    for le, count in zip(h.buckets, h.counts):
+                        cumulative += count
+                        bucket = labels + (("le", _number(le)),)
+                        lines.append(f"{name}_bucket{_labels(bucket)} {cumulative}")
+                    bucket = labels + (("le", "+Inf"),)
+                    lines.append(f"{name}_bucket{_labels(bucket)} {h.count}")
+                    lines.append(f"{name}_sum{_labels(labels)} {_number(h.sum)}")
+                    lines.append(f"{name}_count{_labels(labels)} {h.count}")
+
+        return "\n".join(lines) + "\n"
+
+    def drain(self) -> Dict:
+        # counters and histograms since the last drain, for a process that
+        # reports to a coordinator
+        with self.lock:
+            counters, self.counters = self.counters, {}
+            histograms, self.histograms = self.histograms, {}
+
+        return {"counters": counters, "histograms": histograms}
+
+    def merge(self, drained: Dict):
+        with self.lock:
+            for key, value in drained["counters"].items():
+                self.counters[key] = self.counters.get(key, 0) + value
+            for key, other in drained["histograms"].items():
+                histogram = self.histograms.get(key)
+                if histogram is None:
+                    histogram = self.histograms[key] = Histogram(other.buckets)
+                histogram.counts = [
+                    a + b for a, b in zip(histogram.counts, other.counts)
+                ]
+                histogram.sum += other.sum
+                histogram.count += other.count
+
+    def write_prometheus(self, path: str):
+        tmp = f"{path}.{os.getpid()}.tmp"
+        with open(tmp, "w") as f:
+            f.write(self.prometheus())
+
+        os.replace(tmp, path)
+
+    def serve(self, port: int, host: str = "") -> http.server.ThreadingHTTPServer:
+        metrics = self
+
+        class Handler(http.server.BaseHTTPRequestHandler):
+            def do_GET(self):
+                body = metrics.prometheus().encode()
+                self.send_response(200)
+                self.send_header("Content-Type", "text/plain; version=0.0.4")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, *_):
+                pass
+
+        self.server = http.server.ThreadingHTTPServer((host, port), Handler)
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        return self.server
+
+    def close(self):
+        if self.prometheus_path:
+            self.write_prometheus(self.prometheus_path)
+
+        if self.server is not None:
+            self.server.shutdown()
+            self.server.server_close()
+            self.server = None
+
+        if self.file is not None:
+            self.file.close()
+            self.file = None
+
+
+def _key(name: str, labels: Dict) -> Key:
+    return name, tuple(sorted((k, str(v)) for k, v in labels.items()))
+
+
+def _number(value: float) -> str:
+    return str(int(value)) if float(value).is_integer() else repr(float(value))
+
+
+def _labels(labels: Tuple[Tuple[str, str], ...]) -> str:
+    if not labels:
+        return ""
+
+    escaped = [
+        (k, v.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n"))
+        for k, v in labels
+    ]
+    return "{" + ",".join(f'{k}="{v}"' for k, v in escaped) + "}"
+
+
+def _render(lines: List[str], type: str, values: Dict[Key, float]):
+    for name in sorted({name for name, _ in values}):
+        lines.append(f"# TYPE {name} {type}")
+        for (n, labels), value in sorted(values.items()):
+            if n == name:
+                lines.append(f"{name}{_labels(labels)} {_number(value)}")
+
+
+_metrics: Metrics = None
+
+
+def setup_metrics(
+    path: str = METRICS_FILE,
+    prometheus_path: str = PROMETHEUS_FILE,
+    serve: bool = True,
+) -> Metrics:
+    global _metrics
+    if _metrics is not None:
+        _metrics.close()
+
+    _metrics = Metrics(path, prometheus_path)
+    port = os.getenv(METRICS_PORT_ENV)
+    if serve and port:
+        _metrics.serve(int(port))
+
+    return _metrics
+
+
+def get_metrics() -> Metrics:
+    global _metrics
+    if _metrics is None:
+        # kept in memory only until an entry point sets up its files
+        _metrics = Metrics()
+
+    return _metrics
+
+
+def close_metrics():
+    global _metrics
+    if _metrics is not None:
+        _metrics.close()
+        _metrics = None
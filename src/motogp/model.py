@@ -1,25 +1,48 @@
-from dataclasses import dataclass
+import asyncio
+from dataclasses import dataclass, field
 import datetime
+import json
+import random
 from enum import Enum
 import re
-from typing import Dict, List
-from motogp.database import setup_duckdb, setup_sqlite
+import threading
+import time
+import uuid
+from typing import Dict, List, Set, Tuple
+
+try:
+    import pyarrow
+except ImportError:
+    pyarrow = None
+
+from motogp.database import duckdb_cursor, sqlite_connection
+from motogp.decode import ResultRow, decode_classification, intern
+from motogp.metrics import SIZE_BUCKETS, get_metrics
+from motogp.standings import update_standings
+
+STATUS_BATCH_SIZE = 100
+STATUS_FLUSH_INTERVAL = 1.0
+LEASE_SECONDS = 300.0
+MAX_ATTEMPTS = 5
+RETRY_BASE_DELAY = 30.0
+RETRY_MAX_DELAY = 3600.0
+# task ids are derived from the session id, so a session maps to one task
+TASK_NAMESPACE = uuid.uuid5(uuid.NAMESPACE_URL, "motogp/task")
 
 
 class CategoryParseError(Exception):
     pass
 
 
-@dataclass
+@dataclass(frozen=True, slots=True)
 class Season:
     id: str
     year: int
 
     @staticmethod
     def last_season_year():
-        conn = setup_duckdb()
+        conn = duckdb_cursor()
         res = conn.execute("SELECT MAX(year) FROM dwh.dim_season").fetchone()[0]
-        conn.close()
 
         return res if res else 1900
 
@@ -29,26 +52,23 @@ class Season:
 
     @staticmethod
     def from_db(id: str):
-        conn = setup_duckdb()
+        conn = duckdb_cursor()
         res = conn.execute(
             "SELECT id, year FROM dwh.dim_season WHERE id = ?", [id]
         ).fetchone()
-        conn.close()
         return Season(*res)
 
     def sync(self):
-        conn = setup_duckdb()
+        conn = duckdb_cursor()
         conn.execute(
             """\
 INSERT OR IGNORE INTO dwh.dim_season (id, year, timestamp)
 VALUES ($id, $year, current_timestamp)""",
             {"id": self.id, "year": self.year},
         )
-        conn.commit()
-        conn.close()
 
 
-@dataclass
+@dataclass(frozen=True, slots=True)
 class Event:
     id: str
     name: str
@@ -58,11 +78,10 @@ class Event:
 
     @staticmethod
     def last_event_date():
-        conn = setup_duckdb()
+        conn = duckdb_cursor()
         res = conn.execute(
             "SELECT MAX(date_start) FROM dwh.dim_event",
         ).fetchone()[0]
-        conn.close()
 
         return res if res else datetime.date.min
 
@@ -78,16 +97,15 @@ class Event:
 
     @staticmethod
     def from_db(id: str):
-        conn = setup_duckdb()
+        conn = duckdb_cursor()
         res = conn.execute(
             "SELECT id, name, short_name, date_start, date_end FROM dwh.dim_event WHERE id = ?",
             [id],
         ).fetchone()
-        conn.close()
         return Event(*res)
 
     def sync(self):
-        conn = setup_duckdb()
+        conn = duckdb_cursor()
         conn.execute(
             """\
 INSERT OR IGNORE INTO dwh.dim_event (id, name, short_name, date_start, date_end, timestamp)
@@ -100,11 +118,9 @@ VALUES ($id, $name, $short_name, $date_start, $date_end, current_timestamp)""",
                 "date_end": self.end,
             },
         )
-        conn.commit()
-        conn.close()
 
 
-@dataclass
+@dataclass(frozen=True, slots=True)
 class Category:
     id: str
     name: str
@@ -114,21 +130,21 @@ class Category:
         name = json.get("name")
         matches = re.search("[A-Za-z0-9]+", name)  # type: ignore
         if matches:
-            return Category(json.get("id"), matches.group(0).lower())  # type: ignore
+            name = intern(matches.group(0).lower())
+            return Category(json.get("id"), name)  # type: ignore
 
         raise CategoryParseError(f"Failed to parse Category from {name}")
 
     @staticmethod
     def from_db(id: str):
-        conn = setup_duckdb()
+        conn = duckdb_cursor()
         res = conn.execute(
             "SELECT id, name FROM dwh.dim_category WHERE id = ?", [id]
         ).fetchone()
-        conn.close()
         return Category(*res)
 
     def sync(self):
-        conn = setup_duckdb()
+        conn = duckdb_cursor()
         conn.execute(
             """\
 INSERT OR IGNORE INTO dwh.dim_category (id, name, timestamp)
@@ -138,11 +154,9 @@ VALUES ($id, $name, current_timestamp)""",
                 "name": self.name,
             },
         )
-        conn.commit()
-        conn.close()
 
 
-@dataclass
+@dataclass(frozen=True, slots=True)
 class Session:
     id: str
     name: str
@@ -152,20 +166,18 @@ class Session:
         type = json.get("type")
         number = json.get("number")
         name = f"{type}{number}" if number else type
-        return Session(json.get("id"), name.lower())  # type: ignore
+        return Session(json.get("id"), intern(name.lower()))  # type: ignore
 
     @staticmethod
     def from_db(id: str):
-        conn = setup_duckdb()
+        conn = duckdb_cursor()
         res = conn.execute(
             "SELECT id, name FROM dwh.dim_session WHERE id = ?", [id]
         ).fetchone()
-        conn.commit()
-        conn.close()
         return Session(*res)
 
     def sync(self):
-        conn = setup_duckdb()
+        conn = duckdb_cursor()
         conn.execute(
             """\
 INSERT OR IGNORE INTO dwh.dim_session (id, name, timestamp)
@@ -175,11 +187,93 @@ VALUES ($id, $name, current_timestamp)""",
                 "name": self.name,
             },
         )
-        conn.commit()
-        conn.close()
 
 
 @dataclass
+class Dimensions:
+    seasons: Dict[str, Season] = field(default_factory=dict)
+    events: Dict[str, Event] = field(default_factory=dict)
+    categories: Dict[str, Category] = field(default_factory=dict)
+    sessions: Dict[str, Session] = field(default_factory=dict)
+
+    @property
+    def size(self) -> int:
+        return (
+            len(self.seasons)
+            + len(self.events)
+            + len(self.categories)
+            + len(self.sessions)
+        )
+
+    def add(self, season: Season, event: Event, category: Category, session: Session):
+        self.seasons[season.id] = season
+        self.events[event.id] = event
+        self.categories[category.id] = category
+        self.sessions[session.id] = session
+
+    def sync(self):
+        if self.size == 0:
+            return None
+
+        conn = duckdb_cursor()
+        try:
+            conn.begin()
+            if self.seasons:
+                conn.execute(
+                    """\
+INSERT OR IGNORE INTO dwh.dim_season (id, year, timestamp)
+SELECT unnest($id::VARCHAR[]), unnest($year::INT[]), current_timestamp""",
+                    {
+                        "id": [s.id for s in self.seasons.values()],
+                        "year": [s.year for s in self.seasons.values()],
+                    },
+                )
+            if self.events:
+                conn.execute(
+                    """\
+INSERT OR IGNORE INTO dwh.dim_event (id, name, short_name, date_start, date_end, timestamp)
+SELECT
+    unnest($id::VARCHAR[]),
+    unnest($name::VARCHAR[]),
+    unnest($short_name::VARCHAR[]),
+    unnest($date_start::DATE[]),
+    unnest($date_end::DATE[]),
+    current_timestamp""",
+                    {
+                        "id": [e.id for e in self.events.values()],
+                        "name": [e.name for e in self.events.values()],
+                        "short_name": [e.short_name for e in self.events.values()],
+                        "date_start": [e.start for e in self.events.values()],
+                        "date_end": [e.end for e in self.events.values()],
+                    },
+                )
+            if self.categories:
+                conn.execute(
+                    """\
+INSERT OR IGNORE INTO dwh.dim_category (id, name, timestamp)
+SELECT unnest($id::VARCHAR[]), unnest($name::VARCHAR[]), current_timestamp""",
+                    {
+                        "id": [c.id for c in self.categories.values()],
+                        "name": [c.name for c in self.categories.values()],
+                    },
+                )
+            if self.sessions:
+                conn.execute(
+                    """\
+INSERT OR IGNORE INTO dwh.dim_session (id, name, timestamp)
+SELECT unnest($id::VARCHAR[]), unnest($name::VARCHAR[]), current_timestamp""",
+                    {
+                        "id": [s.id for s in self.sessions.values()],
+                        "name": [s.name for s in self.sessions.values()],
+                    },
+                )
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+
+
+@dataclass(frozen=True, slots=True)
 class Rider:
     id: str
     name: str
@@ -189,16 +283,15 @@ class Rider:
 
     @staticmethod
     def from_db(id: str):
-        conn = setup_duckdb()
+        conn = duckdb_cursor()
         res = conn.execute(
             "SELECT id, name, country, number, team  FROM dwh.dim_rider WHERE id = ?",
             [id],
         ).fetchone()
-        conn.close()
         return Rider(res[0], res[1], res[2], res[3], res[4])
 
     def sync(self):
-        conn = setup_duckdb()
+        conn = duckdb_cursor()
         conn.execute(
             """\
 INSERT INTO dwh.dim_rider (id, name, country, team, number, timestamp)
@@ -213,15 +306,13 @@ SET name = $name, country = $country, team = $team, number = $number, timestamp
                 "number": self.number,
             },
         )
-        conn.commit()
-        conn.close()
 
 
-@dataclass
+@dataclass(frozen=True, slots=True)
 class RiderResult:
     rider: Rider
     position: int
-    points: int
+    points: float
 
     @staticmethod
     def from_req(json: Dict):
@@ -232,23 +323,53 @@ class RiderResult:
         rider = Rider(
             json.get("rider").get("id"),
             json.get("rider").get("full_name"),
-            json.get("rider").get("country").get("name"),
+            intern(json.get("rider").get("country").get("name")),
             json.get("rider").get("number"),
-            team,
+            intern(team),
         )
         pos = json.get("position")
         pts = json.get("points")
         return RiderResult(rider, pos, pts)
 
 
+# dim_rider rows shared by the classifications read with them, one query per read
+@dataclass
+class RiderCache:
+    riders: Dict[str, Rider] = field(default_factory=dict)
+
+    def get(self, id: str) -> Rider:
+        return self.riders.get(id)
+
+    def load(self, ids: Set[str]):
+        missing = [id for id in ids if id not in self.riders]
+        if not missing:
+            return None
+
+        conn = duckdb_cursor()
+        res = conn.execute(
+            """\
+SELECT id, name, country, number, team
+FROM dwh.dim_rider
+WHERE id IN (SELECT unnest($ids::VARCHAR[]))""",
+            {"ids": missing},
+        ).fetchall()
+        for row in res:
+            self.riders[row[0]] = Rider(*row)
+
+        # riders missing from the dimension are kept as bare ids
+        for id in missing:
+            self.riders.setdefault(id, Rider(id, None, None, None, None))
+
+
 class TaskStatus(Enum):
     NEW = 0
     QUEUED = 1
     COMPLETED = 2
     ERROR = 3
+    DEAD = 4
 
 
-@dataclass
+@dataclass(slots=True)
 class Task:
     id: str
     season_id: str
@@ -257,54 +378,75 @@ class Task:
     session_id: str
     status: TaskStatus = TaskStatus.NEW
     attempt: int = 0
+    # decides whether the classification can be cached for good
+    event_end: datetime.date = None
 
     @staticmethod
     def from_db(id: str):
-        conn = setup_sqlite()
-        task = conn.execute(
-            """\
-SELECT id, season_id, event_id, category_id, session_id, status, attempt
+        with sqlite_connection() as conn:
+            task = conn.execute(
+                """\
+SELECT id, season_id, event_id, category_id, session_id, status, attempt, event_end
 FROM tasks
 WHERE id = ?""",
-            [id],
-        ).fetchone()
-        conn.close()
+                [id],
+            ).fetchone()
 
+        return Task.from_row(task)
+
+    @staticmethod
+    def from_session(
+        season_id: str,
+        event_id: str,
+        category_id: str,
+        session_id: str,
+        event_end: datetime.date = None,
+    ):
+        id = str(uuid.uuid5(TASK_NAMESPACE, session_id))
         return Task(
-            task[0],
-            task[1],
-            task[2],
-            task[3],
-            task[4],
-            TaskStatus(task[5]),
-            task[6],
+            id, season_id, event_id, category_id, session_id, event_end=event_end
+        )
+
+    @staticmethod
+    def from_row(row: Tuple):
+        # id, season_id, event_id, category_id, session_id, status, attempt,
+        # event_end
+        event_end = row[7] if len(row) > 7 else None
+        return Task(
+            row[0],
+            intern(row[1]),
+            intern(row[2]),
+            intern(row[3]),
+            row[4],
+            TaskStatus(row[5]),
+            row[6],
+            datetime.date.fromisoformat(event_end) if event_end else None,
         )
 
     def upsert_status(self, status: TaskStatus) -> None:
-        conn = setup_sqlite()
-        res = conn.execute(
-            """\
+        with sqlite_connection() as conn:
+            res = conn.execute(
+                """\
 INSERT INTO tasks (id, season_id, event_id, category_id, session_id, added_timestamp)
 VALUES (:id, :season_id, :event_id, :category_id, :session_id, current_timestamp)
 ON CONFLICT DO UPDATE
 SET status = :status, attempt = attempt + 1, updated_timestamp = current_timestamp
 RETURNING status""",
-            {
-                "id": self.id,
-                "season_id": self.season_id,
-                "event_id": self.event_id,
-                "category_id": self.category_id,
-                "session_id": self.session_id,
-                "status": status.value,
-            },
-        ).fetchone()
-        conn.commit()
-        conn.close()
+                {
+                    "id": self.id,
+                    "season_id": self.season_id,
+                    "event_id": self.event_id,
+                    "category_id": self.category_id,
+                    "session_id": self.session_id,
+                    "status": status.value,
+                },
+            ).fetchone()
+            conn.commit()
 
         self.status = TaskStatus(res[0])
 
 
-@dataclass
+@dataclass(slots=True)
 class Classification:
     season_id: str
     event_id: str
@@ -322,63 +464,272 @@ class Classification:
         )
 
     @staticmethod
-    def from_db(session_id: str):
-        conn = setup_duckdb()
+    def from_bytes(content: bytes, task: Task):
+        # schema specific decoding of the raw payload, skips fields we drop
+        rows = decode_classification(content)
+        results = [
+            RiderResult(Rider(id, name, country, number, team), position, points)
+            for id, name, country, number, team, position, points in rows
+        ]
+        return Classification(
+            task.season_id, task.event_id, task.category_id, task.session_id, results
+        )
+
+    @staticmethod
+    def from_db(session_id: str, riders: "RiderCache" = None):
+        return Classification.from_db_many([session_id], riders)[0]
+
+    @staticmethod
+    def from_db_many(session_ids: List[str], riders: "RiderCache" = None):
+        return Classification._query(
+            "fct.session_id IN (SELECT unnest($session_ids::VARCHAR[]))",
+            {"session_ids": session_ids},
+            riders,
+        )
+
+    @staticmethod
+    def from_db_season(
+        season_id: str, category_id: str = None, riders: "RiderCache" = None
+    ):
+        return Classification._query(
+            "fct.season_id = $season_id AND ($category_id IS NULL OR fct.category_id = $category_id)",
+            {"season_id": season_id, "category_id": category_id},
+            riders,
+        )
+
+    @staticmethod
+    def _query(where: str, params: Dict, riders: "RiderCache" = None):
+        # riders come from the join, or from the cache when one is given
+        join = "LEFT JOIN dwh.dim_rider AS rider ON rider.id = fct.rider_id"
+        columns = "rider.name, rider.country, rider.number, rider.team"
+        if riders is not None:
+            join = ""
+            columns = "NULL, NULL, NULL, NULL"
+
+        conn = duckdb_cursor()
         res = conn.execute(
-            """\
-SELECT 
-    season_id,
-    event_id,
-    category_id,
-    session_id,
-    rider_id,
-    position,
-    points
-FROM dwh.fct_classification
-WHERE session_id = ?""",
-            [session_id],
+            f"""\
+SELECT
+    fct.season_id,
+    fct.event_id,
+    fct.category_id,
+    fct.session_id,
+    fct.position,
+    fct.points,
+    fct.rider_id,
+    {columns}
+FROM dwh.fct_classification AS fct
+{join}
+WHERE {where}
+ORDER BY fct.session_id, fct.position NULLS LAST, fct.rider_id""",
+            params,
         ).fetchall()
-        conn.close()
 
-        season_id = res[0][0]
-        event_id = res[0][1]
-        category_id = res[0][2]
+        if riders is not None:
+            riders.load({row[6] for row in res})
 
-        rider_results = []
+        classifications: Dict[str, Classification] = {}
         for row in res:
-            rider = Rider.from_db(row[4])
-            rider_results.append(RiderResult(rider, row[5], row[6]))
+            session_id = row[3]
+            classification = classifications.get(session_id)
+            if classification is None:
+                classification = Classification(row[0], row[1], row[2], session_id, [])
+                classifications[session_id] = classification
 
-        return Classification(
-            season_id, event_id, category_id, session_id, rider_results
-        )
+            rider = riders.get(row[6]) if riders is not None else Rider(*row[6:])
+            classification.results.append(RiderResult(rider, row[4], row[5]))
+
+        return list(classifications.values())
 
     def sync(self):
-        rows = []
-        for result in self.results:
-            result.rider.sync()
-            rows.append(
-                [
-                    self.season_id,
-                    self.event_id,
-                    self.category_id,
-                    self.session_id,
-                    result.rider.id,
-                    result.position,
-                    result.points,
-                ]
+        Classification.sync_many([self])
+
+    @staticmethod
+    def sync_many(classifications: List["Classification"]):
+        batch = ClassificationBatch()
+        for c in classifications:
+            rows = [
+                (
+                    r.rider.id,
+                    r.rider.name,
+                    r.rider.country,
+                    r.rider.number,
+                    r.rider.team,
+                    r.position,
+                    r.points,
+                )
+                for r in c.results
+            ]
+            batch.add(c.season_id, c.event_id, c.category_id, c.session_id, rows)
+
+        batch.sync()
+
+
+# points can be fractional in the api, half points races score 12.5
+FACT_COLUMNS = {
+    "season_id": "VARCHAR",
+    "event_id": "VARCHAR",
+    "category_id": "VARCHAR",
+    "session_id": "VARCHAR",
+    "rider_id": "VARCHAR",
+    "position": "INT",
+    "points": "DOUBLE",
+    "team": "VARCHAR",
+}
+RIDER_COLUMNS = {
+    "id": "VARCHAR",
+    "name": "VARCHAR",
+    "country": "VARCHAR",
+    "team": "VARCHAR",
+    "number": "INT",
+}
+
+
+# decoded results held as columns, synced as arrow tables or unnested lists
+@dataclass
+class ClassificationBatch:
+    facts: Dict[str, List] = field(
+        default_factory=lambda: {name: [] for name in FACT_COLUMNS}
+    )
+    # latest details per rider, dim_rider keeps one row per id
+    riders: Dict[str, Tuple] = field(default_factory=dict)
+    # fact row index of every session and rider
+    keys: Dict[Tuple[str, str], int] = field(default_factory=dict)
+
+    @property
+    def size(self) -> int:
+        return len(self.facts["rider_id"])
+
+    def add(
+        self,
+        season_id: str,
+        event_id: str,
+        category_id: str,
+        session_id: str,
+        rows: List[ResultRow],
+    ):
+        for rider_id, name, country, number, team, position, points in rows:
+            self.riders[rider_id] = (rider_id, name, country, team, number)
+            row = (season_id, event_id, category_id, session_id, rider_id)
+            self.put(row + (position, points, team))
+
+    def put(self, row: Tuple):
+        # a session added twice keeps its latest result per rider, duckdb
+        # can not upsert the same key twice in one statement
+        facts = self.facts
+        index = self.keys.setdefault((row[3], row[4]), self.size)
+        if index == self.size:
+            for column, value in zip(FACT_COLUMNS, row):
+                facts[column].append(value)
+        else:
+            for column, value in zip(FACT_COLUMNS, row):
+                facts[column][index] = value
+
+    def merge(self, other: "ClassificationBatch"):
+        self.extend(other.facts, other.riders)
+
+    def extend(self, facts: Dict[str, List], riders: Dict[str, Tuple]):
+        # columns of another batch are concatenated as they are, rows only go
+        # through put when a session and rider key is already held
+        self.riders.update(riders)
+        start = self.size
+        keys = dict(
+            zip(
+                zip(facts["session_id"], facts["rider_id"]),
+                range(start, start + len(facts["rider_id"])),
             )
+        )
+        if self.keys.keys().isdisjoint(keys):
+            for column in FACT_COLUMNS:
+                self.facts[column].extend(facts[column])
+            self.keys.update(keys)
+            return None
 
-        if rows:
-            conn = setup_duckdb()
-            conn.executemany(
-                """\
-    INSERT OR REPLACE INTO dwh.fct_classification (season_id, event_id, category_id, session_id, rider_id, position, points, timestamp)
-    VALUES (?, ?, ?, ?, ?, ?, ?, get_current_timestamp())""",
-                rows,
+        for row in zip(*[facts[column] for column in FACT_COLUMNS]):
+            self.put(row)
+
+    def scored_events(self) -> List[str]:
+        # only sessions that award points move the standings
+        facts = self.facts
+        return list(
+            {e for e, p in zip(facts["event_id"], facts["points"]) if p is not None}
+        )
+
+    def rider_columns(self) -> Dict[str, List]:
+        columns = zip(*self.riders.values()) if self.riders else [[]] * 5
+        return {name: list(c) for name, c in zip(RIDER_COLUMNS, columns)}
+
+    def to_arrow(self) -> Tuple["pyarrow.Table", "pyarrow.Table"]:
+        return (
+            _arrow_table(self.facts, FACT_COLUMNS),
+            _arrow_table(self.rider_columns(), RIDER_COLUMNS),
+        )
+
+    def sync(self):
+        if self.size == 0:
+            return None
+
+        conn = duckdb_cursor()
+        if pyarrow is not None:
+            facts, riders = self.to_arrow()
+            conn.register("batch_facts", facts)
+            conn.register("batch_riders", riders)
+            facts_source, facts_params = "batch_facts", None
+            riders_source, riders_params = "batch_riders", None
+        else:
+            facts_source = _unnest_source(FACT_COLUMNS)
+            facts_params = self.facts
+            riders_source = _unnest_source(RIDER_COLUMNS)
+            riders_params = self.rider_columns()
+
+        try:
+            conn.begin()
+            conn.execute(
+                f"""\
+INSERT INTO dwh.dim_rider (id, name, country, team, number, timestamp)
+SELECT id, name, country, team, number, get_current_timestamp()
+FROM {riders_source}
+ON CONFLICT DO UPDATE
+SET name = excluded.name, country = excluded.country, team = excluded.team, number = excluded.number, timestamp = excluded.timestamp""",
+                riders_params,
             )
+            conn.execute(
+                f"""\
+INSERT INTO dwh.fct_classification (season_id, event_id, category_id, session_id, rider_id, position, points, team, timestamp)
+SELECT season_id, event_id, category_id, session_id, rider_id, position, points, team, get_current_timestamp()
+FROM {facts_source}
+ON CONFLICT (session_id, rider_id) DO UPDATE
+SET season_id = excluded.season_id, event_id = excluded.event_id, category_id = excluded.category_id, position = excluded.position, points = excluded.points, team = excluded.team, timestamp = excluded.timestamp""",
+                facts_params,
+            )
+            update_standings(conn, self.scored_events())
             conn.commit()
-            conn.close()
+        except Exception:
+            conn.rollback()
+            raise
+        finally:
+            if pyarrow is not None:
+                conn.unregister("batch_facts")
+                conn.unregister("batch_riders")
+
+
+def _arrow_table(columns: Dict[str, List], types: Dict[str, str]) -> "pyarrow.Table":
+    arrow_types = {
+        "VARCHAR": pyarrow.string(),
+        "INT": pyarrow.int32(),
+        "DOUBLE": pyarrow.float64(),
+    }
+    return pyarrow.table(
+        {name: pyarrow.array(columns[name], arrow_types[types[name]]) for name in types}
+    )
+
+
+def _unnest_source(columns: Dict[str, str]) -> str:
+    # whole columns bound as list parameters and unnested side by side
+    unnests = ", ".join(
+        f"unnest(${name}::{type}[]) AS {name}" for name, type in columns.items()
+    )
+    return f"(SELECT {unnests})"
 
 
 @dataclass
@@ -403,26 +754,186 @@ class TaskQueue:
                     "session_id": task.session_id,
                     "status": task.status.value,
                     "attempt": task.attempt,
+                    "event_end": _isoformat(task.event_end),
                 }
             )
 
-        conn = setup_sqlite()
-        conn.executemany(
-            """\
+        with sqlite_connection() as conn:
+            conn.executemany(
+                """\
 INSERT INTO tasks (
     id,
     season_id,
     event_id,
     category_id,
     session_id,
+    event_end,
     added_timestamp
-) VALUES (:id, :season_id, :event_id, :category_id, :session_id, current_timestamp)
+) VALUES (:id, :season_id, :event_id, :category_id, :session_id, :event_end, current_timestamp)
 ON CONFLICT DO UPDATE
 SET status = :status, attempt = :attempt, updated_timestamp = current_timestamp""",
-            records,
-        )
-        conn.commit()
-        conn.close()
+                records,
+            )
+            conn.commit()
+
+    def enqueue(self, requeue: bool = False) -> int:
+        # sessions that already have a task, whatever its id or status, are
+        # not added again, requeue resets the ones not in flight to new
+        records = [
+            {
+                "id": task.id,
+                "season_id": task.season_id,
+                "event_id": task.event_id,
+                "category_id": task.category_id,
+                "session_id": task.session_id,
+                "event_end": _isoformat(task.event_end),
+            }
+            for task in self.tasks
+        ]
+
+        with sqlite_connection() as conn:
+            res = conn.executemany(
+                """\
+INSERT INTO tasks (id, season_id, event_id, category_id, session_id, event_end, added_timestamp)
+SELECT :id, :season_id, :event_id, :category_id, :session_id, :event_end, current_timestamp
+WHERE NOT EXISTS (SELECT 1 FROM tasks WHERE session_id = :session_id)
+ON CONFLICT DO NOTHING""",
+                records,
+            )
+            added = res.rowcount
+            # tasks queued before event_end was kept get it from the listing
+            conn.executemany(
+                """\
+UPDATE tasks
+SET event_end = :event_end
+WHERE session_id = :session_id AND event_end IS NULL AND :event_end IS NOT NULL""",
+                records,
+            )
+            if requeue:
+                conn.execute(
+                    """\
+UPDATE tasks
+SET status = :new, attempt = 0, updated_timestamp = current_timestamp, next_attempt_timestamp = NULL
+WHERE session_id IN (SELECT value FROM json_each(:session_ids)) AND status != :queued""",
+                    {
+                        "new": TaskStatus.NEW.value,
+                        "queued": TaskStatus.QUEUED.value,
+                        "session_ids": json.dumps([r["session_id"] for r in records]),
+                    },
+                )
+            conn.commit()
+
+        get_metrics().inc("motogp_tasks_enqueued_total", added)
+        return added
+
+    def update_status(self, status: TaskStatus):
+        TaskQueue.update_statuses({status: [task.id for task in self.tasks]})
+        for task in self.tasks:
+            task.status = status
+
+    @staticmethod
+    def update_statuses(
+        updates: Dict[TaskStatus, List[str]], retries: Dict[str, float] = None
+    ):
+        # one UPDATE per status with the ids bound as a single json array,
+        # errored tasks also get the timestamp of their next attempt
+        with sqlite_connection() as conn:
+            for status, ids in updates.items():
+                if not ids:
+                    continue
+
+                conn.execute(
+                    """\
+UPDATE tasks
+SET status = :status, updated_timestamp = current_timestamp, lease_expires_timestamp = NULL
+WHERE id IN (SELECT value FROM json_each(:ids))""",
+                    {"status": status.value, "ids": json.dumps(ids)},
+                )
+            if retries:
+                conn.executemany(
+                    """\
+UPDATE tasks
+SET next_attempt_timestamp = :next_attempt
+WHERE id = :id""",
+                    [{"id": k, "next_attempt": v} for k, v in retries.items()],
+                )
+            conn.commit()
+
+    @staticmethod
+    def next_attempt_timestamp():
+        with sqlite_connection() as conn:
+            res = conn.execute(
+                "SELECT MIN(next_attempt_timestamp) FROM tasks WHERE status = ?",
+                [TaskStatus.ERROR.value],
+            ).fetchone()
+
+        return res[0]
+
+    @staticmethod
+    def claim(
+        worker_id: str, limit: int, lease: float = LEASE_SECONDS, ids: List[str] = None
+    ):
+        # new tasks, queued tasks whose lease ran out and errored tasks due a
+        # retry are claimable, the single UPDATE ... RETURNING makes the claim
+        # atomic across processes, ids restricts the claim to those tasks
+        now = time.time()
+        with sqlite_connection() as conn:
+            res = conn.execute(
+                """\
+UPDATE tasks
+SET
+    status = :queued,
+    worker_id = :worker_id,
+    lease_expires_timestamp = :now + :lease,
+    heartbeat_timestamp = :now,
+    attempt = attempt + 1,
+    updated_timestamp = current_timestamp
+WHERE id IN (
+    SELECT id
+    FROM tasks
+    WHERE (
+        status = :new
+        OR (status = :queued AND coalesce(lease_expires_timestamp, 0) < :now)
+        OR (status = :error AND coalesce(next_attempt_timestamp, 0) <= :now)
+    )
+    AND (:ids IS NULL OR id IN (SELECT value FROM json_each(:ids)))
+    ORDER BY added_timestamp
+    LIMIT :limit
+)
+RETURNING id, season_id, event_id, category_id, session_id, status, attempt, event_end""",
+                {
+                    "new": TaskStatus.NEW.value,
+                    "queued": TaskStatus.QUEUED.value,
+                    "error": TaskStatus.ERROR.value,
+                    "worker_id": worker_id,
+                    "now": now,
+                    "lease": lease,
+                    "limit": limit,
+                    "ids": json.dumps(ids) if ids is not None else None,
+                },
+            ).fetchall()
+            conn.commit()
+
+        get_metrics().inc("motogp_task_transitions_total", len(res), status="queued")
+        return TaskQueue.from_list([Task.from_row(row) for row in res])
+
+    @staticmethod
+    def heartbeat(worker_id: str, lease: float = LEASE_SECONDS):
+        now = time.time()
+        with sqlite_connection() as conn:
+            conn.execute(
+                """\
+UPDATE tasks
+SET heartbeat_timestamp = :now, lease_expires_timestamp = :now + :lease
+WHERE worker_id = :worker_id AND status = :queued""",
+                {
+                    "now": now,
+                    "lease": lease,
+                    "worker_id": worker_id,
+                    "queued": TaskStatus.QUEUED.value,
+                },
+            )
+            conn.commit()
 
     @staticmethod
     def from_db(status_upper_bound: TaskStatus, limit: int = None):
@@ -434,31 +945,112 @@ SELECT
     category_id,
     session_id,
     status,
-    attempt
+    attempt,
+    event_end
 FROM tasks
 WHERE status <= :status_bound
+ORDER BY rowid
 LIMIT :limit"""
 
-        conn = setup_sqlite()
         params = {
             "status_bound": status_upper_bound.value,
             "limit": limit if limit else 2**32,  # sqlite max
         }
-        res = conn.execute(query, params).fetchall()
-        conn.close()
+        with sqlite_connection() as conn:
+            res = conn.execute(query, params).fetchall()
 
-        tasks = []
-        for row in res:
-            tasks.append(
-                Task(
-                    row[0],
-                    row[1],
-                    row[2],
-                    row[3],
-                    row[4],
-                    TaskStatus(row[5]),
-                    row[6],
-                )
-            )
+        return TaskQueue.from_list([Task.from_row(row) for row in res])
+
+
+def _isoformat(date: datetime.date) -> str:
+    return date.isoformat() if date is not None else None
+
+
+def retry_delay(
+    attempt: int,
+    base: float = RETRY_BASE_DELAY,
+    cap: float = RETRY_MAX_DELAY,
+) -> float:
+    # exponential backoff with jitter over the upper half of the window
+    delay = min(cap, base * 2 ** max(attempt - 1, 0))
+    return delay / 2 + random.uniform(0, delay / 2)
+
+
+# task status transitions written in batches, errored tasks are retried with
+# backoff until max_attempts
+class StatusRecorder:
+    def __init__(
+        self,
+        batch_size: int = STATUS_BATCH_SIZE,
+        flush_interval: float = STATUS_FLUSH_INTERVAL,
+        max_attempts: int = MAX_ATTEMPTS,
+    ):
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.max_attempts = max_attempts
+        self.pending: Dict[str, TaskStatus] = {}
+        self.retries: Dict[str, float] = {}
+        self.lock = threading.Lock()
+        # set while run() is active, wakes it up for a full buffer
+        self.due: asyncio.Event = None
+
+    def record(self, task: Task, status: TaskStatus):
+        if status == TaskStatus.ERROR and task.attempt >= self.max_attempts:
+            status = TaskStatus.DEAD
+
+        task.status = status
+        metrics = get_metrics()
+        metrics.inc("motogp_task_transitions_total", status=status.name.lower())
+        if status == TaskStatus.ERROR:
+            metrics.inc("motogp_task_retries_total")
+
+        with self.lock:
+            self.pending[task.id] = status
+            if status == TaskStatus.ERROR:
+                self.retries[task.id] = time.time() + retry_delay(task.attempt)
+            else:
+                self.retries.pop(task.id, None)
+            full = len(self.pending) >= self.batch_size
+
+        if not full:
+            return None
+
+        try:
+            asyncio.get_running_loop()
+        except RuntimeError:
+            # off the event loop the caller can wait for the write
+            self.flush()
+            return None
+
+        if self.due is not None:
+            self.due.set()
+
+    def flush(self):
+        with self.lock:
+            pending, self.pending = self.pending, {}
+            retries, self.retries = self.retries, {}
+
+        updates: Dict[TaskStatus, List[str]] = {}
+        for id, status in pending.items():
+            updates.setdefault(status, []).append(id)
+
+        metrics = get_metrics()
+        with metrics.timer("motogp_db_flush_seconds", target="statuses"):
+            TaskQueue.update_statuses(updates, retries)
+        metrics.observe(
+            "motogp_db_flush_rows", len(pending), SIZE_BUCKETS, target="statuses"
+        )
+
+    async def run(self):
+        self.due = asyncio.Event()
+        try:
+            while True:
+                try:
+                    await asyncio.wait_for(self.due.wait(), self.flush_interval)
+                except asyncio.TimeoutError:
+                    pass
 
-        return TaskQueue.from_list(tasks)
+                self.due.clear()
+                await asyncio.to_thread(self.flush)
+        finally:
+            self.due = None
@@ -0,0 +1,76 @@
+import asyncio
+import sys
+
+from motogp.archive import setup_archive, close_archive
+from motogp.cache import ResponseCache
+from motogp.client import get_client, setup_client, close_client
+from motogp.consumer import (
+    CLAIM_BATCH_SIZE,
+    claim_tasks,
+    export,
+    new_worker_id,
+    start_workers,
+    stop_workers,
+)
+from motogp.database import close_connections
+from motogp.logger import setup_logger
+from motogp.metrics import close_metrics, setup_metrics
+from motogp.model import StatusRecorder
+from motogp.producer import Crawler
+
+
+# crawls and consumes in one process, sessions go to the workers as they are
+# found
+async def run(limit: int = 0, incremental: bool = True):
+    logger = setup_logger("pipeline")
+    client = get_client()
+
+    worker_id = new_worker_id()
+    logger.info("pipeline worker_id: %s", worker_id)
+
+    queue = asyncio.Queue(maxsize=CLAIM_BATCH_SIZE)
+    write_queue = asyncio.Queue()
+    recorder = StatusRecorder()
+    workers = start_workers(
+        worker_id, queue, write_queue, recorder, client.limiter.max_concurrency
+    )
+    try:
+        crawler = Crawler(limit, incremental, queue=queue, worker_id=worker_id)
+        await crawler.crawl()
+
+        remaining = limit - crawler.count
+        if limit <= 0 or remaining > 0:
+            await claim_tasks(worker_id, remaining, queue, write_queue, recorder)
+    finally:
+        await stop_workers(workers, queue, write_queue, recorder)
+
+    logger.info("rate limits: %s", client.limiter.limits())
+
+
+async def main(limit: int, incremental: bool, replay: bool = False):
+    logger = setup_logger("pipeline")
+    logger.info("started pipeline")
+
+    setup_client(cache=ResponseCache(), refresh=not incremental)
+    setup_archive(replay=replay)
+    setup_metrics()
+    try:
+        await run(limit=limit, incremental=incremental)
+        export()
+    finally:
+        await close_client()
+        close_archive()
+        close_connections()
+        close_metrics()
+
+    logger.info("finished pipeline")
+
+
+if __name__ == "__main__":
+    args = []
+    file, limit, load_type, *args = sys.argv
+    replay = "replay" in args
+    if load_type == "inc":
+        asyncio.run(main(limit=int(limit), incremental=True, replay=replay))
+    else:
+        asyncio.run(main(limit=int(limit), incremental=False, replay=replay))
@@ -1,9 +1,16 @@
 # import sys
 import asyncio
 import sys
-import uuid
+from typing import List, Set, Tuple
 
+from motogp.archive import ArchiveMiss, setup_archive, close_archive
+from motogp.cache import ResponseCache
+from motogp.client import setup_client, close_client
+from motogp.database import close_connections
 from motogp.endpoints import (
+    async_get_seasons,
+    async_get_events,
+    async_get_categories,
     async_get_sessions,
     get_seasons,
     get_events,
@@ -11,74 +18,297 @@ from motogp.endpoints import (
     get_sessions,
 )
 from motogp.logger import setup_logger
+from motogp.metrics import SIZE_BUCKETS, close_metrics, get_metrics, setup_metrics
 from motogp.model import (
     Season,
     Event,
     Category,
     Session,
+    Dimensions,
     Task,
-    TaskStatus,
+    TaskQueue,
 )
+from motogp.state import SyncState
 
+SEASON_CONCURRENCY = 4
+EVENT_CONCURRENCY = 16
+CATEGORY_CONCURRENCY = 32
+ENQUEUE_BATCH_SIZE = 500
+# seconds sessions found by a pipeline crawl wait before being published
+PUBLISH_INTERVAL = 0.5
 
-async def do_task(
-    season: Season,
-    event: Event,
-    category: Category,
-    session: Session,
-    count: int,
-    limit: int,
-):
-    logger = setup_logger("producer")
 
-    if limit > 0 and count >= limit:
-        logger.info("producer hit limit: %s", limit)
-        raise asyncio.LimitOverrunError("hit limit %s" % limit, count)
-
-    logger.info("enqueuing session: %s", session.name)
-    season.sync()
-    event.sync()
-    category.sync()
-    session.sync()
-    task = Task(
-        str(uuid.uuid4()),
-        season.id,
-        event.id,
-        category.id,
-        session.id,
-    )
-    task.upsert_status(TaskStatus.NEW)
+# buffers found sessions and writes them with their dimensions in batches
+class Enqueuer:
+    def __init__(
+        self,
+        batch_size: int = ENQUEUE_BATCH_SIZE,
+        requeue: bool = False,
+        worker_id: str = None,
+        auto_flush: bool = True,
+    ):
+        self.batch_size = batch_size
+        self.requeue = requeue
+        self.worker_id = worker_id
+        self.auto_flush = auto_flush
+        # tasks claimed for worker_id on flush, waiting to be handed over
+        self.claimed: List[Task] = []
+        self.dimensions = Dimensions()
+        self.tasks: List[Task] = []
+        self.synced: Set[str] = set()
+        self.logger = setup_logger("producer")
+
+    def add(self, season: Season, event: Event, category: Category, session: Session):
+        self.logger.info("enqueuing session: %s", session.name)
+        # dimension rows already written this run are not written again
+        if season.id not in self.synced:
+            self.dimensions.seasons[season.id] = season
+        if event.id not in self.synced:
+            self.dimensions.events[event.id] = event
+        if category.id not in self.synced:
+            self.dimensions.categories[category.id] = category
+        if session.id not in self.synced:
+            self.dimensions.sessions[session.id] = session
+
+        self.tasks.append(
+            Task.from_session(season.id, event.id, category.id, session.id, event.end)
+        )
+
+        if self.auto_flush and self.full:
+            self.flush()
+
+    @property
+    def full(self) -> bool:
+        return len(self.tasks) >= self.batch_size
+
+    def flush(self):
+        self.claimed.extend(self.write(*self.take()))
+
+    def take(self) -> Tuple[Dimensions, List[Task]]:
+        # empties the buffer, what it held counts as synced from now on
+        dimensions, tasks = self.dimensions, self.tasks
+        self.synced.update(dimensions.seasons)
+        self.synced.update(dimensions.events)
+        self.synced.update(dimensions.categories)
+        self.synced.update(dimensions.sessions)
+        self.dimensions = Dimensions()
+        self.tasks = []
+        return dimensions, tasks
+
+    def write(self, dimensions: Dimensions, tasks: List[Task]) -> List[Task]:
+        # returns the tasks claimed for worker_id
+        if not tasks and dimensions.size == 0:
+            return []
+
+        self.logger.info(
+            "flushing %s tasks, %s dimensions", len(tasks), dimensions.size
+        )
+        metrics = get_metrics()
+        with metrics.timer("motogp_db_flush_seconds", target="tasks"):
+            dimensions.sync()
+            added = TaskQueue.from_list(tasks).enqueue(self.requeue)
+        metrics.observe(
+            "motogp_db_flush_rows", len(tasks), SIZE_BUCKETS, target="tasks"
+        )
+        self.logger.info("added %s new tasks", added)
+        if self.worker_id is None:
+            return []
+
+        ids = [task.id for task in tasks]
+        return TaskQueue.claim(self.worker_id, len(ids), ids=ids).tasks
+
+
+# walks seasons, events, categories and sessions concurrently, one semaphore
+# per level
+class Crawler:
+    def __init__(
+        self,
+        limit: int = 0,
+        incremental: bool = True,
+        season_concurrency: int = SEASON_CONCURRENCY,
+        event_concurrency: int = EVENT_CONCURRENCY,
+        category_concurrency: int = CATEGORY_CONCURRENCY,
+        queue: asyncio.Queue = None,
+        worker_id: str = None,
+        publish_interval: float = PUBLISH_INTERVAL,
+    ):
+        self.limit = limit
+        self.incremental = incremental
+        self.count = 0
+        self.queue = queue
+        self.publish_interval = publish_interval
+        self.publishing = asyncio.Lock()
+        self.enqueuer = Enqueuer(
+            requeue=not incremental, worker_id=worker_id, auto_flush=False
+        )
+        self.state = SyncState()
+        self.logger = setup_logger("producer")
+        self.seasons = asyncio.Semaphore(season_concurrency)
+        self.events = asyncio.Semaphore(event_concurrency)
+        self.categories = asyncio.Semaphore(category_concurrency)
+
+    @property
+    def done(self) -> bool:
+        return self.limit > 0 and self.count >= self.limit
+
+    async def crawl(self):
+        try:
+            seasons = await async_get_seasons()
+        except ArchiveMiss as err:
+            self.logger.warning("skipping crawl, seasons not archived: %s", err)
+            return None
+
+        if self.incremental:
+            seasons = [s for s in seasons if not self.state.season_settled(s)]
+
+        # stopped, not cancelled, so a batch it already claimed is put on the
+        # queue
+        stop = asyncio.Event()
+        publisher = None
+        if self.queue is not None:
+            publisher = asyncio.create_task(self.publish_every(stop))
+        try:
+            await asyncio.gather(*[self.crawl_season(s) for s in seasons])
+        finally:
+            stop.set()
+            if publisher is not None:
+                await publisher
+            await self.publish()
+
+        # state is only stored once the tasks it covers are
+        self.state.save()
+
+    # each crawl_* returns whether its whole subtree was crawled, a subtree
+    # missing from the archive in replay is skipped and left unmarked
+    async def crawl_season(self, season: Season) -> bool:
+        if self.done:
+            return False
+
+        try:
+            async with self.seasons:
+                events = await async_get_events(season.id)
+        except ArchiveMiss as err:
+            self.logger.warning(
+                "skipping season %s, not archived: %s", season.year, err
+            )
+            return False
+
+        if self.incremental:
+            events = [e for e in events if not self.state.event_settled(e)]
+
+        self.logger.info("enqueuing season: %s", season.year)
+        crawled = await asyncio.gather(*[self.crawl_event(season, e) for e in events])
+        if all(crawled) and not self.done:
+            self.state.mark_season(season)
+            return True
+
+        return False
+
+    async def crawl_event(self, season: Season, event: Event) -> bool:
+        if self.done:
+            return False
+
+        try:
+            async with self.events:
+                categories = await async_get_categories(event.id, season.id)
+        except ArchiveMiss as err:
+            self.logger.warning(
+                "skipping event %s, not archived: %s", event.short_name, err
+            )
+            return False
+
+        self.logger.info("enqueuing event: %s", event.short_name)
+        crawled = await asyncio.gather(
+            *[self.crawl_category(season, event, c) for c in categories]
+        )
+        if all(crawled) and not self.done:
+            self.state.mark_event(event)
+            return True
+
+        return False
+
+    async def crawl_category(
+        self, season: Season, event: Event, category: Category
+    ) -> bool:
+        if self.done:
+            return False
+
+        try:
+            async with self.categories:
+                sessions = await async_get_sessions(event.id, category.id, season.id)
+        except ArchiveMiss as err:
+            self.logger.warning(
+                "skipping category %s of %s, not archived: %s",
+                category.name,
+                event.short_name,
+                err,
+            )
+            return False
+
+        if self.incremental and not self.state.sessions_changed(
+            event, category, sessions
+        ):
+            return True
+
+        crawled = False
+        self.logger.info("enqueuing category: %s", category.name)
+        for session in sessions:
+            if self.done:
+                self.logger.info("producer hit limit: %s", self.limit)
+                break
+
+            self.enqueuer.add(season, event, category, session)
+            self.count += 1
+            self.logger.info(
+                "load item: %s/%s",
+                self.count,
+                self.limit if self.limit > 0 else "inf",
+            )
+            if self.enqueuer.full:
+                await self.publish(if_full=True)
+        else:
+            self.state.mark_sessions(event, category, sessions)
+            crawled = True
+
+        return crawled
+
+    async def publish(self, if_full: bool = False):
+        # one batch is written at a time, in the order it was found, callers
+        # waiting on a full buffer find it taken by the one before them
+        async with self.publishing:
+            if if_full and not self.enqueuer.full:
+                return None
+
+            batch = self.enqueuer.take()
+            tasks = await asyncio.to_thread(self.enqueuer.write, *batch)
+
+        if self.queue is None:
+            return None
+
+        # waits while the consumers are behind, which slows the walk down
+        for task in tasks:
+            await self.queue.put(task)
+
+    async def publish_every(self, stop: asyncio.Event):
+        while True:
+            try:
+                # the crawl publishes what is left once it stops
+                await asyncio.wait_for(stop.wait(), self.publish_interval)
+                return None
+            except asyncio.TimeoutError:
+                pass
+
+            if self.enqueuer.tasks:
+                await self.publish()
 
 
 async def async_produce_tasks(limit: int = 0, incremental: bool = True):
-    count = 0
     logger = setup_logger("producer")
     logger.info("started producer")
 
-    for season in get_seasons(incremental):
-        logger.info("enqueuing season: %s", season.year)
-        for event in get_events(season.id, incremental):
-            logger.info("enqueuing event: %s", event.short_name)
-            for category in get_categories(event.id):
-                logger.info("enqueuing category: %s", category.name)
-                sessions = await async_get_sessions(event.id, category.id)
-                tasks = [
-                    asyncio.create_task(
-                        do_task(
-                            season,
-                            event,
-                            category,
-                            x,
-                            count,
-                            limit,
-                        )
-                    )
-                    for x in sessions
-                ]
-                count += len(tasks)
-                logger.info("load item: %s/%s", count, limit if limit > 0 else "inf")
+    await Crawler(limit, incremental).crawl()
 
-                await asyncio.gather(*tasks)
+    logger.info("finished producer")
 
 
 def produce_tasks(limit: int = 0, incremental: bool = True):
@@ -86,46 +316,69 @@ def produce_tasks(limit: int = 0, incremental: bool = True):
     logger = setup_logger("producer")
     logger.info("started producer")
 
-    for season in get_seasons(incremental):
-        logger.info("enqueuing season: %s", season.year)
-        for event in get_events(season.id, incremental):
-            logger.info("enqueuing event: %s", event.short_name)
-            for category in get_categories(event.id):
-                logger.info("enqueuing category: %s", category.name)
-                for session in get_sessions(event.id, category.id):
-                    if limit > 0 and count >= limit:
-                        logger.info("producer hit limit: %s", limit)
-                        return None
-
-                    logger.info("enqueuing session: %s", session.name)
-                    season.sync()
-                    event.sync()
-                    category.sync()
-                    session.sync()
-                    task = Task(
-                        str(uuid.uuid4()),
-                        season.id,
-                        event.id,
-                        category.id,
-                        session.id,
-                    )
-                    task.upsert_status(TaskStatus.NEW)
-                    count += 1
-                    logger.info(
-                        "load item: %s/%s", count, limit if limit > 0 else "inf"
-                    )
+    enqueuer = Enqueuer(requeue=not incremental)
+    state = SyncState()
+    try:
+        for season in get_seasons():
+            if incremental and state.season_settled(season):
+                continue
+
+            logger.info("enqueuing season: %s", season.year)
+            for event in get_events(season.id):
+                if incremental and state.event_settled(event):
+                    continue
+
+                logger.info("enqueuing event: %s", event.short_name)
+                for category in get_categories(event.id, season.id):
+                    sessions = get_sessions(event.id, category.id, season.id)
+                    if incremental and not state.sessions_changed(
+                        event, category, sessions
+                    ):
+                        continue
+
+                    logger.info("enqueuing category: %s", category.name)
+                    for session in sessions:
+                        if limit > 0 and count >= limit:
+                            logger.info("producer hit limit: %s", limit)
+                            return None
+
+                        enqueuer.add(season, event, category, session)
+                        count += 1
+                        logger.info(
+                            "load item: %s/%s", count, limit if limit > 0 else "inf"
+                        )
+
+                    state.mark_sessions(event, category, sessions)
+
+                state.mark_event(event)
+
+            state.mark_season(season)
+    finally:
+        enqueuer.flush()
+        state.save()
 
     logger.info("finished producer")
 
 
-async def main(limit: int, incremental: bool):
-    await async_produce_tasks(limit=limit, incremental=incremental)
+async def main(limit: int, incremental: bool, replay: bool = False):
+    # full runs fetch every listing again instead of trusting the cache
+    setup_client(cache=ResponseCache(), refresh=not incremental)
+    setup_archive(replay=replay)
+    setup_metrics()
+    try:
+        await async_produce_tasks(limit=limit, incremental=incremental)
+    finally:
+        await close_client()
+        close_archive()
+        close_connections()
+        close_metrics()
 
 
 if __name__ == "__main__":
     args = []
     file, limit, load_type, *args = sys.argv
+    replay = "replay" in args
     if load_type == "inc":
-        asyncio.run(main(limit=int(limit), incremental=True))
+        asyncio.run(main(limit=int(limit), incremental=True, replay=replay))
     else:
-        asyncio.run(main(limit=int(limit), incremental=False))
+        asyncio.run(main(limit=int(limit), incremental=False, replay=replay))
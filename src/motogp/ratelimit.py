@@ -0,0 +1,180 @@
+import asyncio
+import contextlib
+import datetime
+import email.utils
+import logging
+import threading
+import time
+from typing import Dict
+
+DEFAULT_RATE = 20.0
+DEFAULT_MIN_RATE = 1.0
+DEFAULT_MAX_RATE = 200.0
+DEFAULT_CONCURRENCY = 8
+DEFAULT_MIN_CONCURRENCY = 1
+DEFAULT_MAX_CONCURRENCY = 64
+DEFAULT_TARGET_LATENCY = 2.0
+RATE_INCREASE = 0.5
+DECREASE_FACTOR = 0.5
+# status codes the api uses to tell us to slow down
+THROTTLE_STATUS_CODES = {429, 503}
+
+
+def parse_retry_after(value: str) -> float:
+    if value is None:
+        return None
+
+    try:
+        return max(float(value), 0.0)
+    except ValueError:
+        pass
+
+    try:
+        when = email.utils.parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return None
+
+    now = datetime.datetime.now(datetime.timezone.utc)
+    return max((when - now).total_seconds(), 0.0)
+
+
+class TokenBucket:
+    def __init__(self, rate: float, burst: float = None):
+        self.rate = rate
+        self.burst = burst if burst is not None else rate
+        self.tokens = self.burst
+        self.updated = time.monotonic()
+        self.paused_until = 0.0
+        self.lock = threading.Lock()
+
+    def _reserve(self) -> float:
+        # takes a token and returns how long the caller must wait for it
+        with self.lock:
+            now = time.monotonic()
+            self.tokens = min(
+                self.burst, self.tokens + (now - self.updated) * self.rate
+            )
+            self.updated = now
+            self.tokens -= 1
+
+            wait = 0.0 if self.tokens >= 0 else -self.tokens / self.rate
+            return max(wait, self.paused_until - now)
+
+    def pause(self, seconds: float):
+        with self.lock:
+            self.paused_until = max(self.paused_until, time.monotonic() + seconds)
+
+    async def acquire(self):
+        wait = self._reserve()
+        if wait > 0:
+            await asyncio.sleep(wait)
+
+    def acquire_sync(self):
+        wait = self._reserve()
+        if wait > 0:
+            time.sleep(wait)
+
+
+# token bucket rate with an AIMD concurrency limit, paused by Retry-After
+class AdaptiveLimiter:
+    def __init__(
+        self,
+        rate: float = DEFAULT_RATE,
+        min_rate: float = DEFAULT_MIN_RATE,
+        max_rate: float = DEFAULT_MAX_RATE,
+        concurrency: int = DEFAULT_CONCURRENCY,
+        min_concurrency: int = DEFAULT_MIN_CONCURRENCY,
+        max_concurrency: int = DEFAULT_MAX_CONCURRENCY,
+        target_latency: float = DEFAULT_TARGET_LATENCY,
+    ):
+        self.min_rate = min_rate
+        self.max_rate = max_rate
+        self.min_concurrency = min_concurrency
+        self.max_concurrency = max_concurrency
+        self.target_latency = target_latency
+
+        self.bucket = TokenBucket(rate, burst=max(rate, 1.0))
+        self.concurrency = float(concurrency)
+        self.in_flight = 0
+        self.last_decrease = 0.0
+        self.logger = logging.getLogger("ratelimit")
+
+        self._condition = None
+        self._loop = None
+
+    @property
+    def rate(self) -> float:
+        return self.bucket.rate
+
+    @property
+    def limit(self) -> int:
+        return max(int(self.concurrency), self.min_concurrency)
+
+    def limits(self) -> Dict:
+        return {
+            "rate": round(self.rate, 2),
+            "concurrency": self.limit,
+            "in_flight": self.in_flight,
+        }
+
+    @property
+    def condition(self) -> asyncio.Condition:
+        loop = asyncio.get_running_loop()
+        if self._condition is None or self._loop is not loop:
+            self._condition = asyncio.Condition()
+            self._loop = loop
+
+        return self._condition
+
+    @contextlib.asynccontextmanager
+    async def acquire(self):
+        condition = self.condition
+        async with condition:
+            await condition.wait_for(lambda: self.in_flight < self.limit)
+            self.in_flight += 1
+
+        try:
+            await self.bucket.acquire()
+            yield self
+        finally:
+            async with condition:
+                self.in_flight -= 1
+                condition.notify_all()
+
+    @contextlib.contextmanager
+    def acquire_sync(self):
+        self.bucket.acquire_sync()
+        self.in_flight += 1
+        try:
+            yield self
+        finally:
+            self.in_flight -= 1
+
+    def record(
+        self, latency: float, status_code: int = None, retry_after: float = None
+    ):
+        if retry_after:
+            self.bucket.pause(retry_after)
+
+        throttled = status_code is None or status_code in THROTTLE_STATUS_CODES
+        if throttled or status_code >= 500 or latency > self.target_latency:
+            self.decrease()
+        else:
+            self.increase()
+
+    def increase(self):
+        # additive: roughly one more request in flight per window of successes
+        self.concurrency = min(
+            self.max_concurrency, self.concurrency + 1 / self.concurrency
+        )
+        self.bucket.rate = min(self.max_rate, self.rate + RATE_INCREASE / self.limit)
+
+    def decrease(self):
+        now = time.monotonic()
+        if now - self.last_decrease < self.target_latency:
+            return None
+
+        self.last_decrease = now
+        self.concurrency = max(self.min_concurrency, self.concurrency * DECREASE_FACTOR)
+        self.bucket.rate = max(self.min_rate, self.rate * DECREASE_FACTOR)
+        self.logger.info("backing off, limits: %s", self.limits())
@@ -0,0 +1,6 @@
+CREATE TABLE IF NOT EXISTS sync_state (
+    key TEXT PRIMARY KEY,
+    hash TEXT,
+    watermark TEXT,
+    updated_timestamp REAL
+)
\ No newline at end of file
@@ -7,5 +7,10 @@ CREATE TABLE IF NOT EXISTS tasks (
     status INTEGER DEFAULT 0,
     attempt INTEGER DEFAULT 0,
     added_timestamp INTEGER,
-    updated_timestamp INTEGER
+    updated_timestamp INTEGER,
+    worker_id TEXT,
+    lease_expires_timestamp REAL,
+    heartbeat_timestamp REAL,
+    next_attempt_timestamp REAL,
+    event_end TEXT
 )
\ No newline at end of file
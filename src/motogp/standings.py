@@ -0,0 +1,78 @@
+from typing import List
+
+import duckdb
+
+# standings table and the fct_classification expression it is ranked by,
+# every table holds one row per season, category, event and key
+STANDINGS = {
+    "dwh.agg_standings_rider": ("rider_id", "fct.rider_id"),
+    "dwh.agg_standings_team": ("team", "coalesce(fct.team, '')"),
+}
+
+
+# sums the points of the given events, then the running season totals from the
+# earliest changed event on
+def update_standings(conn: duckdb.DuckDBPyConnection, event_ids: List[str]):
+    if not event_ids:
+        return None
+
+    for table, (key, expression) in STANDINGS.items():
+        conn.execute(
+            f"""\
+INSERT INTO {table} (season_id, category_id, event_id, event_date, {key}, event_points, points, timestamp)
+SELECT
+    fct.season_id,
+    fct.category_id,
+    fct.event_id,
+    any_value(event.date_start),
+    {expression},
+    sum(coalesce(fct.points, 0)),
+    0,
+    get_current_timestamp()
+FROM dwh.fct_classification AS fct
+LEFT JOIN dwh.dim_event AS event ON event.id = fct.event_id
+WHERE fct.event_id IN (SELECT unnest($event_ids::VARCHAR[]))
+GROUP BY fct.season_id, fct.category_id, fct.event_id, {expression}
+ON CONFLICT DO UPDATE
+SET event_date = excluded.event_date, event_points = excluded.event_points, timestamp = excluded.timestamp""",
+            {"event_ids": event_ids},
+        )
+        conn.execute(
+            f"""\
+WITH changed AS (
+    SELECT season_id, category_id, min(event_date) AS since
+    FROM {table}
+    WHERE event_id IN (SELECT unnest($event_ids::VARCHAR[]))
+    GROUP BY season_id, category_id
+)
+UPDATE {table} AS standings
+SET points = totals.points
+FROM (
+    SELECT
+        s.season_id,
+        s.category_id,
+        s.event_id,
+        s.{key},
+        s.event_date,
+        changed.since,
+        sum(s.event_points) OVER (
+            PARTITION BY s.season_id, s.category_id, s.{key}
+            ORDER BY s.event_date, s.event_id
+        ) AS points
+    FROM {table} AS s
+    JOIN changed USING (season_id, category_id)
+) AS totals
+WHERE standings.season_id = totals.season_id
+    AND standings.category_id = totals.category_id
+    AND standings.event_id = totals.event_id
+    AND standings.{key} = totals.{key}
+    AND (totals.since IS NULL OR totals.event_date >= totals.since)""",
+            {"event_ids": event_ids},
+        )
+
+
+def rebuild_standings(conn: duckdb.DuckDBPyConnection):
+    events = conn.execute(
+        "SELECT DISTINCT event_id FROM dwh.fct_classification"
+    ).fetchall()
+    update_standings(conn, [event_id for event_id, in events])
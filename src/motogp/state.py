@@ -0,0 +1,77 @@
+import datetime
+import hashlib
+import time
+from typing import Dict, List, Tuple
+
+from motogp.database import sqlite_connection
+from motogp.model import Category, Event, Season
+
+# results and sessions of an event can still change for a while after it ends
+SETTLE_DAYS = 7
+
+
+def content_hash(items: List) -> str:
+    # hash of the fields we keep, not of the raw payload
+    return hashlib.sha256(repr(items).encode()).hexdigest()
+
+
+# listing hashes and sync dates of what was enqueued, settled subtrees are
+# skipped by incremental runs
+class SyncState:
+    def __init__(self, today: datetime.date = None):
+        self.today = today if today is not None else datetime.date.today()
+        self.pending: Dict[str, Tuple[str, str]] = {}
+        with sqlite_connection() as conn:
+            res = conn.execute("SELECT key, hash, watermark FROM sync_state")
+            self.states = {key: (hash, watermark) for key, hash, watermark in res}
+
+    def settled(self, key: str, record, end: datetime.date) -> bool:
+        state = self.states.get(key)
+        if state is None or state[0] != content_hash([record]):
+            return False
+
+        synced = datetime.date.fromisoformat(state[1])
+        return synced >= end + datetime.timedelta(days=SETTLE_DAYS)
+
+    def season_settled(self, season: Season) -> bool:
+        end = datetime.date(season.year, 12, 31)
+        return self.settled(f"season:{season.id}", season, end)
+
+    def event_settled(self, event: Event) -> bool:
+        return self.settled(f"event:{event.id}", event, event.end)
+
+    def sessions_changed(self, event: Event, category: Category, sessions: List):
+        state = self.states.get(f"sessions:{event.id}:{category.id}")
+        return state is None or state[0] != content_hash(sessions)
+
+    def mark_season(self, season: Season):
+        self.mark(f"season:{season.id}", content_hash([season]))
+
+    def mark_event(self, event: Event):
+        self.mark(f"event:{event.id}", content_hash([event]))
+
+    def mark_sessions(self, event: Event, category: Category, sessions: List):
+        self.mark(f"sessions:{event.id}:{category.id}", content_hash(sessions))
+
+    def mark(self, key: str, hash: str):
+        self.pending[key] = (hash, self.today.isoformat())
+
+    def save(self):
+        # called once the tasks of every marked subtree are enqueued
+        if not self.pending:
+            return None
+
+        now = time.time()
+        with sqlite_connection() as conn:
+            conn.executemany(
+                """\
+INSERT INTO sync_state (key, hash, watermark, updated_timestamp)
+VALUES (?, ?, ?, ?)
+ON CONFLICT DO UPDATE
+SET hash = excluded.hash, watermark = excluded.watermark, updated_timestamp = excluded.updated_timestamp""",
+                [(k, h, w, now) for k, (h, w) in self.pending.items()],
+            )
+            conn.commit()
+
+        self.states.update(self.pending)
+        self.pending = {}
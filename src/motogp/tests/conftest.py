@@ -0,0 +1,111 @@
+import asyncio
+import re
+
+import httpx
+import pytest_asyncio
+
+from motogp.client import close_client, setup_client
+from motogp.ratelimit import AdaptiveLimiter
+
+SEASONS = [
+    {"id": "s2024", "name": None, "year": 2024, "current": True},
+    {"id": "s2023", "name": None, "year": 2023, "current": False},
+]
+CATEGORIES = [
+    {"id": "motogp", "name": "MotoGP™"},
+    {"id": "moto2", "name": "Moto2™"},
+]
+
+
+def events(season_id: str):
+    year = season_id[1:]
+    return [
+        {
+            "id": f"{season_id}-e{i}",
+            "name": f"EVENT {i}",
+            "short_name": f"E{i}",
+            "date_start": f"{year}-0{i}-01",
+            "date_end": f"{year}-0{i}-03",
+        }
+        for i in (1, 2)
+    ]
+
+
+def sessions(event_id: str, category_id: str):
+    return [
+        {"id": f"{event_id}-{category_id}-spr", "type": "SPR", "number": None},
+        {"id": f"{event_id}-{category_id}-rac", "type": "RAC", "number": None},
+    ]
+
+
+def classification(session_id: str):
+    points = [25, 20] if session_id.endswith("rac") else [12, 9]
+    return {
+        "classification": [
+            {
+                "rider": {
+                    "id": f"r{i}",
+                    "full_name": f"Rider {i}",
+                    "country": {"name": "Italy"},
+                    "number": i,
+                },
+                "team": {"name": f"Team {i}"},
+                "position": i,
+                "points": points[i - 1],
+            }
+            for i in (1, 2)
+        ]
+    }
+
+
+def route(request: httpx.Request) -> httpx.Response:
+    params = request.url.params
+    path = request.url.path
+    if path.endswith("/seasons"):
+        return httpx.Response(200, json=SEASONS)
+    if path.endswith("/events"):
+        return httpx.Response(200, json=events(params["seasonUuid"]))
+    if path.endswith("/categories"):
+        return httpx.Response(200, json=CATEGORIES)
+    if path.endswith("/sessions"):
+        return httpx.Response(
+            200, json=sessions(params["eventUuid"], params["categoryUuid"])
+        )
+
+    match = re.search("/session/(.+)/classification", path)
+    if match:
+        return httpx.Response(200, json=classification(match.group(1)))
+
+    return httpx.Response(404)
+
+
+class MockApi:
+    def __init__(self):
+        self.requests = []
+        self.in_flight = 0
+        self.max_in_flight = 0
+
+    def handler(self, request: httpx.Request) -> httpx.Response:
+        self.requests.append(request)
+        return route(request)
+
+    async def async_handler(self, request: httpx.Request) -> httpx.Response:
+        self.requests.append(request)
+        self.in_flight += 1
+        self.max_in_flight = max(self.max_in_flight, self.in_flight)
+        await asyncio.sleep(0.001)
+        self.in_flight -= 1
+        return route(request)
+
+
+@pytest_asyncio.fixture
+async def mock_api():
+    api = MockApi()
+    setup_client(
+        transport=httpx.MockTransport(api.handler),
+        async_transport=httpx.MockTransport(api.async_handler),
+        limiter=AdaptiveLimiter(rate=1000, max_rate=1000, concurrency=16),
+    )
+    yield api
+    # later tests get a fresh client instead of the mocked transports
+    await close_client()
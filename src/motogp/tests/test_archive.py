@@ -0,0 +1,133 @@
+import glob
+import os
+
+import httpx
+import pytest
+
+from motogp.archive import Archive, ArchiveMiss, setup_archive, close_archive
+from motogp.cache import ResponseCache
+from motogp.client import setup_client
+from motogp.consumer import fetch_results
+from motogp.database import setup_duckdb, setup_sqlite, sqlite_connection
+from motogp.endpoints import async_get_classification
+from motogp.model import Task, TaskQueue, TaskStatus
+from motogp.producer import async_produce_tasks
+
+
+def offline(request: httpx.Request) -> httpx.Response:
+    raise AssertionError(f"unexpected request in replay: {request.url}")
+
+
+class TestArchive:
+    def test_paths(_, tmp_path):
+        archive = Archive(str(tmp_path))
+        path = archive.classification_path("s", "e", "x")
+        assert path == os.path.join(
+            str(tmp_path), "season=s", "event=e", "classification-x.json.gz"
+        )
+
+        archive.write(path, b"{}")
+        assert archive.read(path) == b"{}"
+        # the event is found without knowing its season
+        assert archive.categories_path(None, "e").startswith(
+            os.path.join(str(tmp_path), "season=s")
+        )
+
+    @pytest.mark.asyncio
+    async def test_replay(_, mock_api, tmp_path):
+        setup_duckdb(True)
+        setup_sqlite(True)
+        setup_archive(path=str(tmp_path))
+        try:
+            await async_produce_tasks(0, incremental=False)
+            task = TaskQueue.from_db(TaskStatus.NEW).tasks[0]
+            classification = await async_get_classification(task)
+            requests = len(mock_api.requests)
+
+            setup_duckdb(True)
+            setup_sqlite(True)
+            setup_archive(path=str(tmp_path), replay=True)
+            setup_client(
+                transport=httpx.MockTransport(offline),
+                async_transport=httpx.MockTransport(offline),
+            )
+            await async_produce_tasks(0, incremental=False)
+            assert TaskQueue.from_db(TaskStatus.NEW).size == 16
+            assert await async_get_classification(task) == classification
+            assert len(mock_api.requests) == requests
+        finally:
+            close_archive()
+
+    @pytest.mark.asyncio
+    async def test_cache_hits_not_rewritten(_, mock_api, tmp_path, monkeypatch):
+        if os.path.exists("test-cache.db"):
+            os.remove("test-cache.db")
+        setup_client(
+            transport=httpx.MockTransport(mock_api.handler),
+            async_transport=httpx.MockTransport(mock_api.async_handler),
+            cache=ResponseCache(),
+        )
+        archive = setup_archive(path=str(tmp_path))
+        write = archive.write
+        writes = []
+
+        def spy(path, content):
+            writes.append(path)
+            write(path, content)
+
+        monkeypatch.setattr(archive, "write", spy)
+        task = Task("0", "s", "e", "c", "x-rac")
+        try:
+            await async_get_classification(task)
+            await async_get_classification(task)
+            assert len(mock_api.requests) == 1
+            assert len(writes) == 1
+
+            # unless the archive lacks them
+            os.remove(writes[0])
+            await async_get_classification(task)
+            assert len(writes) == 2
+        finally:
+            close_archive()
+
+    @pytest.mark.asyncio
+    async def test_replay_missing(_, tmp_path):
+        setup_archive(path=str(tmp_path), replay=True)
+        try:
+            task = Task("0", "s", "e", "c", "x")
+            with pytest.raises(ArchiveMiss):
+                await async_get_classification(task)
+
+            assert await fetch_results(task) == (None, TaskStatus.DEAD)
+        finally:
+            close_archive()
+
+    @pytest.mark.asyncio
+    async def test_replay_skips_missing(_, mock_api, tmp_path):
+        setup_sqlite(True)
+        setup_archive(path=str(tmp_path))
+        try:
+            await async_produce_tasks(0, incremental=False)
+            path = sorted(glob.glob(str(tmp_path / "*" / "*" / "sessions-*.gz")))[0]
+            os.remove(path)
+
+            setup_sqlite(True)
+            setup_archive(path=str(tmp_path), replay=True)
+            setup_client(
+                transport=httpx.MockTransport(offline),
+                async_transport=httpx.MockTransport(offline),
+            )
+            await async_produce_tasks(0, incremental=True)
+            assert 0 < TaskQueue.from_db(TaskStatus.NEW).size < 16
+
+            with sqlite_connection() as conn:
+                keys = [key for key, in conn.execute("SELECT key FROM sync_state")]
+            # the event and season missing a listing are crawled again next time
+            event_dir = os.path.dirname(path)
+            event_id = os.path.basename(event_dir).split("=")[1]
+            season_id = os.path.basename(os.path.dirname(event_dir)).split("=")[1]
+            assert f"event:{event_id}" not in keys
+            assert f"season:{season_id}" not in keys
+            assert any(key.startswith("sessions:") for key in keys)
+        finally:
+            close_archive()
@@ -0,0 +1,147 @@
+import datetime
+import os
+import threading
+
+import httpx
+import pytest
+
+from motogp.cache import CachePolicy, ResponseCache, policy_for
+from motogp.client import Client
+from motogp.endpoints import (
+    BASE_URL,
+    SEASONS_ENDPOINT,
+    CLASSIFICATION_ENDPOINT_TEMPL,
+    _settled,
+)
+from motogp.model import Task
+from motogp.ratelimit import AdaptiveLimiter
+from motogp.state import SETTLE_DAYS
+
+CLASSIFICATION_URL = CLASSIFICATION_ENDPOINT_TEMPL.format(session="0")
+
+
+class Api:
+    def __init__(self):
+        self.requests = []
+
+    def handler(self, request: httpx.Request) -> httpx.Response:
+        self.requests.append(request)
+        if request.headers.get("if-none-match") == '"v1"':
+            return httpx.Response(304)
+
+        return httpx.Response(200, json=[{"id": "0"}], headers={"etag": '"v1"'})
+
+
+def new_client(api: Api, refresh: bool = False) -> Client:
+    return Client(
+        transport=httpx.MockTransport(api.handler),
+        async_transport=httpx.MockTransport(api.handler),
+        limiter=AdaptiveLimiter(rate=1000),
+        cache=ResponseCache(),
+        refresh=refresh,
+    )
+
+
+@pytest.fixture
+def api():
+    if os.path.exists("test-cache.db"):
+        os.remove("test-cache.db")
+
+    api = Api()
+    api.client = new_client(api)
+    yield api
+    api.client.close()
+
+
+def test_policy_for():
+    assert policy_for(CLASSIFICATION_URL).immutable
+    assert not policy_for(SEASONS_ENDPOINT).immutable
+    assert policy_for(BASE_URL + "/unknown") is None
+
+
+def test_immutable(api, monkeypatch):
+    monkeypatch.setattr(
+        "motogp.cache.POLICIES",
+        [("/classification", CachePolicy(ttl=0, immutable=True))],
+    )
+    first = api.client.get(CLASSIFICATION_URL, settled=True)
+    second = api.client.get(CLASSIFICATION_URL)
+
+    assert len(api.requests) == 1
+    assert second.json() == first.json()
+
+
+def test_unsettled(api, monkeypatch):
+    monkeypatch.setattr(
+        "motogp.cache.POLICIES",
+        [("/classification", CachePolicy(ttl=0, immutable=True))],
+    )
+    api.client.get(CLASSIFICATION_URL)
+    api.client.get(CLASSIFICATION_URL, settled=True)
+    api.client.get(CLASSIFICATION_URL)
+
+    # revalidated until a response is stored settled
+    assert len(api.requests) == 2
+    assert api.requests[1].headers["if-none-match"] == '"v1"'
+
+
+def test_settled():
+    today = datetime.date.today()
+    task = Task("0", "0", "0", "0", "0")
+    assert not _settled(task)
+
+    task.event_end = today - datetime.timedelta(SETTLE_DAYS - 1)
+    assert not _settled(task)
+
+    task.event_end = today - datetime.timedelta(SETTLE_DAYS)
+    assert _settled(task)
+
+
+def test_refresh(api):
+    api.client.get(CLASSIFICATION_URL, settled=True)
+    client = new_client(api, refresh=True)
+    try:
+        client.get(CLASSIFICATION_URL)
+    finally:
+        client.close()
+
+    assert len(api.requests) == 2
+    assert "if-none-match" not in api.requests[1].headers
+
+
+def test_fresh(api):
+    api.client.get(SEASONS_ENDPOINT)
+    api.client.get(SEASONS_ENDPOINT)
+
+    assert len(api.requests) == 1
+
+
+@pytest.mark.asyncio
+async def test_revalidate(api, monkeypatch):
+    monkeypatch.setattr("motogp.cache.POLICIES", [("/seasons", CachePolicy(ttl=0))])
+    api.client.get(SEASONS_ENDPOINT)
+    res = await api.client.async_get(SEASONS_ENDPOINT)
+
+    assert len(api.requests) == 2
+    assert api.requests[1].headers["if-none-match"] == '"v1"'
+    assert res.status_code == 200
+    assert res.json() == [{"id": "0"}]
+
+
+@pytest.mark.asyncio
+async def test_async_off_loop(api, monkeypatch):
+    threads = []
+    for name in ("lookup", "store"):
+        method = getattr(api.client.cache, name)
+
+        def spy(*args, method=method):
+            threads.append(threading.current_thread())
+            return method(*args)
+
+        monkeypatch.setattr(api.client.cache, name, spy)
+
+    await api.client.async_get(SEASONS_ENDPOINT)
+    await api.client.async_get(SEASONS_ENDPOINT)
+
+    assert len(threads) == 3
+    assert threading.current_thread() not in threads
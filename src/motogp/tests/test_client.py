@@ -0,0 +1,63 @@
+import asyncio
+
+import httpx
+import pytest
+
+from motogp.client import Client, setup_client, get_client, close_client
+from motogp.endpoints import get_sessions, async_get_sessions
+
+SESSIONS = [{"id": "0", "type": "RAC", "number": None}]
+
+
+def handler(request: httpx.Request) -> httpx.Response:
+    return httpx.Response(200, json=SESSIONS)
+
+
+class TestClient:
+    def test_get_client_is_shared(_):
+        client = setup_client()
+        assert get_client() is client
+        assert get_client() is get_client()
+
+    def test_pool_limits(_):
+        client = Client(max_connections=3, max_keepalive_connections=2)
+        assert client.limits.max_connections == 3
+        assert client.limits.max_keepalive_connections == 2
+
+    def test_sync_client_reused(_):
+        setup_client(transport=httpx.MockTransport(handler))
+        get_sessions("0", "0")
+        sync_client = get_client().sync_client
+        get_sessions("0", "0")
+        assert get_client().sync_client is sync_client
+
+    @pytest.mark.asyncio
+    async def test_async_client_reused(_):
+        setup_client(async_transport=httpx.MockTransport(handler))
+        sessions = await async_get_sessions("0", "0")
+        async_client = get_client().async_client
+        await async_get_sessions("0", "0")
+        assert get_client().async_client is async_client
+        assert sessions[0].name == "rac"
+
+        await close_client()
+        assert async_client.is_closed
+
+    def test_async_client_closed_on_new_loop(_):
+        client = setup_client(async_transport=httpx.MockTransport(handler))
+        first = asyncio.new_event_loop()
+        second = asyncio.new_event_loop()
+        try:
+            first.run_until_complete(async_get_sessions("0", "1"))
+            old = client._async_client
+            second.run_until_complete(async_get_sessions("0", "2"))
+            assert old.is_closed
+            assert client._async_client is not old
+
+            # replacing the shared client closes the async pool as well
+            current = client._async_client
+            setup_client()
+            assert current.is_closed
+        finally:
+            first.close()
+            second.close()
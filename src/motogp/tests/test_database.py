@@ -1,8 +1,18 @@
 import sqlite3
+import threading
 from typing import assert_type
 
 import duckdb
-from motogp.database import setup_duckdb, setup_sqlite
+from motogp.database import (
+    close_connections,
+    duckdb_cursor,
+    get_manager,
+    migrate_duckdb,
+    migrate_sqlite,
+    setup_duckdb,
+    setup_sqlite,
+    sqlite_connection,
+)
 
 
 def test_setup_duckdb():
@@ -12,7 +22,7 @@ def test_setup_duckdb():
 def test_refresh_duckdb():
     conn = setup_duckdb(True)
     res = conn.execute("show").fetchall()
-    assert len(res) == 7
+    assert len(res) == 9
 
 
 def test_setup_sqlite():
@@ -22,4 +32,151 @@ def test_setup_sqlite():
 def test_refresh_sqlite():
     conn = setup_sqlite(True)
     res = conn.execute("SELECT * FROM sqlite_master WHERE type = 'table'").fetchall()
-    assert len(res) == 1
+    assert len(res) == 2
+
+
+def test_duckdb_cursor_per_thread():
+    cursor = duckdb_cursor()
+    assert duckdb_cursor() is cursor
+
+    other = []
+    thread = threading.Thread(target=lambda: other.append(duckdb_cursor()))
+    thread.start()
+    thread.join()
+    assert other[0] is not cursor
+
+
+def test_sqlite_pool_reuse():
+    with sqlite_connection() as conn:
+        pass
+
+    with sqlite_connection() as same_conn:
+        assert same_conn is conn
+
+
+def test_close_connections():
+    manager = get_manager()
+    duckdb_cursor()
+    close_connections()
+    assert get_manager() is not manager
+    assert duckdb_cursor().execute("SELECT 1").fetchone() == (1,)
+
+
+def test_migrate_sqlite():
+    conn = setup_sqlite()
+    conn.execute("DROP TABLE IF EXISTS tasks")
+    conn.execute("""\
+CREATE TABLE tasks (
+    id TEXT PRIMARY KEY,
+    season_id TEXT,
+    event_id TEXT,
+    category_id TEXT,
+    session_id TEXT,
+    status INTEGER DEFAULT 0,
+    attempt INTEGER DEFAULT 0,
+    added_timestamp INTEGER,
+    updated_timestamp INTEGER
+)""")
+    migrate_sqlite(conn)
+
+    columns = [row[1] for row in conn.execute("PRAGMA table_info(tasks)")]
+    assert "worker_id" in columns
+    assert "lease_expires_timestamp" in columns
+
+    indexes = [row[1] for row in conn.execute("PRAGMA index_list(tasks)")]
+    assert "tasks_status_next_attempt" in indexes
+    conn.close()
+
+
+def test_migrate_duckdb():
+    conn = setup_duckdb(True)
+    conn.execute("DROP VIEW dwh.vw_results")
+    conn.execute("DROP TABLE dwh.fct_classification")
+    conn.execute("""\
+CREATE TABLE dwh.fct_classification (
+    id INT PRIMARY KEY DEFAULT nextval('classification_id'),
+    season_id VARCHAR,
+    event_id VARCHAR,
+    category_id VARCHAR,
+    session_id VARCHAR,
+    rider_id VARCHAR,
+    position INT,
+    points INT,
+    timestamp TIMESTAMP
+)""")
+    conn.execute(
+        """\
+INSERT INTO dwh.fct_classification (session_id, rider_id, points, timestamp)
+VALUES ('s', 'r', 1, '2024-01-01'), ('s', 'r', 2, '2024-01-02'), ('s', 'o', 3, '2024-01-01')"""
+    )
+    migrate_duckdb(conn)
+
+    res = conn.execute(
+        "SELECT rider_id, points FROM dwh.vw_results ORDER BY rider_id"
+    ).fetchall()
+    assert res == [("o", 3), ("r", 2)]
+    key = conn.execute(
+        """\
+SELECT constraint_column_names
+FROM duckdb_constraints()
+WHERE table_name = 'fct_classification' AND constraint_type = 'PRIMARY KEY'"""
+    ).fetchone()
+    assert key == (["session_id", "rider_id"],)
+    columns = conn.execute("DESCRIBE dwh.fct_classification").fetchall()
+    columns = [row[0] for row in columns]
+    assert "team" in columns
+    setup_duckdb(True)
+
+
+def test_migrate_duckdb_points():
+    conn = setup_duckdb(True)
+    conn.execute("DROP VIEW dwh.vw_results")
+    conn.execute("DROP TABLE dwh.fct_classification")
+    conn.execute("DROP TABLE dwh.agg_standings_rider")
+    conn.execute("""\
+CREATE TABLE dwh.fct_classification (
+    id INT DEFAULT nextval('classification_id'),
+    season_id VARCHAR,
+    event_id VARCHAR,
+    category_id VARCHAR,
+    session_id VARCHAR,
+    rider_id VARCHAR,
+    position INT,
+    points INT,
+    timestamp TIMESTAMP,
+    team VARCHAR,
+    PRIMARY KEY (session_id, rider_id)
+)""")
+    conn.execute("""\
+CREATE TABLE dwh.agg_standings_rider (
+    season_id VARCHAR,
+    category_id VARCHAR,
+    event_id VARCHAR,
+    event_date DATE,
+    rider_id VARCHAR,
+    event_points INT,
+    points INT,
+    timestamp TIMESTAMP,
+    PRIMARY KEY (season_id, category_id, event_id, rider_id)
+)""")
+    conn.execute("""\
+INSERT INTO dwh.fct_classification (season_id, event_id, category_id, session_id, rider_id, points, timestamp, team)
+VALUES ('s', 'e', 'c', 's', 'r', 12, '2024-01-01', 't')""")
+    migrate_duckdb(conn)
+
+    types = conn.execute("""\
+SELECT table_name, data_type
+FROM duckdb_columns()
+WHERE schema_name = 'dwh' AND column_name = 'points'
+ORDER BY ALL""").fetchall()
+    assert types == [
+        ("agg_standings_rider", "DOUBLE"),
+        ("agg_standings_team", "DOUBLE"),
+        ("fct_classification", "DOUBLE"),
+        ("vw_results", "DOUBLE"),
+    ]
+    res = conn.execute("SELECT rider_id, points, team FROM dwh.vw_results").fetchall()
+    assert res == [("r", 12.0, "t")]
+    res = conn.execute("SELECT rider_id, points FROM dwh.agg_standings_rider")
+    assert res.fetchall() == [("r", 12.0)]
+    setup_duckdb(True)
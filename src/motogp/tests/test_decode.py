@@ -0,0 +1,59 @@
+import json
+
+import pytest
+
+from motogp import decode
+from motogp.model import Classification, Task
+
+TASK = Task("t", "s", "e", "c", "x-rac")
+
+
+def payload() -> dict:
+    return {
+        "classification": [
+            {
+                "rider": {
+                    "id": "r1",
+                    "full_name": "Rider 1",
+                    "country": {"iso": "IT", "name": "Italy"},
+                    "number": 1,
+                    "legacy_id": 7,
+                },
+                "team": {"id": "t1", "name": "Team 1"},
+                "position": 1,
+                "points": 25,
+                # fields we drop must not get in the way
+                "best_lap": {"time": "1:39.1", "number": 4},
+            },
+            {
+                "rider": {
+                    "id": "r2",
+                    "full_name": "Rider 2",
+                    "country": {"iso": "ES", "name": "Spain"},
+                    "number": 2,
+                },
+                "team": None,
+                "position": 2,
+                "points": 12.5,
+            },
+        ],
+        "file": "https://example.com/classification.pdf",
+    }
+
+
+class TestDecode:
+    @pytest.mark.parametrize("fast", [True, False])
+    def test_matches_from_req(_, fast, monkeypatch):
+        if not fast:
+            monkeypatch.setattr(decode, "msgspec", None)
+            monkeypatch.setattr(decode, "orjson", None)
+            assert decode.backend() == "json"
+
+        res = payload()
+        expected = Classification.from_req(res, TASK)
+        assert Classification.from_bytes(json.dumps(res).encode(), TASK) == expected
+        assert expected.results[1].rider.team == ""
+
+    def test_missing_classification(_):
+        with pytest.raises(AssertionError):
+            decode.decode_classification(b"{}")
@@ -0,0 +1,128 @@
+import datetime
+import os
+
+import duckdb
+
+from motogp.database import setup_duckdb
+from motogp.export import Exporter
+from motogp.model import (
+    Category,
+    Classification,
+    Dimensions,
+    Event,
+    Rider,
+    RiderResult,
+    Season,
+    Session,
+)
+
+setup_duckdb(True)
+
+SEASON = Season("x-s", 1999)
+CATEGORY = Category("x-c", "xgp")
+PARTITION = ("1999", "xgp")
+
+
+def load(session_id: str, points: int, day: int = 1):
+    event = Event(f"x-e{day}", "X", "x", datetime.date(1999, 1, day), None)
+    dimensions = Dimensions()
+    dimensions.add(SEASON, event, CATEGORY, Session(session_id, session_id))
+    dimensions.sync()
+
+    rider = Rider("x-r", "test", "test", 1, "test")
+    Classification(
+        SEASON.id, event.id, CATEGORY.id, session_id, [RiderResult(rider, 1, points)]
+    ).sync()
+
+
+def read(exporter: Exporter, where: str = "true"):
+    return duckdb.execute(f"""\
+SELECT session_id, points
+FROM read_parquet('{exporter.path}/**/*.parquet', hive_partitioning = true)
+WHERE {where}
+ORDER BY ALL""").fetchall()
+
+
+class TestExporter:
+    def test_export(_, tmp_path):
+        load("x-1", 25)
+        exporter = Exporter(str(tmp_path))
+        assert exporter.export() > 0
+        exported = len(exporter.manifest["files"])
+
+        # nothing new since the watermark
+        exporter = Exporter(str(tmp_path))
+        assert exporter.export() == 0
+        assert len(exporter.manifest["files"]) == exported
+
+        load("x-2", 20)
+        assert exporter.export() == 1
+        files = exporter.files(PARTITION)
+        assert [f["sessions"] for f in files][-1] == ["x-2"]
+        assert os.path.dirname(files[0]["path"]) == os.path.join(
+            "year=1999", "category=xgp"
+        )
+
+        # a session loaded again replaces its rows instead of duplicating them
+        load("x-1", 12)
+        assert exporter.export() == 1
+        files = exporter.files(PARTITION)
+        assert len(files) == 1
+        assert files[0]["sessions"] == ["x-1", "x-2"]
+        assert ("x-1", 12) in read(exporter)
+        assert ("x-1", 25) not in read(exporter)
+
+        where = "year = 1999 AND category = 'xgp'"
+        assert read(exporter, where) == read(exporter, "session_id LIKE 'x-%'")
+
+    def test_sorted(_, tmp_path):
+        load("x-b", 1, day=3)
+        load("x-a", 1, day=2)
+        exporter = Exporter(str(tmp_path))
+        exporter.rebuild()
+
+        path = os.path.join(str(tmp_path), exporter.files(PARTITION)[0]["path"])
+        dates = duckdb.execute(
+            f"SELECT event_date FROM read_parquet('{path}')"
+        ).fetchall()
+        assert dates == sorted(dates)
+        stats = duckdb.execute(f"""\
+SELECT stats_min_value, stats_max_value
+FROM parquet_metadata('{path}')
+WHERE path_in_schema = 'event_date'""").fetchone()
+        assert stats == ("1999-01-01", "1999-01-03")
+
+    def test_compact(_, tmp_path):
+        exporter = Exporter(str(tmp_path))
+        exporter.export()
+        for i in range(3):
+            load(f"x-c{i}", i)
+            exporter.export()
+
+        before = read(exporter)
+        assert len(exporter.files(PARTITION)) > 2
+        assert exporter.compact(min_files=2) > 0
+        assert len(exporter.files(PARTITION)) == 1
+        assert read(exporter) == before
+
+        partition_dir = os.path.join(str(tmp_path), "year=1999", "category=xgp")
+        assert len(os.listdir(partition_dir)) == 1
+
+    def test_missing_file(_, tmp_path):
+        load("x-m", 25)
+        exporter = Exporter(str(tmp_path))
+        exporter.export()
+        os.remove(os.path.join(str(tmp_path), exporter.files(PARTITION)[0]["path"]))
+
+        # a listed file deleted by hand does not break a full export
+        exporter = Exporter(str(tmp_path))
+        assert exporter.rebuild() > 0
+        assert ("x-m", 25) in read(exporter)
+
+        # nor the rewrite of its partition
+        os.remove(os.path.join(str(tmp_path), exporter.files(PARTITION)[0]["path"]))
+        load("x-m", 12)
+        assert exporter.export() == 1
+        assert ("x-m", 12) in read(exporter)
+        for f in Exporter(str(tmp_path)).manifest["files"]:
+            assert os.path.exists(os.path.join(str(tmp_path), f["path"]))
@@ -0,0 +1,91 @@
+import json
+import urllib.request
+
+import pytest
+
+from motogp.database import setup_duckdb, setup_sqlite
+from motogp.metrics import Metrics, close_metrics, get_metrics, setup_metrics
+from motogp.producer import async_produce_tasks
+
+
+def test_prometheus():
+    metrics = Metrics()
+    metrics.inc("requests_total", endpoint="seasons", status=200)
+    metrics.inc("requests_total", 2, endpoint="seasons", status=200)
+    metrics.gauge("queue_depth", 5, queue="fetch")
+    metrics.observe("latency_seconds", 0.02, buckets=(0.01, 0.1))
+    metrics.observe("latency_seconds", 0.5, buckets=(0.01, 0.1))
+
+    assert metrics.prometheus().splitlines() == [
+        "# TYPE requests_total counter",
+        'requests_total{endpoint="seasons",status="200"} 3',
+        "# TYPE queue_depth gauge",
+        'queue_depth{queue="fetch"} 5',
+        "# TYPE latency_seconds histogram",
+        'latency_seconds_bucket{le="0.01"} 0',
+        'latency_seconds_bucket{le="0.1"} 1',
+        'latency_seconds_bucket{le="+Inf"} 2',
+        "latency_seconds_sum 0.52",
+        "latency_seconds_count 2",
+    ]
+
+
+def test_files(tmp_path):
+    path, prometheus_path = tmp_path / "metrics.ndjson", tmp_path / "metrics.prom"
+    metrics = Metrics(str(path), str(prometheus_path))
+    with metrics.timer("flush_seconds", target="tasks"):
+        pass
+    metrics.close()
+
+    event = json.loads(path.read_text())
+    assert event["event"] == "flush_seconds"
+    assert event["target"] == "tasks"
+    assert 'flush_seconds_count{target="tasks"} 1' in prometheus_path.read_text()
+
+
+def test_serve():
+    metrics = Metrics()
+    metrics.inc("requests_total")
+    server = metrics.serve(0, host="127.0.0.1")
+    try:
+        url = f"http://127.0.0.1:{server.server_address[1]}/metrics"
+        with urllib.request.urlopen(url) as res:
+            assert "requests_total 1" in res.read().decode()
+    finally:
+        metrics.close()
+
+
+def test_merge():
+    worker, coordinator = Metrics(), Metrics()
+    worker.inc("requests_total")
+    worker.observe("latency_seconds", 0.5)
+    coordinator.merge(worker.drain())
+    coordinator.merge(worker.drain())
+
+    assert worker.counters == {}
+    assert coordinator.counters == {("requests_total", ()): 1}
+    assert coordinator.histograms[("latency_seconds", ())].count == 1
+
+
+@pytest.mark.asyncio
+async def test_instrumented(mock_api, tmp_path):
+    setup_duckdb(True)
+    setup_sqlite(True)
+    setup_metrics(str(tmp_path / "metrics.ndjson"), str(tmp_path / "metrics.prom"))
+    try:
+        await async_produce_tasks(0, incremental=False)
+        metrics = get_metrics()
+        key = (
+            "motogp_http_requests_total",
+            (("endpoint", "sessions"), ("status", "200")),
+        )
+        assert metrics.counters[key] == 8
+        assert ("motogp_db_flush_seconds", (("target", "tasks"),)) in metrics.histograms
+    finally:
+        close_metrics()
+        # later test modules expect an empty task queue
+        setup_sqlite(True)
+
+    assert (
+        "motogp_http_request_seconds_bucket" in (tmp_path / "metrics.prom").read_text()
+    )
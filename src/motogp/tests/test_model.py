@@ -1,17 +1,27 @@
+import asyncio
 import datetime
+import time
 from typing import assert_type
 import uuid
+
+import pytest
+
+from motogp import model
 from motogp.model import (
     Season,
     Event,
     Category,
     Session,
     Classification,
+    ClassificationBatch,
     Rider,
+    RiderCache,
     RiderResult,
     Task,
     TaskStatus,
     TaskQueue,
+    StatusRecorder,
+    retry_delay,
 )
 from motogp.database import setup_duckdb, setup_sqlite
 
@@ -116,3 +126,251 @@ class TestClassification:
         cls.classification.sync()
         results = Classification.from_db(cls.season_id)
         assert cls.classification == results
+
+    def test_sync_many(cls):
+        rider = Rider("1", "test", "test", 2, "new team")
+        classifications = [
+            Classification("1", "1", "1", session_id, [RiderResult(rider, 1, 25)])
+            for session_id in ("1", "2")
+        ]
+        Classification.sync_many(classifications)
+
+        assert Rider.from_db(rider.id) == rider
+        for classification in classifications:
+            assert Classification.from_db(classification.session_id) == classification
+
+    def test_from_db_many(cls):
+        rider = Rider("m", "test", "test", 3, "team")
+        classifications = [
+            Classification("m", "m", "m", session_id, [RiderResult(rider, 1, 25)])
+            for session_id in ("m-1", "m-2")
+        ]
+        Classification.sync_many(classifications)
+
+        assert Classification.from_db_many(["m-2", "m-1"]) == classifications
+        riders = RiderCache()
+        res = Classification.from_db_season("m", riders=riders)
+        assert res == classifications
+        # one rider object shared by every result read through the cache
+        assert res[0].results[0].rider is res[1].results[0].rider
+        assert riders.get("m") == rider
+
+
+class TestClassificationBatch:
+    @pytest.mark.parametrize("arrow", [True, False])
+    def test_sync(_, arrow, monkeypatch):
+        if not arrow:
+            monkeypatch.setattr(model, "pyarrow", None)
+        elif model.pyarrow is None:
+            pytest.skip("pyarrow is not installed")
+
+        prefix = "arrow" if arrow else "list"
+        rider_id = f"{prefix}-r"
+        batch = ClassificationBatch()
+        batch.add("b", "b", "b", f"{prefix}-1", [(rider_id, "a", "x", 1, "", 1, 25)])
+        batch.add(
+            "b",
+            "b",
+            "b",
+            f"{prefix}-2",
+            [
+                (rider_id, "a", "x", 1, "team", 1, 12.5),
+                (f"{prefix}-o", "o", None, 2, "", 2, 0),
+            ],
+        )
+        assert batch.size == 3
+        batch.sync()
+
+        # the rider's latest details win
+        assert Rider.from_db(rider_id) == Rider(rider_id, "a", "x", 1, "team")
+        results = Classification.from_db(f"{prefix}-2").results
+        assert [(r.rider.id, r.position) for r in results] == [
+            (rider_id, 1),
+            (f"{prefix}-o", 2),
+        ]
+        assert Classification.from_db(f"{prefix}-1").results[0].points == 25
+
+    def test_upsert(_):
+        batch = ClassificationBatch()
+        batch.add("u", "u", "u", "u-1", [("u-r", "a", "x", 1, "", 1, 25)])
+        batch.add("u", "u", "u", "u-1", [("u-r", "a", "x", 1, "", 2, 20)])
+        assert batch.size == 1
+        batch.sync()
+        batch.sync()
+
+        results = Classification.from_db("u-1").results
+        assert [(r.position, r.points) for r in results] == [(2, 20)]
+
+
+class TestSlots:
+    def test_no_dict(_):
+        rider = Rider("0", "test", "test", 1, "test")
+        assert not hasattr(rider, "__dict__")
+        with pytest.raises(AttributeError):
+            rider.team = "other"
+
+    def test_intern(_):
+        # rows read back from the db carry their own copies of repeated ids
+        rows = [("a", "".join(["s", "1"]), "e", "c", "x", 0, 0) for _ in range(2)]
+        first, second = [Task.from_row(row) for row in rows]
+        assert first.season_id is second.season_id
+
+        payload = b'{"classification": [{"rider": {"id": "r", "country": {"name": "Italy"}}, "team": {"name": "Team"}}]}'
+        first, second = [Classification.from_bytes(payload, first) for _ in range(2)]
+        assert first.results[0].rider.team is second.results[0].rider.team
+
+
+class TestStatusRecorder:
+    tasks = [Task(str(i), "0", "0", "0", str(i)) for i in range(3)]
+
+    def test_update_status(cls):
+        queue = TaskQueue.from_list(cls.tasks)
+        queue.sync()
+        queue.update_status(TaskStatus.QUEUED)
+        assert all(t.status == TaskStatus.QUEUED for t in cls.tasks)
+        for task in cls.tasks:
+            assert Task.from_db(task.id).status == TaskStatus.QUEUED
+
+    def test_record(cls):
+        recorder = StatusRecorder(batch_size=2)
+        recorder.record(cls.tasks[0], TaskStatus.COMPLETED)
+        assert Task.from_db(cls.tasks[0].id).status == TaskStatus.QUEUED
+
+        recorder.record(cls.tasks[1], TaskStatus.ERROR)
+        assert Task.from_db(cls.tasks[0].id).status == TaskStatus.COMPLETED
+        assert Task.from_db(cls.tasks[1].id).status == TaskStatus.ERROR
+
+        recorder.record(cls.tasks[2], TaskStatus.COMPLETED)
+        recorder.flush()
+        assert Task.from_db(cls.tasks[2].id).status == TaskStatus.COMPLETED
+        assert recorder.pending == {}
+
+    @pytest.mark.asyncio
+    async def test_record_on_loop(_):
+        tasks = [Task(f"loop-{i}", "0", "0", "0", f"loop-{i}") for i in range(2)]
+        TaskQueue.from_list(tasks).sync()
+        recorder = StatusRecorder(batch_size=2, flush_interval=60)
+        run = asyncio.create_task(recorder.run())
+        await asyncio.sleep(0)
+
+        for task in tasks:
+            recorder.record(task, TaskStatus.COMPLETED)
+        # a full buffer is left to run(), which writes it off the loop
+        assert len(recorder.pending) == 2
+
+        for _ in range(100):
+            await asyncio.sleep(0.01)
+            if not recorder.pending:
+                break
+        run.cancel()
+
+        assert recorder.pending == {}
+        assert Task.from_db("loop-1").status == TaskStatus.COMPLETED
+
+
+class TestClaim:
+    def test_claim(_):
+        setup_sqlite(True)
+        TaskQueue.from_list(
+            [Task(f"claim-{i}", "0", "0", "0", str(i)) for i in range(5)]
+        ).sync()
+
+        first = TaskQueue.claim("worker-1", 3)
+        second = TaskQueue.claim("worker-2", 3)
+        assert first.size == 3
+        assert second.size == 2
+        assert not {t.id for t in first.tasks} & {t.id for t in second.tasks}
+        assert all(t.status == TaskStatus.QUEUED for t in first.tasks)
+        assert TaskQueue.claim("worker-3", 3).size == 0
+
+    def test_expired_lease(_):
+        setup_sqlite(True)
+        TaskQueue.from_list([Task("lease", "0", "0", "0", "0")]).sync()
+
+        assert TaskQueue.claim("crashed", 1, lease=-1).size == 1
+        claimed = TaskQueue.claim("worker", 1)
+        assert claimed.tasks[0].id == "lease"
+        assert claimed.tasks[0].attempt == 2
+
+    def test_heartbeat(_):
+        setup_sqlite(True)
+        TaskQueue.from_list([Task("heartbeat", "0", "0", "0", "0")]).sync()
+
+        TaskQueue.claim("worker", 1, lease=-1)
+        TaskQueue.heartbeat("worker")
+        assert TaskQueue.claim("other", 1).size == 0
+
+
+class TestEnqueue:
+    def test_enqueue(_):
+        setup_sqlite(True)
+        tasks = [Task.from_session("0", "0", "0", f"enqueue-{i}") for i in range(3)]
+        assert Task.from_session("1", "1", "1", "enqueue-0").id == tasks[0].id
+
+        assert TaskQueue.from_list(tasks).enqueue() == 3
+        TaskQueue.update_statuses({TaskStatus.COMPLETED: [tasks[0].id]})
+        # a task queued under another id earlier still counts for its session
+        TaskQueue.from_list([Task("legacy", "0", "0", "0", "enqueue-3")]).sync()
+
+        again = tasks + [Task.from_session("0", "0", "0", "enqueue-3")]
+        assert TaskQueue.from_list(again).enqueue() == 0
+        assert Task.from_db(tasks[0].id).status == TaskStatus.COMPLETED
+        assert TaskQueue.from_db(TaskStatus.NEW).size == 3
+
+        TaskQueue.claim("worker", 1)
+        assert TaskQueue.from_list(again).enqueue(requeue=True) == 0
+        assert Task.from_db(tasks[0].id).status == TaskStatus.NEW
+        assert TaskQueue.from_db(TaskStatus.NEW).size == 3
+
+    def test_event_end(_):
+        setup_sqlite(True)
+        end = datetime.date(2024, 11, 17)
+        legacy = Task("legacy", "0", "0", "0", "event-end")
+        TaskQueue.from_list([legacy]).sync()
+        assert Task.from_db("legacy").event_end is None
+
+        task = Task.from_session("0", "0", "0", "event-end", end)
+        TaskQueue.from_list([task]).enqueue()
+        assert Task.from_db("legacy").event_end == end
+        assert TaskQueue.claim("worker", 1).tasks[0].event_end == end
+
+
+class TestRetry:
+    def test_retry_delay(_):
+        for attempt in range(1, 10):
+            delay = retry_delay(attempt, base=1, cap=60)
+            window = min(60, 2 ** (attempt - 1))
+            assert window / 2 <= delay <= window
+
+    def test_retry_scheduled(_):
+        setup_sqlite(True)
+        TaskQueue.from_list([Task("retry", "0", "0", "0", "0")]).sync()
+
+        task = TaskQueue.claim("worker", 1).tasks[0]
+        recorder = StatusRecorder()
+        recorder.record(task, TaskStatus.ERROR)
+        recorder.flush()
+
+        assert Task.from_db("retry").status == TaskStatus.ERROR
+        assert TaskQueue.next_attempt_timestamp() > time.time()
+        assert TaskQueue.claim("worker", 1).size == 0
+
+    def test_retry_due(_):
+        setup_sqlite(True)
+        TaskQueue.from_list([Task("retry", "0", "0", "0", "0")]).sync()
+        TaskQueue.claim("worker", 1)
+        TaskQueue.update_statuses({TaskStatus.ERROR: ["retry"]}, {"retry": 0})
+
+        assert TaskQueue.claim("worker", 1).tasks[0].attempt == 2
+
+    def test_dead_letter(_):
+        setup_sqlite(True)
+        TaskQueue.from_list([Task("dead", "0", "0", "0", "0")]).sync()
+
+        task = TaskQueue.claim("worker", 1).tasks[0]
+        recorder = StatusRecorder(max_attempts=1)
+        recorder.record(task, TaskStatus.ERROR)
+        recorder.flush()
+
+        assert Task.from_db("dead").status == TaskStatus.DEAD
+        assert TaskQueue.next_attempt_timestamp() is None
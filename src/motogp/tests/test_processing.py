@@ -1,16 +1,30 @@
 import asyncio
+import datetime
+import threading
+
 import pytest
-from motogp.model import TaskQueue, TaskStatus
-from motogp.consumer import consumer
-from motogp.producer import async_produce_tasks, produce_tasks
-from motogp.database import setup_duckdb, setup_sqlite
+from motogp.model import (
+    Season,
+    Event,
+    Category,
+    Session,
+    Classification,
+    StatusRecorder,
+    TaskQueue,
+    TaskStatus,
+)
+from motogp.consumer import consumer, writer
+from motogp.pipeline import run
+from motogp.producer import Crawler, Enqueuer, async_produce_tasks, produce_tasks
+from motogp.database import setup_duckdb, setup_sqlite, sqlite_connection
 
 
-# End-to-end Test
+# End-to-end Test, against the mocked api, tests/test_endpoints.py covers the
+# real one
 class TestProcessing:
     queue = asyncio.Queue()
 
-    def test_produce_tasks(cls):
+    def test_produce_tasks(cls, mock_api):
         setup_duckdb(True)
         setup_sqlite(True)
 
@@ -19,7 +33,7 @@ class TestProcessing:
         assert TaskQueue.from_db(TaskStatus.NEW).size == 1
 
     @pytest.mark.asyncio
-    async def test_async_produce_tasks(cls):
+    async def test_async_produce_tasks(cls, mock_api):
         setup_duckdb(True)
         setup_sqlite(True)
 
@@ -31,7 +45,7 @@ class TestProcessing:
         assert TaskQueue.from_db(TaskStatus.NEW).size == 1
 
     @pytest.mark.asyncio
-    async def test_processing(cls):
+    async def test_processing(cls, mock_api):
         setup_duckdb(True)
         setup_sqlite(True)
 
@@ -40,9 +54,195 @@ class TestProcessing:
         for task in TaskQueue.from_db(TaskStatus.NEW).tasks:
             await cls.queue.put(task)
 
-        consumers = [asyncio.create_task(consumer(cls.queue)) for _ in range(1)]
+        write_queue = asyncio.Queue()
+        recorder = StatusRecorder()
+        consumers = [
+            asyncio.create_task(consumer(cls.queue, write_queue, recorder))
+            for _ in range(1)
+        ]
+        writers = [asyncio.create_task(writer(write_queue, recorder))]
 
         await cls.queue.join()
+        await write_queue.join()
 
-        for c in consumers:
+        for c in consumers + writers:
             c.cancel()
+
+        recorder.flush()
+
+
+class TestCrawler:
+    @pytest.mark.asyncio
+    async def test_crawl(_, mock_api):
+        setup_duckdb(True)
+        setup_sqlite(True)
+
+        await async_produce_tasks(0, incremental=False)
+
+        # 2 seasons * 2 events * 2 categories * 2 sessions
+        assert TaskQueue.from_db(TaskStatus.NEW).size == 16
+        assert mock_api.max_in_flight > 1
+        assert Season.from_db("s2024").year == 2024
+        assert Session.from_db("s2023-e1-moto2-rac").name == "rac"
+
+    def test_enqueuer_batches(_):
+        setup_duckdb(True)
+        setup_sqlite(True)
+
+        season = Season("0", 2024)
+        event = Event("0", "test", "t", datetime.date.today(), datetime.date.today())
+        category = Category("0", "motogp")
+        enqueuer = Enqueuer(batch_size=2)
+        for i in range(3):
+            enqueuer.add(season, event, category, Session(str(i), "rac"))
+
+        assert TaskQueue.from_db(TaskStatus.NEW).size == 2
+        assert enqueuer.dimensions.seasons == {}
+        assert list(enqueuer.dimensions.sessions) == ["2"]
+
+        enqueuer.flush()
+        assert TaskQueue.from_db(TaskStatus.NEW).size == 3
+        assert Session.from_db("2").name == "rac"
+
+    @pytest.mark.asyncio
+    async def test_crawl_limit(_, mock_api):
+        setup_duckdb(True)
+        setup_sqlite(True)
+
+        await async_produce_tasks(3, incremental=False)
+
+        assert TaskQueue.from_db(TaskStatus.NEW).size == 3
+
+
+class TestConsumer:
+    @pytest.mark.asyncio
+    async def test_consume(_, mock_api):
+        setup_duckdb(True)
+        setup_sqlite(True)
+        await async_produce_tasks(4, incremental=False)
+
+        queue = asyncio.Queue()
+        write_queue = asyncio.Queue()
+        for task in TaskQueue.from_db(TaskStatus.NEW).tasks:
+            await queue.put(task)
+
+        recorder = StatusRecorder()
+        consumers = [
+            asyncio.create_task(consumer(queue, write_queue, recorder))
+            for _ in range(2)
+        ]
+        writers = [asyncio.create_task(writer(write_queue, recorder, 3, 0.01))]
+
+        await queue.join()
+        await write_queue.join()
+
+        for c in consumers + writers:
+            c.cancel()
+
+        recorder.flush()
+
+        tasks = TaskQueue.from_db(TaskStatus.ERROR).tasks
+        assert len(tasks) == 4
+        assert all(t.status == TaskStatus.COMPLETED for t in tasks)
+        for task in tasks:
+            assert len(Classification.from_db(task.session_id).results) == 2
+
+
+class TestPipeline:
+    def test_enqueuer_claims(_):
+        setup_duckdb(True)
+        setup_sqlite(True)
+
+        season = Season("0", 2024)
+        event = Event("0", "test", "t", datetime.date.today(), datetime.date.today())
+        category = Category("0", "motogp")
+        enqueuer = Enqueuer(worker_id="pipeline")
+        enqueuer.add(season, event, category, Session("claimed", "rac"))
+        enqueuer.flush()
+
+        assert [t.session_id for t in enqueuer.claimed] == ["claimed"]
+        assert enqueuer.claimed[0].status == TaskStatus.QUEUED
+        assert TaskQueue.claim("other", 10).size == 0
+
+    @pytest.mark.asyncio
+    async def test_publish(_, mock_api):
+        setup_duckdb(True)
+        setup_sqlite(True)
+
+        queue = asyncio.Queue()
+        crawler = Crawler(
+            incremental=False, queue=queue, worker_id="pipeline", publish_interval=60
+        )
+        crawler.enqueuer.batch_size = 5
+        write = crawler.enqueuer.write
+        writes = []
+
+        def spy(dimensions, tasks):
+            writes.append((threading.current_thread(), len(tasks)))
+            return write(dimensions, tasks)
+
+        crawler.enqueuer.write = spy
+        await crawler.crawl()
+
+        assert queue.qsize() == 16
+        # written by size off the event loop, not once per sessions listing
+        assert all(t is not threading.current_thread() for t, _ in writes)
+        sizes = [size for _, size in writes]
+        assert sum(sizes) == 16
+        assert min(sizes[:-1]) >= 5
+
+    @pytest.mark.asyncio
+    async def test_publish_backed_up(_, mock_api):
+        setup_duckdb(True)
+        setup_sqlite(True)
+
+        queue = asyncio.Queue(maxsize=1)
+        crawler = Crawler(
+            incremental=False, queue=queue, worker_id="pipeline", publish_interval=0.001
+        )
+        delivered = []
+
+        async def slow_consumer():
+            while True:
+                delivered.append(await queue.get())
+                await asyncio.sleep(0.01)
+
+        consumer = asyncio.create_task(slow_consumer())
+        try:
+            await crawler.crawl()
+            while not queue.empty():
+                await asyncio.sleep(0.01)
+        finally:
+            consumer.cancel()
+
+        # every task claimed for the pipeline reached the queue
+        with sqlite_connection() as conn:
+            queued = conn.execute(
+                "SELECT count(*) FROM tasks WHERE status = ?",
+                [TaskStatus.QUEUED.value],
+            ).fetchone()[0]
+        assert queued == 16
+        assert len({task.id for task in delivered}) == 16
+
+    @pytest.mark.asyncio
+    async def test_run(_, mock_api):
+        setup_duckdb(True)
+        setup_sqlite(True)
+
+        await run(0, incremental=False)
+
+        with sqlite_connection() as conn:
+            statuses = conn.execute("SELECT status FROM tasks").fetchall()
+        assert statuses == [(TaskStatus.COMPLETED.value,)] * 16
+        assert len(Classification.from_db("s2023-e1-moto2-rac").results) == 2
+
+    @pytest.mark.asyncio
+    async def test_run_limit(_, mock_api):
+        setup_duckdb(True)
+        setup_sqlite(True)
+
+        await run(3, incremental=False)
+
+        with sqlite_connection() as conn:
+            statuses = conn.execute("SELECT status FROM tasks").fetchall()
+        assert statuses == [(TaskStatus.COMPLETED.value,)] * 3
@@ -0,0 +1,85 @@
+import asyncio
+import time
+
+import httpx
+import pytest
+
+from motogp.client import Client
+from motogp.ratelimit import AdaptiveLimiter, TokenBucket, parse_retry_after
+
+
+def test_parse_retry_after():
+    assert parse_retry_after(None) is None
+    assert parse_retry_after("3") == 3.0
+    assert parse_retry_after("Wed, 21 Oct 2015 07:28:00 GMT") == 0.0
+    assert parse_retry_after("soon") is None
+
+
+def test_token_bucket():
+    bucket = TokenBucket(rate=100, burst=2)
+    start = time.monotonic()
+    for _ in range(4):
+        bucket.acquire_sync()
+
+    # two tokens from the burst, two more at 100 per second
+    assert time.monotonic() - start >= 0.015
+
+
+class TestAdaptiveLimiter:
+    def test_increase(_):
+        limiter = AdaptiveLimiter(rate=10, concurrency=2, target_latency=1)
+        for _ in range(10):
+            limiter.record(0.1, 200)
+
+        assert limiter.limit > 2
+        assert limiter.rate > 10
+
+    def test_decrease(_):
+        limiter = AdaptiveLimiter(rate=10, concurrency=8, target_latency=1)
+        limiter.record(0.1, 429)
+        assert limiter.limits()["concurrency"] == 4
+        assert limiter.rate == 5
+
+        # only one decrease per window
+        limiter.record(0.1, None)
+        assert limiter.limit == 4
+
+    def test_slow_response(_):
+        limiter = AdaptiveLimiter(concurrency=8, target_latency=0.5)
+        limiter.record(1.0, 200)
+        assert limiter.limit == 4
+
+    def test_retry_after(_):
+        limiter = AdaptiveLimiter()
+        limiter.record(0.1, 429, retry_after=10)
+        assert limiter.bucket._reserve() > 9
+
+    @pytest.mark.asyncio
+    async def test_concurrency_bound(_):
+        limiter = AdaptiveLimiter(rate=1000, concurrency=2, max_concurrency=2)
+        peak = 0
+
+        async def request():
+            nonlocal peak
+            async with limiter.acquire():
+                peak = max(peak, limiter.in_flight)
+                await asyncio.sleep(0.01)
+
+        await asyncio.gather(*[request() for _ in range(10)])
+        assert peak == 2
+        assert limiter.in_flight == 0
+
+    @pytest.mark.asyncio
+    async def test_client_records(_):
+        transport = httpx.MockTransport(
+            lambda _: httpx.Response(429, headers={"retry-after": "0"})
+        )
+        client = Client(
+            async_transport=transport,
+            limiter=AdaptiveLimiter(rate=1000, concurrency=8),
+        )
+        res = await client.async_get("https://example.com")
+        await client.aclose()
+
+        assert res.status_code == 429
+        assert client.limiter.limit == 4
@@ -0,0 +1,87 @@
+import datetime
+
+from motogp.database import duckdb_cursor, setup_duckdb
+from motogp.model import (
+    Category,
+    ClassificationBatch,
+    Dimensions,
+    Event,
+    Season,
+    Session,
+)
+from motogp.standings import rebuild_standings
+
+setup_duckdb(True)
+
+SEASON = Season("st-s", 2001)
+CATEGORY = Category("st-c", "stgp")
+
+
+def load(day: int, session: str, rows):
+    event = Event(f"st-e{day}", "E", "e", datetime.date(2001, 1, day), None)
+    session_id = f"{event.id}-{session}"
+    dimensions = Dimensions()
+    dimensions.add(SEASON, event, CATEGORY, Session(session_id, session))
+    dimensions.sync()
+
+    batch = ClassificationBatch()
+    batch.add(SEASON.id, event.id, CATEGORY.id, session_id, rows)
+    batch.sync()
+
+
+def standings(table: str, key: str):
+    conn = duckdb_cursor()
+    return conn.execute(
+        f"""\
+SELECT event_id, {key}, event_points, points
+FROM dwh.agg_standings_{table}
+WHERE season_id = ?
+ORDER BY event_date, {key}""",
+        [SEASON.id],
+    ).fetchall()
+
+
+def row(rider: str, team: str, points):
+    return (rider, rider, "x", 1, team, 1, points)
+
+
+class TestStandings:
+    def test_standings(_):
+        # the second event lands first, the first one then shifts its totals
+        load(2, "rac", [row("a", "t1", 25), row("b", "t1", 20)])
+        load(1, "rac", [row("a", "t1", 20), row("b", "t2", 25)])
+        load(1, "spr", [row("a", "t1", 12), row("b", "t2", 9)])
+        # sessions without points leave the standings alone
+        load(1, "fp1", [row("a", "t1", None), row("b", "t2", None)])
+
+        assert standings("rider", "rider_id") == [
+            ("st-e1", "a", 32, 32),
+            ("st-e1", "b", 34, 34),
+            ("st-e2", "a", 25, 57),
+            ("st-e2", "b", 20, 54),
+        ]
+        assert standings("team", "team") == [
+            ("st-e1", "t1", 32, 32),
+            ("st-e1", "t2", 34, 34),
+            ("st-e2", "t1", 45, 77),
+        ]
+
+        # a session landing again replaces its points
+        load(2, "rac", [row("a", "t1", 0), row("b", "t1", 20)])
+        assert standings("rider", "rider_id")[2] == ("st-e2", "a", 0, 32)
+
+        expected = standings("rider", "rider_id")
+        rebuild_standings(duckdb_cursor())
+        assert standings("rider", "rider_id") == expected
+
+    def test_half_points(_):
+        # a race stopped early awards half points
+        load(3, "rac", [row("h", "t3", 12.5), row("i", "t3", 4.5)])
+        load(4, "rac", [row("h", "t3", 0.5), row("i", "t3", 25)])
+
+        rows = [r for r in standings("rider", "rider_id") if r[1] == "h"]
+        assert rows == [("st-e3", "h", 12.5, 12.5), ("st-e4", "h", 0.5, 13.0)]
+        assert [r for r in standings("team", "team") if r[1] == "t3"] == [
+            ("st-e3", "t3", 17.0, 17.0),
+            ("st-e4", "t3", 25.5, 42.5),
+        ]
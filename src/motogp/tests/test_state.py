@@ -0,0 +1,60 @@
+import datetime
+
+import pytest
+
+from motogp.database import setup_duckdb, setup_sqlite, sqlite_connection
+from motogp.model import Event, Season, TaskQueue, TaskStatus
+from motogp.producer import async_produce_tasks
+from motogp.state import SyncState
+
+
+def test_settled():
+    setup_sqlite(True)
+
+    event = Event(
+        "e", "test", "t", datetime.date(2024, 3, 1), datetime.date(2024, 3, 3)
+    )
+    season = Season("s", 2024)
+    state = SyncState(today=datetime.date(2024, 3, 4))
+    state.mark_event(event)
+    state.mark_season(season)
+    state.save()
+
+    assert not SyncState().event_settled(
+        Event("e", "changed", "t", event.start, event.end)
+    )
+    assert not SyncState(today=datetime.date(2024, 3, 5)).event_settled(event)
+    assert not SyncState().season_settled(season)
+
+    state = SyncState()
+    state.mark_event(event)
+    state.save()
+    assert SyncState().event_settled(event)
+
+
+@pytest.mark.asyncio
+async def test_incremental_crawl(mock_api):
+    setup_duckdb(True)
+    setup_sqlite(True)
+
+    await async_produce_tasks(0, incremental=False)
+    assert TaskQueue.from_db(TaskStatus.NEW).size == 16
+
+    # every season ended long ago, nothing below the seasons listing is fetched
+    mock_api.requests.clear()
+    await async_produce_tasks(0)
+    assert len(mock_api.requests) == 1
+    assert TaskQueue.from_db(TaskStatus.NEW).size == 16
+
+    with sqlite_connection() as conn:
+        conn.execute("""\
+DELETE FROM sync_state
+WHERE key IN ('season:s2024', 'event:s2024-e2', 'sessions:s2024-e2:motogp')""")
+        conn.commit()
+
+    # one events, one categories and two sessions listings, the changed
+    # listing only holds sessions that already have a task
+    mock_api.requests.clear()
+    await async_produce_tasks(0)
+    assert len(mock_api.requests) == 5
+    assert TaskQueue.from_db(TaskStatus.NEW).size == 16
@@ -0,0 +1,71 @@
+import pytest
+
+from motogp.archive import setup_archive, close_archive
+from motogp.database import setup_duckdb, setup_sqlite, sqlite_connection
+from motogp.endpoints import async_get_results
+from motogp.model import (
+    Classification,
+    ClassificationBatch,
+    Task,
+    TaskQueue,
+    TaskStatus,
+)
+from motogp.producer import async_produce_tasks
+from motogp.workers import Coordinator, shard_tasks
+
+ROW = ("r1", "Rider 1", "Italy", 1, "Team 1", 1, 25.0)
+
+
+def test_shard_tasks():
+    tasks = [Task(str(i), f"s{i % 2}", "e", "c", str(i)) for i in range(5)]
+    shards = shard_tasks(tasks, size=2)
+    assert [[t.id for t in shard] for shard in shards] == [
+        ["0", "2"],
+        ["4"],
+        ["1", "3"],
+    ]
+
+
+def test_merge():
+    first, second = ClassificationBatch(), ClassificationBatch()
+    first.add("s", "e", "c", "x", [ROW])
+    second.add("s", "e", "c", "x", [ROW[:5] + (2, 20.0)])
+    second.add("s", "e", "c", "y", [ROW])
+
+    first.merge(second)
+    assert first.size == 2
+    assert first.facts["position"] == [2, 1]
+    assert list(first.riders) == ["r1"]
+
+    # columns without a colliding key are concatenated
+    third = ClassificationBatch()
+    third.add("s", "e", "c", "z", [ROW])
+    first.extend(third.facts, third.riders)
+    assert first.size == 3
+    assert first.facts["session_id"] == ["x", "y", "z"]
+    assert first.keys[("z", "r1")] == 2
+
+    first.extend(third.facts, third.riders)
+    assert first.size == 3
+
+
+@pytest.mark.asyncio
+async def test_coordinator(mock_api, tmp_path):
+    setup_duckdb(True)
+    setup_sqlite(True)
+    # the worker processes replay the archive, they can not see the mock api
+    setup_archive(path=str(tmp_path))
+    try:
+        await async_produce_tasks(0, incremental=False)
+        for task in TaskQueue.from_db(TaskStatus.NEW).tasks:
+            await async_get_results(task)
+    finally:
+        close_archive()
+
+    coordinator = Coordinator(2, archive_path=str(tmp_path), replay=True)
+    assert await coordinator.run() == 16
+
+    with sqlite_connection() as conn:
+        statuses = conn.execute("SELECT status FROM tasks").fetchall()
+    assert statuses == [(TaskStatus.COMPLETED.value,)] * 16
+    assert len(Classification.from_db("s2023-e1-moto2-rac").results) == 2
@@ -0,0 +1,270 @@
+import asyncio
+import multiprocessing
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+from typing import Dict, List, Tuple
+
+from motogp.archive import ARCHIVE_PATH, setup_archive
+from motogp.cache import ResponseCache
+from motogp.client import setup_client
+from motogp.consumer import (
+    MAX_RETRY_WAIT,
+    export,
+    fetch_results,
+    heartbeat,
+    new_worker_id,
+    write,
+)
+from motogp.database import close_connections
+from motogp.logger import setup_logger
+from motogp.metrics import (
+    METRICS_FILE,
+    close_metrics,
+    get_metrics,
+    setup_metrics,
+)
+from motogp.model import (
+    ClassificationBatch,
+    StatusRecorder,
+    Task,
+    TaskQueue,
+    TaskStatus,
+)
+from motogp.ratelimit import (
+    DEFAULT_CONCURRENCY,
+    DEFAULT_MAX_CONCURRENCY,
+    DEFAULT_MAX_RATE,
+    DEFAULT_MIN_RATE,
+    DEFAULT_RATE,
+    AdaptiveLimiter,
+)
+
+# tasks fetched by a process in one go
+SHARD_SIZE = 100
+# shards in flight per process, the next one is queued while the
+# coordinator writes
+SHARDS_PER_PROCESS = 2
+# merged fact rows written to duckdb in one transaction
+WRITE_BATCH_ROWS = 20000
+
+# event loop of a worker process, reused by every shard it fetches
+_loop: asyncio.AbstractEventLoop = None
+
+
+def shard_tasks(tasks: List[Task], size: int = SHARD_SIZE) -> List[List[Task]]:
+    # tasks of a season stay together so a process interns the ids and
+    # rider details of few seasons, large seasons are split
+    seasons: Dict[str, List[Task]] = {}
+    for task in tasks:
+        seasons.setdefault(task.season_id, []).append(task)
+
+    return [
+        group[i : i + size]
+        for group in seasons.values()
+        for i in range(0, len(group), size)
+    ]
+
+
+def setup_worker(
+    processes: int,
+    archive_path: str,
+    replay: bool,
+    metrics_path: str = None,
+    refresh: bool = False,
+):
+    global _loop
+    # the api budget of one consumer is split between the processes
+    rate = DEFAULT_RATE / processes
+    setup_client(
+        cache=ResponseCache(),
+        limiter=AdaptiveLimiter(
+            rate=rate,
+            min_rate=min(DEFAULT_MIN_RATE, rate),
+            max_rate=DEFAULT_MAX_RATE / processes,
+            concurrency=max(DEFAULT_CONCURRENCY // processes, 1),
+            max_concurrency=max(DEFAULT_MAX_CONCURRENCY // processes, 1),
+        ),
+        refresh=refresh,
+    )
+    setup_archive(path=archive_path, replay=replay)
+    # events go to the shared ndjson file, aggregates back to the coordinator
+    setup_metrics(metrics_path, prometheus_path=None, serve=False)
+    _loop = asyncio.new_event_loop()
+
+
+async def async_fetch_shard(
+    tasks: List[Task],
+) -> Tuple[ClassificationBatch, List[Task], List[Tuple[Task, TaskStatus]]]:
+    results = await asyncio.gather(*[fetch_results(task) for task in tasks])
+
+    batch = ClassificationBatch()
+    fetched = []
+    failed = []
+    for task, (rows, status) in zip(tasks, results):
+        if rows is None:
+            failed.append((task, status))
+            continue
+
+        batch.add(
+            task.season_id, task.event_id, task.category_id, task.session_id, rows
+        )
+        fetched.append(task)
+
+    return batch, fetched, failed
+
+
+def fetch_shard(tasks: List[Task]):
+    # runs in a worker process, the batch goes back to the coordinator as
+    # plain column lists, without its key index, with the metrics of the shard
+    batch, fetched, failed = _loop.run_until_complete(async_fetch_shard(tasks))
+    return batch.facts, batch.riders, fetched, failed, get_metrics().drain()
+
+
+# claims tasks and hands shards to a process pool, the only writer of results
+class Coordinator:
+    def __init__(
+        self,
+        processes: int = None,
+        archive_path: str = ARCHIVE_PATH,
+        replay: bool = False,
+        write_rows: int = WRITE_BATCH_ROWS,
+        metrics_path: str = None,
+        refresh: bool = False,
+    ):
+        self.processes = processes if processes else os.cpu_count()
+        self.archive_path = archive_path
+        self.replay = replay
+        self.metrics_path = metrics_path
+        self.refresh = refresh
+        self.write_rows = write_rows
+        self.worker_id = new_worker_id()
+        self.recorder = StatusRecorder()
+        self.logger = setup_logger("consumer")
+
+    def pool(self) -> ProcessPoolExecutor:
+        # spawned, not forked, so no process inherits open database handles
+        return ProcessPoolExecutor(
+            max_workers=self.processes,
+            mp_context=multiprocessing.get_context("spawn"),
+            initializer=setup_worker,
+            initargs=(
+                self.processes,
+                self.archive_path,
+                self.replay,
+                self.metrics_path,
+                self.refresh,
+            ),
+        )
+
+    async def run(self, limit: int = 0) -> int:
+        loop = asyncio.get_running_loop()
+        heartbeats = asyncio.create_task(heartbeat(self.worker_id))
+        recorders = asyncio.create_task(self.recorder.run())
+
+        claimed = 0
+        pending = set()
+        merged, tasks = ClassificationBatch(), []
+        try:
+            with self.pool() as pool:
+                while True:
+                    while len(pending) < self.processes * SHARDS_PER_PROCESS and (
+                        limit <= 0 or claimed < limit
+                    ):
+                        size = (
+                            SHARD_SIZE
+                            if limit <= 0
+                            else min(SHARD_SIZE, limit - claimed)
+                        )
+                        queue = await asyncio.to_thread(
+                            TaskQueue.claim, self.worker_id, size
+                        )
+                        if queue.size == 0:
+                            break
+
+                        claimed += queue.size
+                        for shard in shard_tasks(queue.tasks):
+                            pending.add(loop.run_in_executor(pool, fetch_shard, shard))
+
+                    if not pending:
+                        await asyncio.to_thread(write, merged, tasks, self.recorder)
+                        merged, tasks = ClassificationBatch(), []
+                        if not await self.wait_for_retries(limit, claimed):
+                            break
+                        continue
+
+                    done, pending = await asyncio.wait(
+                        pending, return_when=asyncio.FIRST_COMPLETED
+                    )
+                    for future in done:
+                        facts, riders, fetched, failed, metrics = future.result()
+                        get_metrics().merge(metrics)
+                        merged.extend(facts, riders)
+                        tasks.extend(fetched)
+                        for task, status in failed:
+                            self.recorder.record(task, status)
+
+                    if merged.size >= self.write_rows:
+                        await asyncio.to_thread(write, merged, tasks, self.recorder)
+                        merged, tasks = ClassificationBatch(), []
+        finally:
+            heartbeats.cancel()
+            recorders.cancel()
+            await asyncio.to_thread(self.recorder.flush)
+
+        return claimed
+
+    async def wait_for_retries(self, limit: int, claimed: int) -> bool:
+        # true once errored tasks are due again, false when there is nothing
+        # left to claim soon
+        if limit > 0 and claimed >= limit:
+            return False
+
+        await asyncio.to_thread(self.recorder.flush)
+        retry_at = await asyncio.to_thread(TaskQueue.next_attempt_timestamp)
+        if retry_at is None or retry_at - time.time() > MAX_RETRY_WAIT:
+            return False
+
+        self.logger.info("waiting for retries due at: %s", retry_at)
+        await asyncio.sleep(max(retry_at - time.time(), 0))
+        return True
+
+
+async def main(
+    limit: int, processes: int = None, replay: bool = False, refresh: bool = False
+):
+    logger = setup_logger("consumer")
+    logger.info("started consumer with %s processes", processes or os.cpu_count())
+
+    setup_metrics()
+    try:
+        coordinator = Coordinator(
+            processes, replay=replay, metrics_path=METRICS_FILE, refresh=refresh
+        )
+        logger.info("consumer worker_id: %s", coordinator.worker_id)
+        await coordinator.run(limit)
+
+        export()
+    finally:
+        close_connections()
+        close_metrics()
+
+    logger.info("finished consumer")
+
+
+if __name__ == "__main__":
+    args = []
+    file, limit, *args = sys.argv
+    replay = "replay" in args
+    # full runs fetch every classification again instead of trusting the cache
+    refresh = "full" in args
+    processes = [int(a) for a in args if a.isdigit()]
+    asyncio.run(
+        main(
+            limit=int(limit),
+            processes=processes[0] if processes else None,
+            replay=replay,
+            refresh=refresh,
+        )
+    )